@@ -0,0 +1,7 @@
+"""
+bench
+~~~~~~~~~~~~~~~~~
+
+Benchmarks and load generators for the tracker and the peers. Run them from
+the repository root, e.g. ``python -m bench.wal_recovery``.
+"""
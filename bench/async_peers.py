@@ -0,0 +1,100 @@
+"""
+bench.async_peers
+~~~~~~~~~~~~~~~~~
+
+Hosts many :class:`peer.AsyncPeer` instances on one event loop in a single
+process, against a real tracker:
+
+- setup: every peer starts its listener and registers;
+- messaging: every peer sends ``--messages`` direct messages, round-robin
+  over ``--contacts`` peers picked at random;
+- storm: one peer broadcasts to all the others at once.
+
+The thread count is reported after each phase: it stays flat however many
+peers and connections there are, where the threaded ``Peer`` needs one
+thread per incoming connection.
+
+Usage::
+
+    python tracker.py --engine async --quiet --no-rate-limit --port 9000 &
+    python -m bench.async_peers --port 9000 --peers 500 --messages 20
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import threading
+import time
+
+
+def raise_nofile_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+async def run(args, report):
+    from peer import AsyncPeer
+    peers = [AsyncPeer(f"sim-{args.base_port + i}", args.base_port + i, args.host, args.port, ip='127.0.0.1')
+             for i in range(args.peers)]
+    try:
+        started = time.perf_counter()
+        for peer in peers:
+            await peer.start_listener()
+        registered = await asyncio.gather(*(p._send_register() for p in peers))
+        report(f"setup    : {args.peers} peers in {time.perf_counter() - started:.2f}s, "
+               f"{sum(r.startswith('ACK') for r in registered)} registered, threads {threading.active_count()}")
+
+        names = [p.username for p in peers]
+        rng = random.Random(1)
+
+        async def chat(peer):
+            contacts = rng.sample([n for n in names if n != peer.username], min(args.contacts, len(names) - 1))
+            results = []
+            for i in range(args.messages):
+                target = contacts[i % len(contacts)]
+                results.append(await peer.send_message(target, f"hello from {peer.username}", queue=False))
+            return results
+
+        started = time.perf_counter()
+        results = [r for rs in await asyncio.gather(*(chat(p) for p in peers)) for r in rs]
+        elapsed = time.perf_counter() - started
+        report(f"messaging: {len(results)} messages in {elapsed:.2f}s = {len(results) / elapsed:.0f} msg/s, "
+               f"delivered {sum(results)}, threads {threading.active_count()}")
+
+        started = time.perf_counter()
+        outcome = await peers[0].broadcast_message("storm", deadline=30.0, max_workers=args.peers)
+        elapsed = time.perf_counter() - started
+        delivered = sum(r == 'delivered' for r in outcome.values())
+        report(f"storm    : broadcast to {len(outcome)} peers in {elapsed:.2f}s, delivered {delivered}, "
+               f"threads {threading.active_count()}")
+    finally:
+        for peer in peers:
+            await peer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy nhiều AsyncPeer trong một process")
+    parser.add_argument('--host', default='127.0.0.1', help="Host tracker")
+    parser.add_argument('--port', type=int, default=9000, help="Port tracker")
+    parser.add_argument('--base-port', type=int, default=20000, help="Port P2P của peer đầu tiên")
+    parser.add_argument('--peers', type=int, default=200, help="Số peers mô phỏng")
+    parser.add_argument('--messages', type=int, default=20, help="Số tin mỗi peer gửi")
+    parser.add_argument('--contacts', type=int, default=5, help="Số peers khác mỗi peer nhắn tin tới")
+    args = parser.parse_args()
+
+    raise_nofile_limit()
+    lines = []
+    # Peers in log cho từng tin; chỉ giữ lại kết quả đo
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(run(args, lines.append))
+    for line in lines:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
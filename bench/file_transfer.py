@@ -0,0 +1,128 @@
+"""
+bench.file_transfer
+~~~~~~~~~~~~~~~~~
+
+Measures the chunked file transfer of :mod:`p2p.filexfer` on loopback,
+against the listener of a real :class:`peer.Peer` (no tracker needed):
+
+- link: ``socket.sendfile`` of the test file to a sink that discards it,
+  the most the loopback link can carry;
+- transfer: the same file sent with :func:`p2p.filexfer.send_file`
+  (checksummed, written to disk by the receiving peer), as a share of link;
+- resume: a transfer cut after half the file, then offered again: it goes
+  on from the last verified chunk instead of byte 0.
+
+The peak memory of the process is reported last: it stays a few chunks
+above the interpreter's, however large the file, since neither side ever
+loads the file.
+
+Usage::
+
+    python -m bench.file_transfer --size 512 --chunk-size 1024
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import socket
+import tempfile
+import threading
+import time
+
+
+def make_file(path, size):
+    block = os.urandom(1 << 20)
+    with open(path, 'wb') as f:
+        for _ in range(size >> 20):
+            f.write(block)
+        f.write(block[:size & ((1 << 20) - 1)])
+
+
+def sink(server):
+    # Nhận và bỏ dữ liệu, dùng chung một buffer
+    buffer = bytearray(1 << 20)
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            while conn.recv_into(buffer):
+                pass
+
+
+def link_speed(path, size):
+    server = socket.create_server(('127.0.0.1', 0))
+    threading.Thread(target=sink, args=(server,), daemon=True).start()
+    started = time.perf_counter()
+    with socket.create_connection(server.getsockname()) as sock, open(path, 'rb') as f:
+        sock.sendfile(f)
+        sock.shutdown(socket.SHUT_WR)
+        sock.recv(1)  # chờ sink đọc hết
+    return size / (time.perf_counter() - started)
+
+
+def cut_transfer(addr, offer, path, nbytes):
+    """Bắt đầu gửi file rồi ngắt kết nối sau nbytes (mô phỏng mất mạng)."""
+    with socket.create_connection(addr) as sock, open(path, 'rb') as f:
+        sock.sendall(b'FILE:' + json.dumps(offer).encode('utf-8') + b'\n')
+        reply = b''
+        while not reply.endswith(b'\n'):
+            reply += sock.recv(1)
+        sock.sendfile(f, 0, nbytes)
+    time.sleep(0.5)  # để receiver lưu trạng thái
+
+
+def max_rss_mb():
+    # ru_maxrss: KB trên Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(args, report):
+    from p2p.filexfer import make_offer, send_file
+    from peer import Peer
+
+    size = args.size << 20
+    chunk_size = args.chunk_size << 10
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'payload.bin')
+        make_file(path, size)
+        receiver = Peer('bench-recv', args.port, download_dir=os.path.join(tmp, 'downloads'))
+        addr = ('127.0.0.1', args.port)
+        receiver.start_listener()
+        time.sleep(0.2)
+
+        link = link_speed(path, size)
+        report(f"link     : {args.size} MB in {size / link:.2f}s = {link / (1 << 20):.0f} MB/s (sendfile -> sink)")
+
+        offer = make_offer(path, 'bench-send', chunk_size)
+        result = send_file(addr, path, 'bench-send', chunk_size, offer=offer)
+        speed = result['sent'] / result['seconds']
+        report(f"transfer : {args.size} MB in {result['seconds']:.2f}s = {speed / (1 << 20):.0f} MB/s "
+               f"({100 * speed / link:.0f}% of link), chunk {args.chunk_size} KB")
+
+        os.remove(os.path.join(tmp, 'downloads', 'payload.bin'))
+        cut_transfer(addr, offer, path, size // 2)
+        result = send_file(addr, path, 'bench-send', chunk_size, offer=offer)
+        report(f"resume   : cut at {size // 2} bytes, resumed from {result['resumed_from']}, "
+               f"sent {result['sent']} of {size} bytes")
+        receiver.running = False
+
+    report(f"memory   : peak RSS {max_rss_mb():.0f} MB for a {args.size} MB file")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo tốc độ gửi file giữa hai peers qua loopback")
+    parser.add_argument('--size', type=int, default=256, help="Kích thước file thử (MB)")
+    parser.add_argument('--chunk-size', type=int, default=1024, help="Kích thước chunk (KB)")
+    parser.add_argument('--port', type=int, default=29500, help="Port P2P của peer nhận")
+    args = parser.parse_args()
+
+    lines = []
+    # Peer nhận in log cho từng file; chỉ giữ lại kết quả đo
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        run(args, lines.append)
+    for line in lines:
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
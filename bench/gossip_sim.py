@@ -0,0 +1,105 @@
+"""
+bench.gossip_sim
+~~~~~~~~~~~~~~~~~
+
+In-process simulation of one broadcast over N peers, comparing direct
+fan-out (the sender uploads N-1 copies) with gossip (:mod:`p2p.gossip`).
+
+Every peer has an upload link: sending one copy occupies it for
+``size / bandwidth`` seconds, and a copy then travels for a random network
+latency. Each simulated peer runs the real :class:`p2p.gossip.Gossip` state
+(dedup, TTL, random targets), driven by an event queue instead of sockets.
+
+Reported per mode (averaged over ``--trials``):
+
+- coverage: fraction of the other peers that received the message;
+- redundancy: copies sent per peer reached (1.0 is ideal);
+- full delivery: time until the last reached peer got the message;
+- max upload: most copies sent by a single peer.
+
+Usage::
+
+    python -m bench.gossip_sim --peers 100 500 2000 --fanout 0
+"""
+import argparse
+import heapq
+import math
+import random
+
+from p2p.gossip import Gossip
+
+
+def simulate_direct(n, tx, latency, rng):
+    arrivals = [(i + 1) * tx + rng.uniform(*latency) for i in range(n - 1)]
+    return {'coverage': 1.0, 'redundancy': 1.0, 'full': max(arrivals), 'max_upload': n - 1}
+
+
+def simulate_gossip(n, fanout, ttl, tx, latency, rng):
+    names = [f"p{i}" for i in range(n)]
+    nodes = {name: Gossip(fanout=fanout, ttl=ttl, rng=random.Random(rng.random())) for name in names}
+    busy = dict.fromkeys(names, 0.0)
+    uploads = dict.fromkeys(names, 0)
+    events = []
+    seq = 0
+
+    def send(now, sender, message, exclude):
+        nonlocal seq
+        for target in nodes[sender].targets(names, exclude):
+            busy[sender] = max(busy[sender], now) + tx
+            uploads[sender] += 1
+            seq += 1
+            heapq.heappush(events, (busy[sender] + rng.uniform(*latency), seq, target, message))
+
+    origin = names[0]
+    first = nodes[origin].originate(origin, 'hello')
+    send(0.0, origin, first, (origin,))
+    received = {}
+    while events:
+        now, _, target, message = heapq.heappop(events)
+        deliver, forward = nodes[target].receive(message)
+        if not deliver:
+            continue
+        received[target] = now
+        if forward is not None:
+            send(now, target, dict(forward, relay=target), (target, message['sender'], message['relay']))
+    sent = sum(uploads.values())
+    return {'coverage': len(received) / (n - 1),
+            'redundancy': sent / max(1, len(received)),
+            'full': max(received.values(), default=0.0),
+            'max_upload': max(uploads.values())}
+
+
+def average(results):
+    return {k: sum(r[k] for r in results) / len(results) for k in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mô phỏng gossip so với gửi trực tiếp tới mọi peer")
+    parser.add_argument('--peers', type=int, nargs='+', default=[100, 500, 2000], help="Số peers")
+    parser.add_argument('--fanout', type=int, default=0, help="Số peers mỗi lần chuyển tiếp (0 = ln(N) + 2)")
+    parser.add_argument('--ttl', type=int, default=0, help="Số hop tối đa (0 = tự tính theo fanout)")
+    parser.add_argument('--size', type=int, default=1024, help="Kích thước tin nhắn (byte)")
+    parser.add_argument('--bandwidth', type=float, default=1e6, help="Băng thông upload mỗi peer (byte/s)")
+    parser.add_argument('--latency', type=float, nargs=2, default=[0.005, 0.05],
+                        help="Độ trễ mạng min max (giây)")
+    parser.add_argument('--trials', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tx = args.size / args.bandwidth
+    print(f"{'peers':>6} {'mode':<22} {'coverage':>9} {'redundancy':>10} {'full delivery':>14} {'max upload':>10}")
+    for n in args.peers:
+        fanout = args.fanout or int(math.log(n)) + 2
+        ttl = args.ttl or math.ceil(math.log(n) / math.log(fanout)) + 3
+        modes = [('direct', lambda: simulate_direct(n, tx, args.latency, rng)),
+                 (f"gossip k={fanout} ttl={ttl}",
+                  lambda: simulate_gossip(n, fanout, ttl, tx, args.latency, rng))]
+        for name, run in modes:
+            r = average([run() for _ in range(args.trials)])
+            print(f"{n:>6} {name:<22} {r['coverage']:>9.4f} {r['redundancy']:>10.2f} "
+                  f"{r['full'] * 1000:>12.1f}ms {r['max_upload']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
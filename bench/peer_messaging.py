@@ -0,0 +1,109 @@
+"""
+bench.peer_messaging
+~~~~~~~~~~~~~~~~~
+
+Compares peer-to-peer message throughput of three transports against a
+receiving peer running its normal listener in a separate process:
+
+- unpooled: one connection per message (the original ``send_message``);
+- pooled: long-lived connections, one line and one ACK per message
+  (:mod:`p2p.connpool`);
+- framed: long-lived framed streams with batching and windowed ACKs
+  (:mod:`p2p.peerwire`); every sender queues all its messages, then waits.
+
+Usage::
+
+    python -m bench.peer_messaging --messages 5000 --senders 4
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from p2p.connpool import ConnectionPool
+from p2p.peerwire import StreamPool
+
+
+def run_receiver(port, ready):
+    from peer import Peer
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        peer = Peer('bench-receiver', port)
+        peer.start_listener()
+        ready.set()
+        while True:
+            time.sleep(1)
+
+
+def message(sender, i):
+    data = {'time': '', 'sender': sender, 'msg': f"message {i}"}
+    return f"MESSAGE:{json.dumps(data)}\n".encode('utf-8')
+
+
+def send_unpooled(addr, line):
+    sock = socket.create_connection(addr, timeout=5.0)
+    try:
+        sock.sendall(line)
+        return sock.recv(1024).decode('utf-8').strip()
+    finally:
+        sock.close()
+
+
+def run(addr, senders, count, mode):
+    pool = ConnectionPool()
+    streams = StreamPool()
+    failures = []
+
+    def sender(index):
+        if mode == 'framed':
+            futures = [streams.send(addr, message(f"sender-{index}", i).rstrip(b'\n')) for i in range(count)]
+            failures.extend(f for f in futures if not f.result(timeout=30))
+            return
+        for i in range(count):
+            line = message(f"sender-{index}", i)
+            reply = pool.request(addr, line) if mode == 'pooled' else send_unpooled(addr, line)
+            if not reply.startswith('ACK'):
+                failures.append(reply)
+
+    threads = [threading.Thread(target=sender, args=(i,)) for i in range(senders)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    connects = {'unpooled': senders * count, 'pooled': pool.stats['connects'], 'framed': len(streams.streams)}
+    frames = sum(s.stats['frames'] for s in streams.streams.values())
+    pool.close()
+    streams.close()
+    return elapsed, len(failures), connects[mode], frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh gửi tin P2P: mỗi tin một kết nối, pool, framed")
+    parser.add_argument('--port', type=int, default=9700, help="Port của peer nhận")
+    parser.add_argument('--messages', type=int, default=2000, help="Số tin mỗi sender")
+    parser.add_argument('--senders', type=int, default=4, help="Số thread gửi đồng thời")
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    receiver = multiprocessing.Process(target=run_receiver, args=(args.port, ready), daemon=True)
+    receiver.start()
+    ready.wait(10)
+    addr = ('127.0.0.1', args.port)
+    total = args.messages * args.senders
+    try:
+        for mode in ('unpooled', 'pooled', 'framed'):
+            elapsed, failures, connects, frames = run(addr, args.senders, args.messages, mode)
+            batching = f", frames {frames}" if mode == 'framed' else ""
+            print(f"{mode:<8}: {total} messages in {elapsed:.2f}s = {total / elapsed:.0f} msg/s, "
+                  f"failures {failures}, connections {connects}{batching}")
+    finally:
+        receiver.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+bench.tracker_load
+~~~~~~~~~~~~~~~~~
+
+Load generator for the tracker: many concurrent connections, each keeping a
+window of pipelined framed commands in flight, spread over several
+processes so the generator is not the bottleneck.
+
+Usage::
+
+    python tracker.py --engine async --quiet --no-rate-limit --port 9000 &
+    python -m bench.tracker_load --port 9000 --processes 4 --connections 64
+
+With ``--legacy`` every command opens its own connection (the pre-framing
+protocol), which shows how the listen backlog copes with connect bursts.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+
+from p2p.protocol import FrameDecoder, encode_frame
+
+
+async def framed_worker(host, port, deadline, depth, lookup_ratio, prefix, counts, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    decoder = FrameDecoder()
+    names = []
+    next_id = 1
+    loop = asyncio.get_running_loop()
+    try:
+        while loop.time() < deadline:
+            frames = []
+            for _ in range(depth):
+                if names and random.random() < lookup_ratio:
+                    command = f"LOOKUP:{random.choice(names)}"
+                else:
+                    name = f"{prefix}-{next_id}"
+                    names.append(name)
+                    command = f"REGISTER:{name}:127.0.0.1:{1024 + next_id % 60000}"
+                frames.append(encode_frame(next_id, command))
+                next_id += 1
+            started = loop.time()
+            writer.write(b''.join(frames))
+            received = 0
+            while received < depth:
+                data = await reader.read(65536)
+                if not data:
+                    raise ConnectionError("tracker closed the connection")
+                decoder.feed(data)
+                for _, payload in decoder.frames():
+                    received += 1
+                    if payload.startswith(b'NAK'):
+                        counts['errors'] += 1
+            latencies.append(loop.time() - started)
+            counts['ops'] += depth
+    finally:
+        writer.close()
+
+
+async def legacy_worker(host, port, deadline, lookup_ratio, prefix, counts, latencies):
+    loop = asyncio.get_running_loop()
+    i = 0
+    while loop.time() < deadline:
+        i += 1
+        if i > 1 and random.random() < lookup_ratio:
+            command = f"LOOKUP:{prefix}-{random.randrange(1, i)}"
+        else:
+            command = f"REGISTER:{prefix}-{i}:127.0.0.1:{1024 + i % 60000}"
+        started = loop.time()
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(command.encode('utf-8'))
+            await reader.read(2048)
+            writer.close()
+            counts['ops'] += 1
+            latencies.append(loop.time() - started)
+        except OSError:
+            counts['refused'] += 1
+
+
+def run_process(args, index):
+    async def main():
+        counts = {'ops': 0, 'errors': 0, 'refused': 0}
+        latencies = []
+        deadline = asyncio.get_running_loop().time() + args.duration
+        workers = []
+        for c in range(args.connections):
+            prefix = f"load{os.getpid()}-{index}-{c}"
+            if args.legacy:
+                workers.append(legacy_worker(args.host, args.port, deadline, args.lookups, prefix,
+                                             counts, latencies))
+            else:
+                workers.append(framed_worker(args.host, args.port, deadline, args.depth, args.lookups,
+                                             prefix, counts, latencies))
+        results = await asyncio.gather(*workers, return_exceptions=True)
+        counts['failed'] = sum(isinstance(r, Exception) for r in results)
+        return counts, latencies
+    return asyncio.run(main())
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator cho tracker")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--processes', type=int, default=4, help="Số process sinh tải")
+    parser.add_argument('--connections', type=int, default=32, help="Số kết nối mỗi process")
+    parser.add_argument('--depth', type=int, default=32, help="Số lệnh pipeline mỗi lượt trên một kết nối")
+    parser.add_argument('--duration', type=float, default=10.0, help="Thời gian chạy (giây)")
+    parser.add_argument('--lookups', type=float, default=0.8, help="Tỉ lệ LOOKUP (còn lại là REGISTER)")
+    parser.add_argument('--legacy', action='store_true', help="Một kết nối cho mỗi lệnh (giao thức text cũ)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(run_process, [(args, i) for i in range(args.processes)])
+    elapsed = time.perf_counter() - started
+
+    ops = sum(c['ops'] for c, _ in results)
+    latencies = [l for _, ls in results for l in ls]
+    print(f"{ops} ops in {elapsed:.1f}s: {ops / elapsed:.0f} ops/s")
+    print(f"errors {sum(c['errors'] for c, _ in results)}, "
+          f"refused {sum(c['refused'] for c, _ in results)}, "
+          f"failed connections {sum(c['failed'] for c, _ in results)}")
+    unit = "command" if args.legacy else f"batch of {args.depth}"
+    print(f"latency per {unit}: p50 {percentile(latencies, 0.5) * 1000:.2f}ms "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
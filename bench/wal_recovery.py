@@ -0,0 +1,106 @@
+"""
+bench.wal_recovery
+~~~~~~~~~~~~~~~~~
+
+Measures how long the tracker takes to recover its registry from the
+write-ahead log (see :mod:`p2p.wal`), with and without a snapshot, and how
+well group commit batches concurrent registrations into fsyncs.
+
+Usage::
+
+    python -m bench.wal_recovery --count 1000000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from p2p.wal import RegistryLog
+
+
+def write_log(data_dir, count, start=0, snapshot_at=None):
+    """Appends count join records (no fsync) and optionally snapshots at a version."""
+    log = RegistryLog(data_dir, fsync=False)
+    version, peers = log.recover()
+    for i in range(start, start + count):
+        version += 1
+        log.append(version, 'J', f"user{i:07d}", ('10.0.%d.%d' % (i >> 8 & 255, i & 255), 1024 + i % 60000))
+        if snapshot_at is not None and version == snapshot_at:
+            snapshot = {f"user{j:07d}": ('10.0.%d.%d' % (j >> 8 & 255, j & 255), 1024 + j % 60000)
+                        for j in range(i + 1)}
+            log.rotate(version)
+            log.write_snapshot(version, snapshot)
+    log.close()
+    return version
+
+
+def time_recovery(data_dir):
+    started = time.perf_counter()
+    log = RegistryLog(data_dir, fsync=False)
+    version, peers = log.recover()
+    elapsed = time.perf_counter() - started
+    log.close()
+    return elapsed, version, len(peers)
+
+
+def group_commit(data_dir, writers, per_writer):
+    """Concurrent writers each waiting for durability; returns (records/s, records per fsync)."""
+    log = RegistryLog(data_dir)
+    log.recover()
+    lock = threading.Lock()
+    counter = [0]
+
+    def writer(w):
+        for i in range(per_writer):
+            with lock:
+                counter[0] += 1
+                seq = log.append(counter[0], 'J', f"w{w}-{i}", ('127.0.0.1', 2000))
+            log.wait(seq)
+
+    threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stats = log.stats()
+    log.close()
+    return stats['records'] / elapsed, stats['records'] / max(1, stats['fsyncs'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WAL recovery của tracker")
+    parser.add_argument('--count', type=int, default=1000000, help="Số registrations")
+    parser.add_argument('--tail', type=float, default=0.1,
+                        help="Tỉ lệ bản ghi sau snapshot trong kịch bản snapshot + tail")
+    parser.add_argument('--writers', type=int, default=64, help="Số writer cho group commit")
+    parser.add_argument('--dir', default=None, help="Thư mục tạm (mặc định: tempfile)")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='wal-bench-', dir=args.dir)
+    try:
+        log_only = os.path.join(root, 'log-only')
+        started = time.perf_counter()
+        write_log(log_only, args.count)
+        print(f"write {args.count} records: {time.perf_counter() - started:.2f}s")
+        elapsed, version, peers = time_recovery(log_only)
+        print(f"recover log only:        {elapsed:.2f}s  ({peers} peers, version {version})")
+
+        snap = os.path.join(root, 'snapshot-tail')
+        tail = int(args.count * args.tail)
+        write_log(snap, args.count, snapshot_at=args.count - tail)
+        elapsed, version, peers = time_recovery(snap)
+        print(f"recover snapshot + {tail} tail: {elapsed:.2f}s  ({peers} peers, version {version})")
+
+        rate, batch = group_commit(os.path.join(root, 'group'), args.writers, 200)
+        print(f"group commit, {args.writers} writers: {rate:.0f} durable records/s, "
+              f"{batch:.1f} records per fsync")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
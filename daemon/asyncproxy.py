@@ -0,0 +1,537 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.asyncproxy
+~~~~~~~~~~~~~~~~~
+
+This module implements an asyncio engine for the proxy server. Instead of
+spawning a thread per client, every client and upstream socket is multiplexed
+on a single event loop, so the number of concurrent proxied connections is
+bounded by file descriptors rather than by the thread limit.
+
+The routing semantics are the same as :mod:`daemon.proxy`: the Host header is
+resolved through `resolve_routing_policy` against the routes built by
+`parse_virtual_hosts`, and unreachable backends produce a 404 response.
+
+Requirement:
+-----------------
+- asyncio: event loop and stream based socket handling.
+- resource: (optional, POSIX only) raises the open file limit.
+- proxy: shared routing helpers of the threaded engine.
+- coalesce: single-flight coalescing of identical upstream GETs.
+- resilience: timeouts, retry budget and hedging of upstream attempts.
+- metrics: per-host and per-upstream statistics and the access log.
+"""
+import asyncio
+import time
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+from .proxy import (
+    ACCESS_LOG, CACHE, ERROR_RESPONSES, METRICS, NOT_FOUND, VARY, apply_proxy_headers,
+    current_routes, find_upstream, resolve_routing_policy, select_upstream,
+)
+from .metrics import status_of
+from .proxyconf import DEFAULT_ROUTE, RoutingTable
+from .resilience import IDEMPOTENT_METHODS, Deadline, UpstreamError, policy_for, request_method
+from .coalesce import AsyncSingleFlight, request_key, response_policy
+
+#: Maximum size of a request head (request line and headers).
+MAX_HEADER_SIZE = 65536
+
+#: Size of the chunks relayed from the upstream to the client.
+RELAY_CHUNK_SIZE = 65536
+
+#: Default listen backlog of the asyncio engine.
+DEFAULT_BACKLOG = 4096
+
+#: Upstream fetches shared by concurrent identical GETs on this event loop.
+FLIGHTS = AsyncSingleFlight()
+METRICS.sources["coalesced_async"] = lambda: FLIGHTS.coalesced
+
+
+def raise_nofile_limit():
+    """
+    Raises the soft limit of open file descriptors up to the hard limit.
+
+    Each proxied connection holds two sockets, so the default soft limit
+    (often 1024) is reached long before the event loop is saturated.
+
+    :rtype int: the resulting soft limit, or -1 if it cannot be queried.
+    """
+    if resource is None:
+        return -1
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError) as e:
+            print("[AsyncProxy] Cannot raise open file limit: {}".format(e))
+    return soft
+
+
+def extract_hostname(head):
+    """
+    Extracts the Host header value from a raw request head.
+
+    :params head (str): request line and headers.
+    :rtype str: hostname, or an empty string if the header is missing.
+    """
+    for line in head.split('\r\n')[1:]:
+        if line.lower().startswith('host:'):
+            return line.split(':', 1)[1].strip()
+    return ''
+
+
+def content_length(head):
+    """
+    Returns the Content-Length declared in a raw request head.
+
+    :params head (str): request line and headers.
+    :rtype int: body length, 0 if absent or invalid.
+    """
+    for line in head.split('\r\n')[1:]:
+        if line.lower().startswith('content-length:'):
+            try:
+                return max(0, int(line.split(':', 1)[1].strip()))
+            except ValueError:
+                return 0
+    return 0
+
+
+async def read_request(reader):
+    """
+    Reads one complete HTTP request (head and body) from the client stream.
+
+    :params reader (asyncio.StreamReader): client stream.
+    :rtype bytes: the raw request, or empty bytes if the client went away.
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError:
+        return b''
+    length = content_length(head.decode('latin-1'))
+    body = b''
+    if length:
+        try:
+            body = await reader.readexactly(length)
+        except asyncio.IncompleteReadError as e:
+            body = e.partial
+    return head + body
+
+
+class Attempt:
+    """
+    An upstream connection that has already produced its first bytes.
+
+    :attrs upstream (Upstream): backend server answering the request.
+    :attrs first (bytes): first chunk of the response.
+    :attrs ttfb (float): time to first byte in seconds.
+    """
+
+    def __init__(self, upstream, reader, writer, first, started, connect, ttfb, sent, slot):
+        self.upstream = upstream
+        self.reader = reader
+        self.writer = writer
+        self.first = first
+        self.started = started
+        self.connect = connect
+        self.ttfb = ttfb
+        self.sent = sent
+        self.received = len(first)
+        self.slot = slot
+
+    def close(self, error=False):
+        """Closes the upstream connection and records the attempt."""
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        if self.slot is not None:
+            self.slot.release()
+            self.slot = None
+        METRICS.record_upstream(
+            "{}:{}".format(self.upstream.host, self.upstream.port), status_of(self.first),
+            self.received, self.sent, self.connect, self.ttfb,
+            time.monotonic() - self.started, error)
+
+
+async def open_attempt(upstream, request, policy, deadline):
+    """
+    Connects to an upstream, sends the request and waits for the first bytes
+    of the response, within the route's connect and read timeouts.
+
+    :params upstream (Upstream): backend server.
+    :params request (bytes): raw HTTP request.
+    :params policy (RoutePolicy): runtime state of the route.
+    :params deadline (Deadline): total time budget of the request.
+    :rtype Attempt: the connected attempt.
+    :raises UpstreamError: if the attempt failed.
+    """
+    name = "{}:{}".format(upstream.host, upstream.port)
+    slot = policy.slot(upstream, asyncio.Semaphore)
+    if slot is not None:
+        try:
+            await asyncio.wait_for(slot.acquire(), deadline.clamp(policy.connect_timeout))
+        except asyncio.TimeoutError:
+            METRICS.record_upstream(name, 503, 0, 0, error=True)
+            raise UpstreamError(503, "connection pool of {} exhausted".format(name))
+    writer = None
+    started = time.monotonic()
+    connect = None
+    try:
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(upstream.host, upstream.port),
+                deadline.clamp(policy.connect_timeout))
+        except asyncio.TimeoutError:
+            raise UpstreamError(504, "connect to {} timed out".format(name))
+        except OSError as e:
+            raise UpstreamError(404, "connect to {} failed: {}".format(name, e))
+        connect = time.monotonic() - started
+        try:
+            writer.write(request)
+            await writer.drain()
+            first = await asyncio.wait_for(reader.read(RELAY_CHUNK_SIZE),
+                                           deadline.clamp(policy.read_timeout))
+        except asyncio.TimeoutError:
+            raise UpstreamError(504, "read from {} timed out".format(name))
+        except OSError as e:
+            raise UpstreamError(502, "read from {} failed: {}".format(name, e))
+        return Attempt(upstream, reader, writer, first, started, connect,
+                       time.monotonic() - started, len(request), slot)
+    except BaseException as e:
+        # Failed or cancelled (e.g. the losing side of a hedge)
+        if writer is not None:
+            writer.close()
+        if slot is not None:
+            slot.release()
+        if isinstance(e, UpstreamError):
+            METRICS.record_upstream(name, e.status, 0, len(request), connect, None,
+                                    time.monotonic() - started, error=True)
+        raise
+
+
+async def hedged_open(route, version, policy, upstream, request, deadline, delay):
+    """
+    Opens an attempt on one upstream and, if it has not answered after
+    ``delay`` seconds, a second one on another upstream. The first attempt to
+    produce bytes wins and the other one is cancelled.
+
+    :rtype tuple: (Attempt, upstreams tried).
+    :raises UpstreamError: if every attempt failed.
+    """
+    tried = [upstream]
+    tasks = {asyncio.ensure_future(open_attempt(upstream, request, policy, deadline))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=deadline.clamp(delay))
+        if not done:
+            second = select_upstream(route, version, exclude=tried)
+            if second is not None and policy.budget.withdraw():
+                print("[AsyncProxy] Hedging {} to {}:{}".format(route.host, second.host, second.port))
+                tried.append(second)
+                tasks.add(asyncio.ensure_future(open_attempt(second, request, policy, deadline)))
+
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(
+                tasks, timeout=deadline.clamp(None), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise UpstreamError(504, "request deadline exceeded")
+            for task in done:
+                if task.exception() is None:
+                    winner = task.result()
+                    for other in done - {task}:
+                        if other.exception() is None:
+                            other.result().close()
+                    return winner, tried
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                task.result().close()
+            else:
+                task.cancel()
+
+
+async def open_resilient(route, version, host, port, request):
+    """
+    Opens the upstream connection of a request under the route's resilience
+    policy: timeouts, retries of idempotent requests against a different
+    upstream within the retry budget, and optional hedging after the p95
+    time to first byte. Retries happen only before any byte was relayed.
+
+    :params route (Route): compiled route of the host.
+    :params version (int): version of the routing table.
+    :params host (str): IP address of the first backend server.
+    :params port (int): port number of the first backend server.
+    :params request (bytes): raw HTTP request.
+    :rtype tuple: (Attempt, RoutePolicy, Deadline).
+    :raises UpstreamError: if every attempt failed.
+    """
+    policy = policy_for(route, version)
+    policy.budget.deposit()
+    deadline = Deadline(route.timeout)
+    idempotent = request_method(request) in IDEMPOTENT_METHODS
+    upstream = find_upstream(route, host, port)
+    tried = []
+    attempts = 0
+
+    while True:
+        attempts += 1
+        try:
+            delay = policy.latency.percentile() if route.hedge and idempotent else None
+            if delay is not None and len(route.upstreams) > 1:
+                attempt, used = await hedged_open(
+                    route, version, policy, upstream, request, deadline, delay)
+                tried.extend(used)
+            else:
+                tried.append(upstream)
+                attempt = await open_attempt(upstream, request, policy, deadline)
+            policy.latency.record(attempt.ttfb)
+            return attempt, policy, deadline
+        except UpstreamError as e:
+            print("[AsyncProxy] Upstream error for {}: {}".format(route.host or host, e))
+            error = e
+        if not idempotent or attempts > route.retries or deadline.expired():
+            raise error
+        upstream = select_upstream(route, version, exclude=tried)
+        if upstream is None or not policy.budget.withdraw():
+            raise error
+        print("[AsyncProxy] Retrying {} on {}:{}".format(route.host, upstream.host, upstream.port))
+
+
+async def read_chunks(attempt, policy, deadline):
+    """
+    Yields the response chunks of an attempt, starting with its first bytes.
+    Stops early if the upstream stalls longer than the read timeout or the
+    request deadline passes.
+    """
+    chunk = attempt.first
+    while chunk:
+        yield chunk
+        try:
+            chunk = await asyncio.wait_for(attempt.reader.read(RELAY_CHUNK_SIZE),
+                                           deadline.clamp(policy.read_timeout))
+        except (asyncio.TimeoutError, UpstreamError):
+            print("[AsyncProxy] Upstream {}:{} stalled, response truncated".format(
+                attempt.upstream.host, attempt.upstream.port))
+            return
+        attempt.received += len(chunk)
+
+
+async def forward_request(route, version, host, port, request, client_writer):
+    """
+    Forwards a request to a backend server and relays the response to the
+    client as it arrives, without buffering the whole response.
+
+    :params route (Route): compiled route of the host.
+    :params version (int): version of the routing table.
+    :params host (str): IP address of the backend server.
+    :params port (int): port number of the backend server.
+    :params request (bytes): raw HTTP request.
+    :params client_writer (asyncio.StreamWriter): client stream.
+    :rtype tuple: (status code, bytes sent to the client).
+    """
+    try:
+        attempt, policy, deadline = await open_resilient(route, version, host, port, request)
+    except UpstreamError as e:
+        response = ERROR_RESPONSES.get(e.status, NOT_FOUND)
+        client_writer.write(response)
+        await client_writer.drain()
+        return e.status, len(response)
+
+    sent = 0
+    try:
+        async for chunk in read_chunks(attempt, policy, deadline):
+            client_writer.write(chunk)
+            sent += len(chunk)
+            await client_writer.drain()
+    except OSError as e:
+        print("Socket error: {}".format(e))
+    finally:
+        attempt.close()
+    return status_of(attempt.first), sent
+
+
+async def fetch_response(route, version, host, port, request):
+    """
+    Sends a request to a backend server and buffers the whole response.
+
+    :params route (Route): compiled route of the host.
+    :params version (int): version of the routing table.
+    :params host (str): IP address of the backend server.
+    :params port (int): port number of the backend server.
+    :params request (bytes): raw HTTP request.
+    :rtype bytes: raw HTTP response, or an error response if every attempt failed.
+    """
+    try:
+        attempt, policy, deadline = await open_resilient(route, version, host, port, request)
+    except UpstreamError as e:
+        return ERROR_RESPONSES.get(e.status, NOT_FOUND)
+    try:
+        return b''.join([chunk async for chunk in read_chunks(attempt, policy, deadline)])
+    except OSError as e:
+        print("Socket error: {}".format(e))
+        return ERROR_RESPONSES[502]
+    finally:
+        attempt.close()
+
+
+async def forward_coalesced(route, version, hostname, host, port, request, client_writer):
+    """
+    Forwards a request, sharing the upstream fetch with concurrent identical
+    GETs as :func:`daemon.proxy.forward_coalesced` does for threads. Requests
+    that cannot be coalesced are streamed by :func:`forward_request`.
+
+    :params route (Route): compiled route of the host.
+    :params version (int): version of the routing table.
+    :params hostname (str): value of the Host header.
+    :params host (str): IP address of the backend server.
+    :params port (int): port number of the backend server.
+    :params request (bytes): raw HTTP request.
+    :params client_writer (asyncio.StreamWriter): client stream.
+    :rtype tuple: (status code, bytes sent to the client).
+    """
+    keyed = None
+    if route.coalesce:
+        keyed = request_key(hostname, request.decode('latin-1'), VARY)
+    if keyed is None:
+        return await forward_request(route, version, host, port, request, client_writer)
+    key, vary = keyed
+    response = CACHE.get(key) if route.cache else None
+
+    if response is None:
+        async def fetch():
+            response = await fetch_response(route, version, host, port, request)
+            if response in ERROR_RESPONSES.values():
+                return response, True
+            shareable, max_age, names = response_policy(response, vary)
+            VARY.learn(hostname, key[1], names)
+            if shareable and route.cache:
+                ttl = route.cache_valid if max_age is None else min(max_age, route.cache_valid)
+                CACHE.put(key, response, ttl)
+            return response, shareable
+
+        (response, shareable), shared = await FLIGHTS.do(key, fetch)
+        if shared and not shareable:
+            return await forward_request(route, version, host, port, request, client_writer)
+
+    client_writer.write(response)
+    await client_writer.drain()
+    return status_of(response), len(response)
+
+
+async def handle_client(reader, writer, routes):
+    """
+    Handles an individual client connection on the event loop.
+
+    The handler reads the request, resolves the Host header against the
+    routes and relays the backend response, mirroring
+    :func:`daemon.proxy.handle_client`.
+
+    :params reader (asyncio.StreamReader): client stream.
+    :params writer (asyncio.StreamWriter): client stream.
+    :params routes (dict): dictionary mapping hostnames and location, or a
+                           :class:`ConfigReloader` serving the current table.
+    """
+    addr = writer.get_extra_info('peername')
+    try:
+        request = await read_request(reader)
+        if not request:
+            return
+        started = time.monotonic()
+
+        hostname = extract_hostname(request.decode('latin-1'))
+        print("[AsyncProxy] {} at Host: {}".format(addr, hostname))
+
+        routes = current_routes(routes)
+        route = DEFAULT_ROUTE
+        version = getattr(routes, "version", 0)
+        if isinstance(routes, RoutingTable) and hostname in routes:
+            route = routes.get(hostname)
+            request = apply_proxy_headers(
+                request.decode('latin-1'), route, hostname, addr
+            ).encode('latin-1')
+
+        resolved_host, resolved_port = resolve_routing_policy(hostname, routes)
+        try:
+            resolved_port = int(resolved_port)
+        except ValueError:
+            print("Not a valid integer")
+
+        if resolved_host:
+            print("[AsyncProxy] Host name {} is forwarded to {}:{}".format(hostname, resolved_host, resolved_port))
+            status, sent = await forward_coalesced(route, version, hostname, resolved_host,
+                                                   resolved_port, request, writer)
+        else:
+            writer.write(NOT_FOUND)
+            await writer.drain()
+            status, sent = 404, len(NOT_FOUND)
+
+        elapsed = time.monotonic() - started
+        METRICS.record_host(hostname, status, len(request), sent, elapsed, routes)
+        ACCESS_LOG.log(addr, hostname, request.split(b'\r\n', 1)[0].decode('latin-1'),
+                       status, sent, elapsed)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        print("[AsyncProxy] Client {} error: {}".format(addr, e))
+    finally:
+        writer.close()
+
+
+async def serve_proxy(ip, port, routes, backlog=DEFAULT_BACKLOG):
+    """
+    Runs the asyncio proxy server until cancelled.
+
+    :params ip (str): IP address to bind the proxy server.
+    :params port (int): port number to listen on.
+    :params routes (dict): dictionary mapping hostnames and location.
+    :params backlog (int): listen backlog of the server socket.
+    """
+    server = await asyncio.start_server(
+        lambda r, w: handle_client(r, w, routes),
+        ip, port,
+        backlog=backlog,
+        limit=MAX_HEADER_SIZE,
+        reuse_address=True,
+    )
+    print("[AsyncProxy] Listening on IP {} port {}".format(ip, port))
+    async with server:
+        await server.serve_forever()
+
+
+def run_async_proxy(ip, port, routes, backlog=DEFAULT_BACKLOG):
+    """
+    Starts the asyncio proxy engine and blocks until interrupted.
+
+    :params ip (str): IP address to bind the proxy server.
+    :params port (int): port number to listen on.
+    :params routes (dict): dictionary mapping hostnames and location.
+    :params backlog (int): listen backlog of the server socket.
+    """
+    limit = raise_nofile_limit()
+    if limit > 0:
+        print("[AsyncProxy] Open file limit {}".format(limit))
+    try:
+        asyncio.run(serve_proxy(ip, port, routes, backlog))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print("Socket error: {}".format(e))
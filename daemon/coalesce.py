@@ -0,0 +1,279 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.coalesce
+~~~~~~~~~~~~~~~~~
+
+This module provides request coalescing (single-flight) for the proxy.
+Concurrent cacheable GETs with the same host, path and Vary key share one
+upstream fetch, and the response is fanned out to every waiter, so a cold URL
+hit by N clients at once costs the backend a single request.
+
+A request is coalesced only if it is a GET without credentials (no Cookie or
+Authorization header) and without ``no-cache``. A response is fanned out only
+if it is shareable: no Set-Cookie, no private/no-store/no-cache and no Vary on
+headers that were not part of the key. Waiters that receive a response that
+is not shareable fetch it again on their own.
+
+Requirement:
+-----------------
+- threading: :class:`SingleFlight <SingleFlight>` for the threaded engine.
+- asyncio: :class:`AsyncSingleFlight <AsyncSingleFlight>` for the asyncio engine.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+#: Status codes that are cacheable by default (RFC 9110, section 15.1).
+CACHEABLE_STATUS = frozenset((200, 203, 204, 206, 300, 301, 308, 404, 405, 410, 414, 501))
+
+
+def parse_head(head):
+    """
+    Splits a raw HTTP head into its start line and a lower-cased header dict.
+    Repeated headers are joined with ", ".
+
+    :params head (str): start line and header lines.
+    :rtype tuple: (start line, dict of headers).
+    """
+    lines = head.split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = headers[name] + ", " + value if name in headers else value
+    return lines[0], headers
+
+
+def split_tokens(value):
+    """Splits a comma separated header value into lower-cased tokens."""
+    return [t.strip().lower() for t in value.split(',') if t.strip()]
+
+
+class VaryIndex:
+    """
+    Remembers the Vary header names last seen for each host and path, so the
+    coalescing key of later requests includes the values of those headers.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, hostname, path):
+        """Returns the known Vary names (tuple), ("*",) or ()."""
+        with self.lock:
+            return self.entries.get((hostname, path), ())
+
+    def learn(self, hostname, path, names):
+        """Stores the Vary names of a response."""
+        key = (hostname, path)
+        with self.lock:
+            if names:
+                self.entries[key] = names
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.pop(key, None)
+
+
+def request_key(hostname, request, vary_index):
+    """
+    Computes the coalescing key of a request.
+
+    :params hostname (str): value of the Host header.
+    :params request (str): raw HTTP request.
+    :params vary_index (VaryIndex): Vary names learned from earlier responses.
+    :rtype tuple: (key, vary names) or None if the request must not be coalesced.
+    """
+    start, headers = parse_head(request.partition('\r\n\r\n')[0])
+    parts = start.split()
+    if len(parts) < 2 or parts[0] != 'GET':
+        return None
+    if 'authorization' in headers or 'cookie' in headers:
+        return None
+    directives = split_tokens(headers.get('cache-control', '')) + split_tokens(headers.get('pragma', ''))
+    if 'no-cache' in directives or 'no-store' in directives:
+        return None
+    path = parts[1]
+    vary = vary_index.get(hostname, path)
+    if '*' in vary:
+        return None
+    key = (hostname, path) + tuple(headers.get(name, '') for name in vary)
+    return key, vary
+
+
+def response_policy(response, vary):
+    """
+    Decides whether a response can be shared with other waiters.
+
+    :params response (bytes): raw HTTP response.
+    :params vary (tuple): Vary names that were part of the request key.
+    :rtype tuple: (shareable, max-age or None, Vary names of the response).
+    """
+    head = response.partition(b'\r\n\r\n')[0].decode('latin-1')
+    start, headers = parse_head(head)
+    names = tuple(sorted(split_tokens(headers.get('vary', ''))))
+    parts = start.split()
+    try:
+        status = int(parts[1])
+    except (IndexError, ValueError):
+        return False, None, names
+    if status not in CACHEABLE_STATUS or 'set-cookie' in headers:
+        return False, None, names
+    max_age = None
+    for directive in split_tokens(headers.get('cache-control', '')):
+        if directive in ('private', 'no-store', 'no-cache'):
+            return False, None, names
+        if directive.startswith('max-age='):
+            try:
+                max_age = float(directive[len('max-age='):])
+            except ValueError:
+                max_age = 0.0
+    if any(name not in vary for name in names):
+        return False, max_age, names
+    return True, max_age, names
+
+
+class ResponseCache:
+    """
+    Small LRU cache of shareable responses for routes with ``proxy_cache on``.
+    Entries expire after ``proxy_cache_valid`` seconds, or earlier when the
+    response carries a smaller max-age.
+    """
+
+    def __init__(self, max_entries=1024, max_size=1 << 20):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Returns the cached response for key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, response = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return response
+
+    def put(self, key, response, ttl):
+        """Stores a response for ttl seconds."""
+        if ttl <= 0 or len(response) > self.max_size:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class _Call:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers with the same
+    key wait for the leader and receive its result.
+
+    Usage::
+
+      >>> flights = SingleFlight()
+      >>> value, shared = flights.do(key, fetch)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        #: Number of callers that reused a leader's result.
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        Calls fn() unless a call for key is already in flight.
+
+        :rtype tuple: (result, shared) where shared is True for waiters.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.value, False
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of :class:`SingleFlight`. The shared fetch runs as its
+    own task, so a leader whose client disconnects does not cancel it for the
+    other waiters.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        #: Number of callers that reused a leader's result.
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        """
+        Awaits factory() unless a call for key is already in flight.
+
+        :rtype tuple: (result, shared) where shared is True for waiters.
+        """
+        task = self.calls.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self.calls[key] = task
+
+            def done(t):
+                if self.calls.get(key) is t:
+                    del self.calls[key]
+            task.add_done_callback(done)
+        return await asyncio.shield(task), shared
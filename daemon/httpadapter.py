@@ -19,12 +19,15 @@ http settings (headers, bodies). The adapter supports both
 raw URL paths and RESTful route definitions, and integrates with
 Request and Response objects to handle client-server communication.
 """
+import os
 import threading
 import socket
 from .request import Request
 from .response import Response
 from .dictionary import CaseInsensitiveDict
 from peer import Peer
+from p2p.client import PeerDirectory
+from p2p.cluster import connect_tracker
 import json as _json 
 
 registered_users = {
@@ -33,18 +36,18 @@ registered_users = {
 }
 users_lock = threading.Lock()
 is_valid = False
+# Tracker (mặc định localhost:9000), hoặc cluster "host:port,host:port,..." qua TRACKER_NODES
+TRACKER_NODES = os.environ.get('TRACKER_NODES', 'localhost:9000')
+tracker = connect_tracker(TRACKER_NODES)  # Kết nối giữ lâu dài
+directory = PeerDirectory(tracker)  # Danh sách peers, đồng bộ theo delta
 def call_tracker(command):
     """
-    Gọi tracker qua socket TCP, gửi lệnh và nhận response.
+    Gọi tracker qua kết nối framed dùng chung, gửi lệnh và nhận response.
     :param command: Lệnh như 'REGISTER:username:ip:port' hoặc 'LOOKUP:*'
     :return: Response string hoặc None nếu lỗi
     """
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect(('localhost', 9000))  # Port tracker
-        sock.send((command + '\n').encode('utf-8'))  
-        response = sock.recv(2048).decode('utf-8').strip()  # Nhận full response
-        sock.close()
+        response = tracker.call(command)  # Nhận full response
         print(f"[HttpAdapter] Tracker response: {response}")  # Debug
         return response
     except socket.error as e:
@@ -212,8 +215,12 @@ class HttpAdapter:
             username = form.get("username", "")
             post_str = form.get("Port", "")
             print("HTTP : POST" + post_str)
-            peer = Peer(username, post_str)
-            if peer.register():
+            peer = Peer(username, post_str, tracker_nodes=TRACKER_NODES)
+            registered = peer.register()
+            # Proxy không gửi HEARTBEAT thay người dùng web: đăng ký hết hạn theo TTL của tracker
+            # trừ khi peer thật của người dùng tiếp tục gửi HEARTBEAT
+            peer.tracker.close()
+            if registered:
                 resp.status_code = 200
                 resp.reason = "OK"
                 resp.headers["Content-Type"] = "text/html"
@@ -236,19 +243,16 @@ class HttpAdapter:
             import os
             print("[HttpAdapter] Xử lý load peers GET")
 
-            # Gọi tracker để lấy peers (LOOKUP:*)
-            tracker_response = call_tracker("LOOKUP:*")
+            # Đồng bộ danh sách peers với tracker (LOOKUP_PAGE lần đầu, sau đó LOOKUP_SINCE)
+            try:
+                peers = directory.sync()
+            except (socket.error, ValueError) as e:
+                print(f"[HttpAdapter] Lỗi tải peers từ tracker: {e}")
+                peers = None
             peers_list = []
-            if tracker_response and tracker_response.startswith('PEERS:'):
-                try:
-                    peers_json = tracker_response[6:]  # Bỏ 'PEERS:'
-                    print(f"[HttpAdapter] Debug JSON raw: {peers_json}")
-                    peers_data = json.loads(peers_json)
-                    peers_list = peers_data.get('peers', [])
-                    print(f"[HttpAdapter] Parsed {len(peers_list)} peers: {peers_list}")
-                except json.JSONDecodeError:
-                    print("json wrong")
-                    peers_list = []
+            if peers is not None:
+                peers_list = [{'username': u, 'ip': a[0], 'port': a[1]} for u, a in sorted(peers.items())]
+                print(f"[HttpAdapter] Parsed {len(peers_list)} peers: {peers_list}")
 
                 # Xây dựng danh sách HTML
                 peer_html = ""
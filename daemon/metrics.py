@@ -0,0 +1,342 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.metrics
+~~~~~~~~~~~~~~~~~
+
+This module records per-host and per-upstream proxy statistics and writes the
+access log.
+
+- :class:`Histogram <Histogram>` is an HDR-style log-linear latency histogram:
+  recording is O(1) and percentiles are accurate to about 3%.
+- :class:`ProxyMetrics <ProxyMetrics>` keeps request counts, status classes,
+  bytes and connect/TTFB/total histograms for every host and upstream.
+- :class:`AccessLog <AccessLog>` hands log records to a background thread
+  through a queue, which writes them to a size-rotated file, so the request
+  path never waits on disk.
+- :func:`serve_admin` exposes the statistics as JSON on an admin port.
+
+Requirement:
+-----------------
+- logging.handlers: QueueHandler, QueueListener and RotatingFileHandler.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import socket
+import threading
+import time
+
+#: Sub-bucket bits of :class:`Histogram`; 6 bits bound the relative error to 1/32.
+SUB_BITS = 6
+_HALF = 1 << (SUB_BITS - 1)
+
+#: Highest trackable value in microseconds (about 19 hours).
+MAX_MICROS = (1 << 36) - 1
+
+
+def _bucket(value):
+    if value < (1 << SUB_BITS):
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+
+def _bucket_floor(index):
+    if index < (1 << SUB_BITS):
+        return index
+    shift = index // _HALF - 1
+    return (index - shift * _HALF) << shift
+
+
+class Histogram:
+    """
+    Log-linear histogram of durations, recorded in microseconds.
+
+    Values below 64us are exact; above, each power of two is split into 32
+    linear sub-buckets, like an HdrHistogram with 6 significant bits.
+    """
+
+    __slots__ = ("counts", "count", "total", "max", "lock")
+
+    def __init__(self):
+        self.counts = [0] * (_bucket(MAX_MICROS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        """Adds one sample given in seconds."""
+        micros = min(MAX_MICROS, max(0, int(seconds * 1e6)))
+        with self.lock:
+            self.counts[_bucket(micros)] += 1
+            self.count += 1
+            self.total += micros
+            if micros > self.max:
+                self.max = micros
+
+    def percentile(self, q):
+        """
+        Returns the q-quantile in milliseconds (lower bound of its bucket).
+
+        :params q (float): quantile between 0 and 1.
+        """
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, int(q * self.count + 0.5))
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return _bucket_floor(index) / 1000.0
+            return self.max / 1000.0
+
+    def summary(self):
+        """Returns count, mean, p50, p90, p99, p999 and max in milliseconds."""
+        count = self.count
+        return {
+            "count": count,
+            "mean": round(self.total / count / 1000.0, 3) if count else 0.0,
+            "p50": self.percentile(0.50),
+            "p90": self.percentile(0.90),
+            "p99": self.percentile(0.99),
+            "p999": self.percentile(0.999),
+            "max": self.max / 1000.0,
+        }
+
+
+class Stats:
+    """Counters and latency histograms of one host or upstream."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.status = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connect = Histogram()
+        self.ttfb = Histogram()
+        self.latency = Histogram()
+
+    def record(self, status, bytes_in=0, bytes_out=0, connect=None, ttfb=None, total=None, error=False):
+        status_class = "{}xx".format(status // 100) if status else "error"
+        with self.lock:
+            self.requests += 1
+            self.status[status_class] = self.status.get(status_class, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if error:
+                self.errors += 1
+        if connect is not None:
+            self.connect.record(connect)
+        if ttfb is not None:
+            self.ttfb.record(ttfb)
+        if total is not None:
+            self.latency.record(total)
+
+    def snapshot(self):
+        with self.lock:
+            data = {
+                "requests": self.requests,
+                "errors": self.errors,
+                "status": dict(self.status),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+            }
+        data["connect_ms"] = self.connect.summary()
+        data["ttfb_ms"] = self.ttfb.summary()
+        data["total_ms"] = self.latency.summary()
+        return data
+
+
+def status_of(response):
+    """Returns the status code of a raw HTTP response, or 0 if unparsable."""
+    try:
+        return int(response[9:12])
+    except (TypeError, ValueError):
+        return 0
+
+
+class ProxyMetrics:
+    """
+    Statistics of the proxy, keyed by virtual host and by upstream address.
+
+    Usage::
+
+      >>> metrics = ProxyMetrics()
+      >>> metrics.record_upstream("127.0.0.1:9001", 200, 120, 4096, 0.001, 0.010, 0.012)
+      >>> metrics.record_host("app1.local", 200, 120, 4096, 0.013)
+      >>> metrics.snapshot()["hosts"]["app1.local"]["requests"]
+      1
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.upstreams = {}
+        #: Optional callables adding extra sections to :meth:`snapshot`.
+        self.sources = {}
+
+    def _stats(self, table, key):
+        stats = table.get(key)
+        if stats is None:
+            with self.lock:
+                stats = table.setdefault(key, Stats())
+        return stats
+
+    def record_host(self, host, status, bytes_in, bytes_out, total, routes=None):
+        """
+        Records one client request of a virtual host.
+
+        Hosts not configured in routes are all recorded under ``"-"``: the
+        Host header comes from the client, and every distinct value would
+        otherwise keep its own histograms.
+        """
+        if routes is not None and host not in routes:
+            host = None
+        self._stats(self.hosts, host or "-").record(
+            status, bytes_in, bytes_out, total=total, error=status >= 500 or not status)
+
+    def record_upstream(self, upstream, status, bytes_in, bytes_out,
+                        connect=None, ttfb=None, total=None, error=False):
+        """Records one attempt against an upstream ("host:port")."""
+        self._stats(self.upstreams, upstream).record(
+            status, bytes_in, bytes_out, connect, ttfb, total, error)
+
+    def snapshot(self):
+        """Returns all statistics as a JSON serializable dict."""
+        with self.lock:
+            hosts = list(self.hosts.items())
+            upstreams = list(self.upstreams.items())
+        data = {
+            "uptime": round(time.time() - self.started, 3),
+            "hosts": {k: v.snapshot() for k, v in hosts},
+            "upstreams": {k: v.snapshot() for k, v in upstreams},
+        }
+        for name, source in self.sources.items():
+            data[name] = source()
+        return data
+
+
+class AccessLog:
+    """
+    Buffered, rotating access log written by a background thread.
+
+    Records are put on an unbounded in-memory queue by a
+    :class:`logging.handlers.QueueHandler`; a
+    :class:`logging.handlers.QueueListener` thread drains it into a
+    :class:`logging.handlers.RotatingFileHandler`.
+
+    :params path (str): log file path, or None to stay disabled until :meth:`open`.
+    :params max_bytes (int): size at which the file is rotated.
+    :params backups (int): number of rotated files kept.
+    """
+
+    def __init__(self, path=None, max_bytes=10 * 1024 * 1024, backups=5):
+        self.logger = logging.getLogger("proxy.access.{}".format(id(self)))
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.listener = None
+        self.enabled = False
+        if path is not None:
+            self.open(path, max_bytes, backups)
+
+    def open(self, path, max_bytes=10 * 1024 * 1024, backups=5):
+        """Starts writing to path; the log is disabled until then."""
+        self.close()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        records = queue.SimpleQueue()
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(logging.handlers.QueueHandler(records))
+        self.listener = logging.handlers.QueueListener(records, file_handler)
+        self.listener.start()
+        self.enabled = True
+
+    def log(self, addr, host, request_line, status, size, seconds):
+        """
+        Queues one access log line in combined-like format::
+
+            127.0.0.1 app1.local [19/Oct/2026:10:00:00 +0000] "GET / HTTP/1.1" 200 512 1.234ms
+        """
+        if not self.enabled:
+            return
+        self.logger.info('%s %s [%s] "%s" %d %d %.3fms',
+                         addr[0] if addr else "-", host or "-",
+                         time.strftime("%d/%b/%Y:%H:%M:%S %z"),
+                         request_line, status, size, seconds * 1000.0)
+
+    def close(self):
+        """Flushes queued records and stops the writer thread."""
+        self.enabled = False
+        if self.listener is not None:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.close()
+            self.listener = None
+
+
+def serve_admin(ip, port, metrics):
+    """
+    Starts a daemon thread serving the proxy statistics as JSON.
+
+    ``GET /metrics`` (or ``/``) returns :meth:`ProxyMetrics.snapshot`.
+
+    :params ip (str): IP address to bind the admin endpoint.
+    :params port (int): port number of the admin endpoint.
+    :params metrics (ProxyMetrics): statistics to expose.
+    :rtype threading.Thread: the serving thread.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((ip, port))
+    server.listen(16)
+    print("[Admin] Listening on IP {} port {}".format(ip, port))
+
+    def handle(conn):
+        try:
+            conn.settimeout(5)
+            request = conn.recv(4096).decode('latin-1')
+            parts = request.split(' ', 2)
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1] in ('/', '/metrics'):
+                body = json.dumps(metrics.snapshot(), indent=2).encode('utf-8')
+                status = "200 OK"
+            else:
+                body = b'{"error": "not found"}'
+                status = "404 Not Found"
+            conn.sendall((
+                "HTTP/1.1 {}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: close\r\n"
+                "\r\n").format(status, len(body)).encode('latin-1') + body)
+        except socket.error as e:
+            print("[Admin] Socket error: {}".format(e))
+        finally:
+            conn.close()
+
+    def loop():
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
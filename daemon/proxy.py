@@ -25,13 +25,28 @@ Requirement:
 - response: customized :class: `Response <Response>` utilities.
 - httpadapter: :class: `HttpAdapter <HttpAdapter >` adapter for HTTP request processing.
 - dictionary: :class: `CaseInsensitiveDict <CaseInsensitiveDict>` for managing headers and cookies.
+- proxyconf: :class: `RoutingTable <RoutingTable>` compiled from the proxy configuration.
+- coalesce: single-flight coalescing and caching of identical upstream GETs.
+- resilience: timeouts, retry budget and hedging of upstream attempts.
+- metrics: per-host and per-upstream statistics and the access log.
 
 """
+import queue
+import random
 import socket
 import threading
+import time
 from .response import *
 from .httpadapter import HttpAdapter
 from .dictionary import CaseInsensitiveDict
+from .proxyconf import DEFAULT_ROUTE, RoutingTable
+from .coalesce import ResponseCache, SingleFlight, VaryIndex, request_key, response_policy
+from .proxyconf import Upstream
+from .metrics import AccessLog, ProxyMetrics, status_of
+from .resilience import (
+    IDEMPOTENT_METHODS,
+    Deadline, UpstreamError, policy_for, request_method,
+)
 
 #: A dictionary mapping hostnames to backend IP and port tuples.
 #: Used to determine routing targets for incoming requests.
@@ -41,41 +56,346 @@ PROXY_PASS = {
     "app2.local": ('192.168.56.103', 9002),
 }
 
+def error_response(status, reason):
+    """
+    Builds the plain text response the proxy returns on its own errors.
+
+    :params status (int): HTTP status code.
+    :params reason (str): reason phrase.
+    :rtype bytes: raw HTTP response.
+    """
+    body = "{} {}".format(status, reason)
+    return (
+        "HTTP/1.1 {} {}\r\n"
+        "Content-Type: text/plain\r\n"
+        "Content-Length: {}\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+        "{}"
+    ).format(status, reason, len(body), body).encode('utf-8')
+
+
+#: Response returned when the backend is unreachable or the host is unknown.
+NOT_FOUND = error_response(404, "Not Found")
+
+#: Responses returned when every attempt against the upstreams failed,
+#: indexed by :attr:`UpstreamError.status`.
+ERROR_RESPONSES = {
+    404: NOT_FOUND,
+    502: error_response(502, "Bad Gateway"),
+    503: error_response(503, "Service Unavailable"),
+    504: error_response(504, "Gateway Timeout"),
+}
+
+#: Coalescing state shared by all client threads.
+FLIGHTS = SingleFlight()
+VARY = VaryIndex()
+CACHE = ResponseCache()
+
+#: Statistics and access log shared by both engines.
+METRICS = ProxyMetrics()
+METRICS.sources["coalesced"] = lambda: FLIGHTS.coalesced
+ACCESS_LOG = AccessLog()
+
+
+def fetch_upstream(upstream, request, policy, deadline):
+    """
+    Performs one attempt against an upstream with the route's connect and
+    read timeouts, bounded by the request deadline.
+
+    :params upstream (Upstream): backend server.
+    :params request (str): incoming HTTP request.
+    :params policy (RoutePolicy): runtime state of the route.
+    :params deadline (Deadline): total time budget of the request.
+
+    :rtype tuple: (raw response, time to first byte in seconds).
+    :raises UpstreamError: if the attempt failed.
+    """
+    name = "{}:{}".format(upstream.host, upstream.port)
+    slot = policy.slot(upstream)
+    if slot is not None and not slot.acquire(timeout=deadline.clamp(policy.connect_timeout)):
+        METRICS.record_upstream(name, 503, 0, 0, error=True)
+        raise UpstreamError(503, "connection pool of {} exhausted".format(name))
+    started = time.monotonic()
+    connect = ttfb = None
+    try:
+        try:
+            backend = socket.create_connection(
+                (upstream.host, upstream.port), timeout=deadline.clamp(policy.connect_timeout))
+        except socket.timeout:
+            raise UpstreamError(504, "connect to {} timed out".format(name))
+        except socket.error as e:
+            raise UpstreamError(404, "connect to {} failed: {}".format(name, e))
+        connect = time.monotonic() - started
+        try:
+            backend.sendall(request.encode())
+            chunks = []
+            while True:
+                backend.settimeout(deadline.clamp(policy.read_timeout))
+                chunk = backend.recv(65536)
+                if ttfb is None:
+                    ttfb = time.monotonic() - started
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except socket.timeout:
+            raise UpstreamError(504, "read from {} timed out".format(name))
+        except socket.error as e:
+            raise UpstreamError(502, "read from {} failed: {}".format(name, e))
+        finally:
+            backend.close()
+    except UpstreamError as e:
+        METRICS.record_upstream(name, e.status, 0, len(request), connect, ttfb,
+                                time.monotonic() - started, error=True)
+        raise
+    finally:
+        if slot is not None:
+            slot.release()
+    response = b"".join(chunks)
+    METRICS.record_upstream(name, status_of(response), len(response), len(request),
+                            connect, ttfb, time.monotonic() - started)
+    return response, ttfb
+
+
+def hedged_fetch(route, version, policy, upstream, request, deadline, delay):
+    """
+    Sends the request to one upstream and, if no response arrived after
+    ``delay`` seconds, a second copy to another upstream. The first successful
+    response wins; the slower attempt finishes in the background.
 
-def forward_request(host, port, request):
+    :rtype tuple: (upstream, raw response, ttfb, upstreams tried).
+    :raises UpstreamError: if every attempt failed.
     """
-    Forwards an HTTP request to a backend server and retrieves the response.
+    results = queue.Queue()
+
+    def attempt(target):
+        try:
+            response, ttfb = fetch_upstream(target, request, policy, deadline)
+            results.put((target, response, ttfb, None))
+        except UpstreamError as e:
+            results.put((target, None, None, e))
+
+    tried = [upstream]
+    threading.Thread(target=attempt, args=(upstream,), daemon=True).start()
+    pending = 1
+    try:
+        item = results.get(timeout=deadline.clamp(delay))
+    except queue.Empty:
+        item = None
+        second = select_upstream(route, version, exclude=tried)
+        if second is not None and policy.budget.withdraw():
+            print("[Proxy] Hedging {} to {}:{}".format(route.host, second.host, second.port))
+            tried.append(second)
+            threading.Thread(target=attempt, args=(second,), daemon=True).start()
+            pending += 1
+
+    error = None
+    while True:
+        if item is None:
+            try:
+                item = results.get(timeout=deadline.clamp(None))
+            except queue.Empty:
+                raise UpstreamError(504, "request deadline exceeded")
+        pending -= 1
+        target, response, ttfb, error = item
+        if error is None:
+            return target, response, ttfb, tried
+        if pending == 0:
+            raise error
+        item = None
+
+
+def forward_upstream(route, version, host, port, request):
+    """
+    Forwards a request under the route's resilience policy: connect, read and
+    total timeouts, retries of idempotent requests against a different
+    upstream within the retry budget, and optional hedging after the p95
+    time to first byte.
+
+    :params route (Route): compiled route of the host.
+    :params version (int): version of the routing table.
+    :params host (str): IP address of the first backend server.
+    :params port (int): port number of the first backend server.
+    :params request (str): incoming HTTP request.
 
+    :rtype bytes: Raw HTTP response, or an error response if every attempt failed.
+    """
+    policy = policy_for(route, version)
+    policy.budget.deposit()
+    deadline = Deadline(route.timeout)
+    idempotent = request_method(request) in IDEMPOTENT_METHODS
+    upstream = find_upstream(route, host, port)
+    tried = []
+    attempts = 0
+
+    while True:
+        attempts += 1
+        try:
+            delay = policy.latency.percentile() if route.hedge and idempotent else None
+            if delay is not None and len(route.upstreams) > 1:
+                upstream, response, ttfb, used = hedged_fetch(
+                    route, version, policy, upstream, request, deadline, delay)
+                tried.extend(used)
+            else:
+                tried.append(upstream)
+                response, ttfb = fetch_upstream(upstream, request, policy, deadline)
+            policy.latency.record(ttfb)
+            return response
+        except UpstreamError as e:
+            print("[Proxy] Upstream error for {}: {}".format(route.host or host, e))
+            error = e
+        if not idempotent or attempts > route.retries or deadline.expired():
+            break
+        upstream = select_upstream(route, version, exclude=tried)
+        if upstream is None or not policy.budget.withdraw():
+            break
+        print("[Proxy] Retrying {} on {}:{}".format(route.host, upstream.host, upstream.port))
+    return ERROR_RESPONSES.get(error.status, NOT_FOUND)
+
+
+def forward_coalesced(route, hostname, host, port, request, version=0):
+    """
+    Forwards a request, sharing the upstream fetch with concurrent identical
+    GETs and serving it from the response cache when the route enables it.
+
+    :params route (Route): compiled route of the host.
+    :params hostname (str): value of the Host header.
     :params host (str): IP address of the backend server.
     :params port (int): port number of the backend server.
     :params request (str): incoming HTTP request.
+    :params version (int): version of the routing table.
 
-    :rtype bytes: Raw HTTP response from the backend server. If the connection
-                  fails, returns a 404 Not Found response.
+    :rtype bytes: Raw HTTP response.
+    """
+    def forward():
+        return forward_upstream(route, version, host, port, request)
+
+    keyed = request_key(hostname, request, VARY) if route.coalesce else None
+    if keyed is None:
+        return forward()
+    key, vary = keyed
+    use_cache = route.cache
+    if use_cache:
+        cached = CACHE.get(key)
+        if cached is not None:
+            return cached
+
+    def fetch():
+        response = forward()
+        if response in ERROR_RESPONSES.values():
+            return response, True
+        shareable, max_age, names = response_policy(response, vary)
+        VARY.learn(hostname, key[1], names)
+        if shareable and use_cache:
+            ttl = route.cache_valid if max_age is None else min(max_age, route.cache_valid)
+            CACHE.put(key, response, ttl)
+        return response, shareable
+
+    (response, shareable), shared = FLIGHTS.do(key, fetch)
+    if shared and not shareable:
+        response = forward()
+    return response
+
+
+#: Smooth weighted round-robin state per host: {host: (table version, [current weights])}.
+_BALANCER = {}
+_BALANCER_LOCK = threading.Lock()
+
+
+def current_routes(routes):
     """
+    Returns the routing table to use for one request.
 
-    backend = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    A :class:`ConfigReloader <ConfigReloader>` is asked for the table in
+    service, so a request keeps a consistent table even if a reload happens
+    while it is in flight. Plain dicts and tables are returned as-is.
 
-    try:
-        backend.connect((host, port))
-        backend.sendall(request.encode())
-        response = b""
-        while True:
-            chunk = backend.recv(4096)
-            if not chunk:
-                break
-            response += chunk
-        return response
-    except socket.error as e:
-      print("Socket error: {}".format(e))
-      return (
-            "HTTP/1.1 404 Not Found\r\n"
-            "Content-Type: text/plain\r\n"
-            "Content-Length: 13\r\n"
-            "Connection: close\r\n"
-            "\r\n"
-            "404 Not Found"
-        ).encode('utf-8')
+    :params routes: dict, :class:`RoutingTable` or :class:`ConfigReloader`.
+    """
+    if hasattr(routes, "current"):
+        return routes.current()
+    return routes
+
+
+def select_upstream(route, version=0, exclude=()):
+    """
+    Picks an upstream of a route according to its dist_policy and weights.
+
+    Round-robin uses the smooth weighted round-robin of nginx, so a backend
+    with weight 3 receives 3 out of every 4 requests next to a backend with
+    weight 1, interleaved rather than in bursts.
+
+    :params route (Route): compiled route.
+    :params version (int): version of the table the route belongs to.
+    :params exclude (iterable): upstreams that must not be chosen.
+    :rtype Upstream: the chosen upstream, or None if none is eligible.
+    """
+    candidates = [i for i, u in enumerate(route.upstreams) if u not in exclude]
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return route.upstreams[candidates[0]]
+    if route.policy == "random":
+        weights = [route.upstreams[i].weight for i in candidates]
+        return route.upstreams[random.choices(candidates, weights)[0]]
+
+    with _BALANCER_LOCK:
+        state = _BALANCER.get(route.host)
+        if state is None or state[0] != version or len(state[1]) != len(route.upstreams):
+            state = (version, [0] * len(route.upstreams))
+            _BALANCER[route.host] = state
+        current = state[1]
+        total = 0
+        best = None
+        for i in candidates:
+            weight = route.upstreams[i].weight
+            current[i] += weight
+            total += weight
+            if best is None or current[i] > current[best]:
+                best = i
+        current[best] -= total
+    return route.upstreams[best]
+
+
+def find_upstream(route, host, port):
+    """
+    Returns the upstream of a route matching a resolved host and port.
+
+    :rtype Upstream: the configured upstream, or a weight 1 upstream if the
+                     address is not part of the route.
+    """
+    port = int(port)
+    for upstream in route.upstreams:
+        if upstream.host == host and upstream.port == port:
+            return upstream
+    return Upstream(host, port, 1)
+
+
+def apply_proxy_headers(request, route, hostname, addr):
+    """
+    Rewrites the request head with the proxy_set_header directives of a route.
+
+    Supported variables are ``$host`` and ``$remote_addr``.
+
+    :params request (str): incoming HTTP request.
+    :params route (Route): compiled route, or None.
+    :params hostname (str): value of the incoming Host header.
+    :params addr (tuple): client address (IP, port).
+    :rtype str: the rewritten request.
+    """
+    if route is None or not route.headers:
+        return request
+    head, sep, body = request.partition('\r\n\r\n')
+    lines = head.split('\r\n')
+    variables = {"$host": hostname, "$remote_addr": addr[0] if addr else ""}
+    for name, value in route.headers:
+        for var, sub in variables.items():
+            value = value.replace(var, sub)
+        lines = [lines[0]] + [l for l in lines[1:]
+                              if l.split(':', 1)[0].strip().lower() != name.lower()]
+        if value:
+            lines.append("{}: {}".format(name, value))
+    return '\r\n'.join(lines) + sep + body
 
 
 def resolve_routing_policy(hostname, routes):
@@ -85,10 +405,19 @@ def resolve_routing_policy(hostname, routes):
 
     :params host (str): IP address of the request target server.
     :params port (int): port number of the request target server.
-    :params routes (dict): dictionary mapping hostnames and location.
+    :params routes (dict): dictionary mapping hostnames and location,
+                           or a compiled :class:`RoutingTable`.
     """
 
     print(hostname)
+    if isinstance(routes, RoutingTable):
+        route = routes.get(hostname)
+        upstream = select_upstream(route, routes.version) if route else None
+        if upstream is None:
+            print("[Proxy] Emtpy resolved routing of hostname {}".format(hostname))
+            return '127.0.0.1', '8000'
+        return upstream.host, str(upstream.port)
+
     proxy_map, policy = routes.get(hostname,('127.0.0.1:8000','round-robin'))
     print(proxy_map)
     print(policy)
@@ -136,18 +465,28 @@ def handle_client(ip, port, conn, addr, routes):
     :params port (int): port number of the proxy server.
     :params conn (socket.socket): client connection socket.
     :params addr (tuple): client address (IP, port).
-    :params routes (dict): dictionary mapping hostnames and location.
+    :params routes (dict): dictionary mapping hostnames and location, or a
+                           :class:`ConfigReloader` serving the current table.
     """
 
     request = conn.recv(1024).decode()
+    started = time.monotonic()
 
     # Extract hostname
+    hostname = ''
     for line in request.splitlines():
         if line.lower().startswith('host:'):
             hostname = line.split(':', 1)[1].strip()
 
     print("[Proxy] {} at Host: {}".format(addr, hostname))
 
+    # Pin the routing table for the whole request
+    routes = current_routes(routes)
+    route = DEFAULT_ROUTE
+    if isinstance(routes, RoutingTable) and hostname in routes:
+        route = routes.get(hostname)
+        request = apply_proxy_headers(request, route, hostname, addr)
+
     # Resolve the matching destination in routes and need conver port
     # to integer value
     resolved_host, resolved_port = resolve_routing_policy(hostname, routes)
@@ -158,19 +497,18 @@ def handle_client(ip, port, conn, addr, routes):
 
     if resolved_host:
         print("[Proxy] Host name {} is forwarded to {}:{}".format(hostname,resolved_host, resolved_port))
-        response = forward_request(resolved_host, resolved_port, request)        
+        response = forward_coalesced(route, hostname, resolved_host, resolved_port, request,
+                                     getattr(routes, "version", 0))
     else:
-        response = (
-            "HTTP/1.1 404 Not Found\r\n"
-            "Content-Type: text/plain\r\n"
-            "Content-Length: 13\r\n"
-            "Connection: close\r\n"
-            "\r\n"
-            "404 Not Found"
-        ).encode('utf-8')
+        response = NOT_FOUND
     conn.sendall(response)
     conn.close()
 
+    status = status_of(response)
+    elapsed = time.monotonic() - started
+    METRICS.record_host(hostname, status, len(request), len(response), elapsed, routes)
+    ACCESS_LOG.log(addr, hostname, request.split('\r\n', 1)[0], status, len(response), elapsed)
+
 def run_proxy(ip, port, routes):
     """
     Starts the proxy server and listens for incoming connections. 
@@ -212,13 +550,19 @@ def run_proxy(ip, port, routes):
     except socket.error as e:
       print("Socket error: {}".format(e))
 
-def create_proxy(ip, port, routes):
+def create_proxy(ip, port, routes, engine="thread"):
     """
     Entry point for launching the proxy server.
 
     :params ip (str): IP address to bind the proxy server.
     :params port (int): port number to listen on.
     :params routes (dict): dictionary mapping hostnames and location.
+    :params engine (str): "thread" for thread-per-connection, or "async"
+                          to multiplex all connections on one event loop.
     """
 
-    run_proxy(ip, port, routes)
\ No newline at end of file
+    if engine == "async":
+        from .asyncproxy import run_async_proxy
+        run_async_proxy(ip, port, routes)
+    else:
+        run_proxy(ip, port, routes)
@@ -0,0 +1,495 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.proxyconf
+~~~~~~~~~~~~~~~~~
+
+This module parses the proxy configuration format (``config/proxy.conf``)
+with a real tokenizer and compiles it into an immutable
+:class:`RoutingTable <RoutingTable>`. A :class:`ConfigReloader <ConfigReloader>`
+holds the current table and swaps a freshly compiled one in atomically on
+SIGHUP or when the file changes, so in-flight requests keep the table they
+started with.
+
+Configuration format::
+
+    # comment
+    host "app2.local" {
+        proxy_set_header Host $host;
+        proxy_pass http://127.0.0.1:9002 weight=3;
+        proxy_pass http://127.0.0.1:9003;
+        dist_policy round-robin;
+        proxy_connect_timeout 2s;
+        proxy_read_timeout 10s;
+        proxy_timeout 30s;
+        proxy_retries 1;
+        proxy_retry_budget 0.2;
+        proxy_hedge on;
+        proxy_pool_size 32;
+        proxy_cache on;
+        proxy_cache_valid 5s;
+        proxy_coalesce on;
+    }
+
+A directive ends at ``;`` or at the end of its line, which keeps older
+files such as ``dist_policy round-robin`` without ``;`` valid.
+"""
+import os
+import signal
+import threading
+import time
+from collections import namedtuple
+from collections.abc import Mapping
+from types import MappingProxyType
+
+#: Distribution policies understood by the proxy.
+DIST_POLICIES = ("round-robin", "random")
+
+#: A backend server of a route.
+Upstream = namedtuple("Upstream", ["host", "port", "weight"])
+
+#: Compiled, immutable settings of one virtual host.
+Route = namedtuple("Route", [
+    "host",             # virtual host name
+    "upstreams",        # tuple of Upstream
+    "policy",           # one of DIST_POLICIES
+    "headers",          # tuple of (name, value) from proxy_set_header
+    "connect_timeout",  # seconds or None
+    "read_timeout",     # seconds or None
+    "timeout",          # total seconds or None
+    "retries",          # extra attempts of idempotent requests on another upstream
+    "retry_budget",     # retries allowed per request, as a ratio
+    "hedge",            # bool, send a second attempt after the p95 latency
+    "pool_size",        # max concurrent connections per upstream, 0 = unbounded
+    "cache",            # bool
+    "cache_valid",      # seconds a cached response stays fresh
+    "coalesce",         # bool, share one upstream fetch between identical GETs
+])
+
+ROUTE_DEFAULTS = {
+    "policy": "round-robin",
+    "connect_timeout": None,
+    "read_timeout": None,
+    "timeout": None,
+    "retries": 1,
+    "retry_budget": 0.2,
+    "hedge": False,
+    "pool_size": 0,
+    "cache": False,
+    "cache_valid": 0.0,
+    "coalesce": True,
+}
+
+#: Route used for hosts that are not configured (default timeouts, no retries).
+DEFAULT_ROUTE = Route(host="", upstreams=(), headers=(), **dict(ROUTE_DEFAULTS, retries=0))
+
+#: Token kinds produced by :func:`tokenize`.
+WORD, STRING, LBRACE, RBRACE, SEMI, NEWLINE = (
+    "WORD", "STRING", "LBRACE", "RBRACE", "SEMI", "NEWLINE")
+
+Token = namedtuple("Token", ["kind", "value", "line"])
+
+
+class ConfigError(ValueError):
+    """Raised when the proxy configuration cannot be parsed or compiled."""
+
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = "line {}: {}".format(line, message)
+        super().__init__(message)
+        self.line = line
+
+
+def tokenize(text):
+    """
+    Splits configuration text into tokens.
+
+    :params text (str): configuration source.
+    :rtype list: list of :class:`Token`.
+    """
+    tokens = []
+    line = 1
+    i = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == "\n":
+            tokens.append(Token(NEWLINE, c, line))
+            line += 1
+            i += 1
+        elif c in " \t\r":
+            i += 1
+        elif c == "#":
+            while i < n and text[i] != "\n":
+                i += 1
+        elif c == "{":
+            tokens.append(Token(LBRACE, c, line))
+            i += 1
+        elif c == "}":
+            tokens.append(Token(RBRACE, c, line))
+            i += 1
+        elif c == ";":
+            tokens.append(Token(SEMI, c, line))
+            i += 1
+        elif c in "\"'":
+            end = text.find(c, i + 1)
+            if end < 0 or "\n" in text[i + 1:end]:
+                raise ConfigError("unterminated string", line)
+            tokens.append(Token(STRING, text[i + 1:end], line))
+            i = end + 1
+        else:
+            start = i
+            while i < n and text[i] not in " \t\r\n{};#\"'":
+                i += 1
+            tokens.append(Token(WORD, text[start:i], line))
+    return tokens
+
+
+def parse(text):
+    """
+    Parses configuration text into raw host blocks.
+
+    :params text (str): configuration source.
+    :rtype list: list of (host, [(directive, [args], line), ...]).
+    """
+    tokens = tokenize(text)
+    blocks = []
+    pos = 0
+
+    def skip_newlines(p):
+        while p < len(tokens) and tokens[p].kind == NEWLINE:
+            p += 1
+        return p
+
+    while True:
+        pos = skip_newlines(pos)
+        if pos >= len(tokens):
+            break
+        tok = tokens[pos]
+        if tok.kind != WORD or tok.value != "host":
+            raise ConfigError("expected 'host', got {!r}".format(tok.value), tok.line)
+        pos = skip_newlines(pos + 1)
+        if pos >= len(tokens) or tokens[pos].kind not in (STRING, WORD):
+            raise ConfigError("expected host name", tok.line)
+        host = tokens[pos].value
+        pos = skip_newlines(pos + 1)
+        if pos >= len(tokens) or tokens[pos].kind != LBRACE:
+            raise ConfigError("expected '{{' after host {!r}".format(host), tok.line)
+        pos += 1
+
+        directives = []
+        current = None
+        while True:
+            if pos >= len(tokens):
+                raise ConfigError("unterminated block for host {!r}".format(host), tok.line)
+            t = tokens[pos]
+            pos += 1
+            if t.kind in (WORD, STRING):
+                if current is None:
+                    if t.kind != WORD:
+                        raise ConfigError("expected directive name", t.line)
+                    current = (t.value, [], t.line)
+                else:
+                    current[1].append(t.value)
+            elif t.kind in (SEMI, NEWLINE, RBRACE):
+                if current is not None:
+                    directives.append(current)
+                    current = None
+                elif t.kind == SEMI:
+                    raise ConfigError("empty directive", t.line)
+                if t.kind == RBRACE:
+                    break
+            else:
+                raise ConfigError("unexpected {!r}".format(t.value), t.line)
+        blocks.append((host, directives))
+    return blocks
+
+
+def parse_duration(value, line=None):
+    """
+    Converts "500ms", "2s", "1m" or a bare number of seconds to seconds.
+
+    :params value (str): duration literal.
+    :rtype float: seconds.
+    """
+    units = (("ms", 0.001), ("s", 1.0), ("m", 60.0), ("h", 3600.0))
+    for suffix, scale in units:
+        if value.endswith(suffix) and value[:-len(suffix)]:
+            number = value[:-len(suffix)]
+            break
+    else:
+        number, scale = value, 1.0
+    try:
+        seconds = float(number) * scale
+    except ValueError:
+        raise ConfigError("invalid duration {!r}".format(value), line)
+    if seconds < 0:
+        raise ConfigError("negative duration {!r}".format(value), line)
+    return seconds
+
+
+def parse_upstream(args, line):
+    """
+    Compiles the arguments of a ``proxy_pass`` directive.
+
+    :params args (list): ["http://host:port", "weight=N"?].
+    :rtype Upstream: the compiled upstream.
+    """
+    if not args:
+        raise ConfigError("proxy_pass needs an address", line)
+    address = args[0]
+    if address.startswith("http://"):
+        address = address[len("http://"):]
+    address = address.rstrip("/")
+    host, sep, port = address.rpartition(":")
+    if not sep or not host:
+        raise ConfigError("proxy_pass address must be host:port", line)
+    try:
+        port = int(port)
+    except ValueError:
+        raise ConfigError("invalid port in {!r}".format(args[0]), line)
+    weight = 1
+    for option in args[1:]:
+        key, _, value = option.partition("=")
+        if key != "weight":
+            raise ConfigError("unknown proxy_pass option {!r}".format(option), line)
+        try:
+            weight = int(value)
+        except ValueError:
+            raise ConfigError("invalid weight {!r}".format(value), line)
+        if weight < 1:
+            raise ConfigError("weight must be >= 1", line)
+    return Upstream(host, port, weight)
+
+
+def _one_arg(name, args, line):
+    if len(args) != 1:
+        raise ConfigError("{} takes exactly one argument".format(name), line)
+    return args[0]
+
+
+def _flag(name, args, line):
+    value = _one_arg(name, args, line)
+    if value not in ("on", "off"):
+        raise ConfigError("{} expects on|off".format(name), line)
+    return value == "on"
+
+
+def _count(name, args, line):
+    value = _one_arg(name, args, line)
+    try:
+        number = int(value)
+    except ValueError:
+        raise ConfigError("{} expects an integer".format(name), line)
+    if number < 0:
+        raise ConfigError("{} must not be negative".format(name), line)
+    return number
+
+
+def compile_host(host, directives):
+    """
+    Compiles the directives of one host block into a :class:`Route`.
+
+    :params host (str): virtual host name.
+    :params directives (list): raw directives returned by :func:`parse`.
+    :rtype Route: the compiled route.
+    """
+    settings = dict(ROUTE_DEFAULTS)
+    upstreams = []
+    headers = []
+    for name, args, line in directives:
+        if name == "proxy_pass":
+            upstreams.append(parse_upstream(args, line))
+        elif name == "proxy_set_header":
+            if len(args) != 2:
+                raise ConfigError("proxy_set_header takes a name and a value", line)
+            headers.append((args[0], args[1]))
+        elif name == "dist_policy":
+            policy = _one_arg(name, args, line)
+            if policy not in DIST_POLICIES:
+                raise ConfigError("unknown dist_policy {!r}".format(policy), line)
+            settings["policy"] = policy
+        elif name == "proxy_connect_timeout":
+            settings["connect_timeout"] = parse_duration(_one_arg(name, args, line), line)
+        elif name == "proxy_read_timeout":
+            settings["read_timeout"] = parse_duration(_one_arg(name, args, line), line)
+        elif name == "proxy_timeout":
+            settings["timeout"] = parse_duration(_one_arg(name, args, line), line)
+        elif name == "proxy_retries":
+            settings["retries"] = _count(name, args, line)
+        elif name == "proxy_retry_budget":
+            value = _one_arg(name, args, line)
+            try:
+                settings["retry_budget"] = float(value)
+            except ValueError:
+                raise ConfigError("proxy_retry_budget expects a ratio", line)
+            if not 0 <= settings["retry_budget"] <= 1:
+                raise ConfigError("proxy_retry_budget must be between 0 and 1", line)
+        elif name == "proxy_hedge":
+            settings["hedge"] = _flag(name, args, line)
+        elif name == "proxy_pool_size":
+            settings["pool_size"] = _count(name, args, line)
+        elif name == "proxy_cache":
+            settings["cache"] = _flag(name, args, line)
+        elif name == "proxy_cache_valid":
+            settings["cache_valid"] = parse_duration(_one_arg(name, args, line), line)
+        elif name == "proxy_coalesce":
+            settings["coalesce"] = _flag(name, args, line)
+        else:
+            raise ConfigError("unknown directive {!r}".format(name), line)
+    return Route(host=host, upstreams=tuple(upstreams), headers=tuple(headers), **settings)
+
+
+class RoutingTable(Mapping):
+    """
+    Immutable mapping of virtual host names to compiled :class:`Route` objects.
+
+    :attrs version (int): increasing number of the reload that produced it.
+    :attrs source (str): path of the configuration file, if any.
+    """
+
+    def __init__(self, routes, version=0, source=None):
+        self._routes = MappingProxyType(dict(routes))
+        self.version = version
+        self.source = source
+
+    def __getitem__(self, host):
+        return self._routes[host]
+
+    def __iter__(self):
+        return iter(self._routes)
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __repr__(self):
+        return "<RoutingTable v{} {} hosts>".format(self.version, len(self))
+
+    def legacy(self):
+        """
+        Returns the routes in the ``{host: (target | [targets], policy)}``
+        format produced by the former regex parser.
+
+        :rtype dict: legacy routes.
+        """
+        routes = {}
+        for host, route in self._routes.items():
+            targets = ["{}:{}".format(u.host, u.port) for u in route.upstreams]
+            if len(targets) == 1:
+                routes[host] = (targets[0], route.policy)
+            else:
+                routes[host] = (targets, route.policy)
+        return routes
+
+
+def compile_config(text, version=0, source=None):
+    """
+    Parses and compiles configuration text.
+
+    :params text (str): configuration source.
+    :params version (int): version stamped on the table.
+    :params source (str): path the text was read from.
+    :rtype RoutingTable: the compiled table.
+    """
+    routes = {}
+    for host, directives in parse(text):
+        if host in routes:
+            raise ConfigError("duplicate host {!r}".format(host))
+        routes[host] = compile_host(host, directives)
+    return RoutingTable(routes, version, source)
+
+
+def load_config(path, version=0):
+    """
+    Reads and compiles a configuration file.
+
+    :params path (str): path to the configuration file.
+    :rtype RoutingTable: the compiled table.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+    return compile_config(text, version, path)
+
+
+class ConfigReloader:
+    """
+    Holds the current :class:`RoutingTable` of a configuration file and
+    replaces it when the file is reloaded.
+
+    Readers call :meth:`current` once per request and keep the returned
+    table for the whole request; a reload only rebinds ``self.table``, which
+    is atomic, so traffic is never interrupted. A configuration that fails
+    to compile is reported and the previous table stays in service.
+
+    Usage::
+
+      >>> reloader = ConfigReloader("config/proxy.conf")
+      >>> reloader.install_signal_handler()
+      >>> reloader.watch()
+      >>> route = reloader.current().get("app1.local")
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = self._stat()
+        self.table = load_config(path, version=1)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def current(self):
+        """Returns the routing table currently in service."""
+        return self.table
+
+    def reload(self):
+        """
+        Recompiles the configuration file and swaps the new table in.
+
+        :rtype bool: True if a new table is in service.
+        """
+        with self.lock:
+            self.mtime = self._stat()
+            try:
+                table = load_config(self.path, version=self.table.version + 1)
+            except (OSError, ConfigError) as e:
+                print("[Proxy] Config reload failed, keeping v{}: {}".format(self.table.version, e))
+                return False
+            self.table = table
+        print("[Proxy] Loaded config v{} with {} hosts".format(table.version, len(table)))
+        return True
+
+    def install_signal_handler(self):
+        """Reloads on SIGHUP. Must be called from the main thread."""
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+
+    def watch(self, interval=1.0):
+        """
+        Starts a daemon thread reloading the table when the file changes.
+
+        :params interval (float): polling period in seconds.
+        """
+        def poll():
+            while True:
+                time.sleep(interval)
+                if self._stat() != self.mtime:
+                    self.reload()
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        return thread
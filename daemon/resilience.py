@@ -0,0 +1,229 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+daemon.resilience
+~~~~~~~~~~~~~~~~~
+
+This module provides the building blocks the proxy engines use to keep a slow
+or failing backend from pinning connections: deadlines, a retry budget, a
+latency window for hedged requests and per-upstream connection limits.
+
+- :class:`Deadline <Deadline>` bounds the total time spent on a request.
+- :class:`RetryBudget <RetryBudget>` lets only a fraction of requests be
+  retried, so retries cannot multiply the load on an already failing backend.
+- :class:`LatencyWindow <LatencyWindow>` tracks recent time-to-first-byte
+  samples and provides the p95 used as the hedging delay.
+- :class:`RoutePolicy <RoutePolicy>` groups the state above for one route.
+"""
+import threading
+import time
+from collections import deque
+
+#: Methods that can safely be sent twice (RFC 9110, section 9.2.2).
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "TRACE", "PUT", "DELETE"))
+
+#: Timeouts applied when a route does not configure its own.
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 60.0
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an attempt against one upstream fails.
+
+    :attrs status (int): status returned to the client if no retry succeeds
+                         (404 unreachable, 502 broken response, 503 pool
+                         exhausted, 504 timeout).
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Deadline:
+    """
+    Total time budget of a request, shared by all its attempts.
+
+    :params timeout (float): seconds, or None for no total limit.
+    """
+
+    def __init__(self, timeout=None):
+        self.expires = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self):
+        """Seconds left, or None if unbounded."""
+        if self.expires is None:
+            return None
+        return self.expires - time.monotonic()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def clamp(self, timeout):
+        """
+        Returns the smaller of timeout and the remaining time.
+
+        :raises UpstreamError: 504 if the deadline has passed.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise UpstreamError(504, "request deadline exceeded")
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a ratio of the request rate.
+
+    Every request deposits ``ratio`` tokens and every retry or hedge withdraws
+    one. A small reserve refilled at ``min_per_sec`` keeps retries possible
+    at low traffic.
+    """
+
+    def __init__(self, ratio=0.2, min_per_sec=5.0, cap=100.0):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.cap = cap
+        self.balance = 0.0
+        self.reserve = min_per_sec
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.balance = min(self.cap, self.balance + self.ratio)
+
+    def withdraw(self):
+        """
+        Takes one token for a retry.
+
+        :rtype bool: False if the budget is exhausted.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.reserve = min(self.min_per_sec,
+                               self.reserve + (now - self.updated) * self.min_per_sec)
+            self.updated = now
+            if self.balance >= 1:
+                self.balance -= 1
+                return True
+            if self.reserve >= 1:
+                self.reserve -= 1
+                return True
+            return False
+
+
+class LatencyWindow:
+    """
+    Sliding window of the most recent latency samples of a route.
+
+    The percentile is recomputed every ``refresh`` samples instead of on every
+    request, which keeps the cost per request constant.
+    """
+
+    def __init__(self, size=512, min_samples=20, refresh=32):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.refresh = refresh
+        self.pending = 0
+        self.cached = None
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.pending += 1
+
+    def percentile(self, q=0.95):
+        """
+        Returns the q-quantile of the window, or None if there are too few
+        samples to be meaningful.
+        """
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            if self.cached is None or self.pending >= self.refresh:
+                ordered = sorted(self.samples)
+                self.cached = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+                self.pending = 0
+            return self.cached
+
+
+class RoutePolicy:
+    """
+    Mutable runtime state attached to an immutable route: its retry budget,
+    its latency window and its per-upstream connection slots.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.budget = RetryBudget(route.retry_budget)
+        self.latency = LatencyWindow()
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    @property
+    def connect_timeout(self):
+        if self.route.connect_timeout is None:
+            return DEFAULT_CONNECT_TIMEOUT
+        return self.route.connect_timeout
+
+    @property
+    def read_timeout(self):
+        if self.route.read_timeout is None:
+            return DEFAULT_READ_TIMEOUT
+        return self.route.read_timeout
+
+    def slot(self, upstream, factory=threading.BoundedSemaphore):
+        """
+        Returns the semaphore limiting concurrent connections to an upstream,
+        or None if the route has no pool size.
+        """
+        if not self.route.pool_size:
+            return None
+        key = (upstream.host, upstream.port, factory)
+        with self.lock:
+            sem = self.slots.get(key)
+            if sem is None:
+                sem = self.slots[key] = factory(self.route.pool_size)
+            return sem
+
+
+_POLICIES = {}
+_POLICIES_LOCK = threading.Lock()
+
+
+def policy_for(route, version=0):
+    """
+    Returns the :class:`RoutePolicy` of a route, creating a fresh one when the
+    routing table was reloaded.
+
+    :params route (Route): compiled route.
+    :params version (int): version of the table the route belongs to.
+    """
+    with _POLICIES_LOCK:
+        entry = _POLICIES.get(route.host)
+        if entry is None or entry[0] != version:
+            entry = _POLICIES[route.host] = (version, RoutePolicy(route))
+        return entry[1]
+
+
+def request_method(request):
+    """Returns the method of a raw request (str or bytes)."""
+    if isinstance(request, bytes):
+        request = request[:16].decode('latin-1')
+    return request.split(' ', 1)[0].upper()
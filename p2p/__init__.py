@@ -0,0 +1,20 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p
+~~~~~~~~~~~~~~~~~
+
+Shared building blocks of the hybrid chat application: the wire protocol
+spoken by ``tracker.py`` and ``peer.py`` and the client used to reach the
+tracker.
+"""
@@ -0,0 +1,118 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.addrcache
+~~~~~~~~~~~~~~~~~
+
+This module caches the addresses peers resolve through the tracker.
+
+- Found addresses are kept ``ttl`` seconds, so a peer that moved is looked
+  up again instead of being dialed at its old address forever.
+- Usernames the tracker does not know are cached as :data:`NOT_FOUND` for
+  ``negative_ttl`` seconds, so sending to a missing peer does not cost a
+  ``LOOKUP`` per attempt.
+- :meth:`AddressCache.invalidate` drops an entry when connecting to it
+  failed; :meth:`AddressCache.update` fills many entries at once from a
+  peer list or tracker events (prefetch).
+
+At most ``max_entries`` are kept, the least recently used are evicted.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+#: Cached answer for a username the tracker does not know.
+NOT_FOUND = object()
+
+
+class AddressCache:
+    """
+    TTL cache of username -> (ip, port), with negative entries.
+
+    Usage::
+
+      >>> cache = AddressCache(ttl=60, negative_ttl=10)
+      >>> cache.put('bob', ('10.0.0.2', 8002))
+      >>> cache.get('bob')
+      ('10.0.0.2', 8002)
+      >>> cache.put('zed', None)
+      >>> cache.get('zed') is NOT_FOUND
+      True
+      >>> cache.get('carol')       # unknown or expired: ask the tracker
+      None
+
+    :params ttl (float): seconds a found address stays valid.
+    :params negative_ttl (float): seconds a not-found answer stays valid.
+    :params max_entries (int): entries kept before the least recently used are evicted.
+    """
+
+    def __init__(self, ttl=60.0, negative_ttl=10.0, max_entries=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, username):
+        """Returns the address, :data:`NOT_FOUND`, or None if not cached."""
+        with self.lock:
+            entry = self.entries.get(username)
+            if entry is None or entry[1] <= self.clock():
+                if entry is not None:
+                    del self.entries[username]
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(username)
+            if entry[0] is NOT_FOUND:
+                self.stats['negative_hits'] += 1
+            else:
+                self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, username, addr):
+        """Caches addr, or a negative entry if addr is None."""
+        with self.lock:
+            self._put(username, addr, self.clock())
+
+    def _put(self, username, addr, now):
+        if addr is None:
+            self.entries[username] = (NOT_FOUND, now + self.negative_ttl)
+        else:
+            self.entries[username] = (tuple(addr), now + self.ttl)
+        self.entries.move_to_end(username)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def update(self, addresses):
+        """Caches many addresses at once ({username: (ip, port) or None})."""
+        with self.lock:
+            now = self.clock()
+            for username, addr in addresses.items():
+                self._put(username, addr, now)
+
+    def invalidate(self, username):
+        """Forgets username, e.g. after connecting to its cached address failed."""
+        with self.lock:
+            if self.entries.pop(username, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def missing(self, usernames):
+        """The usernames of the list that have no valid entry (to prefetch)."""
+        with self.lock:
+            now = self.clock()
+            return [u for u in usernames if u not in self.entries or self.entries[u][1] <= now]
+
+    def __len__(self):
+        return len(self.entries)
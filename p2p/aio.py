@@ -0,0 +1,335 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.aio
+~~~~~~~~~~~~~~~~~
+
+asyncio versions of the peer-side connections, for peers running on one
+event loop (``peer.AsyncPeer``):
+
+- :class:`AsyncTrackerClient <AsyncTrackerClient>` speaks the framed tracker
+  protocol of :class:`p2p.client.TrackerClient`. Requests are multiplexed by
+  request id on one connection, so concurrent callers never wait for each
+  other's round trips.
+- :class:`AsyncPeerStream <AsyncPeerStream>` and
+  :class:`AsyncStreamPool <AsyncStreamPool>` speak the batched, windowed
+  message protocol of :mod:`p2p.peerwire`, so threaded and asyncio peers
+  talk to each other unchanged.
+
+Nothing here starts a thread: a process can host thousands of peers.
+"""
+import asyncio
+import socket
+import time
+from collections import deque
+
+from .protocol import PUSH_ID, MAX_FRAME, FrameDecoder, ProtocolError, encode_frame
+
+
+def _nodelay(writer):
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class AsyncTrackerClient:
+    """
+    Persistent framed connection to the tracker, for coroutines.
+
+    Usage::
+
+      >>> tracker = AsyncTrackerClient('localhost', 9000)
+      >>> await tracker.call('LOOKUP:*')
+      'PEERS:{"peers": [...]}'
+
+    :params host (str): tracker host.
+    :params port (int): tracker port.
+    :params timeout (float): connect and response timeout in seconds.
+    """
+
+    def __init__(self, host='localhost', port=9000, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.writer = None
+        self.pending = {}
+        self.next_id = 1
+        self.connecting = None
+        self.read_task = None  # Strong reference: the loop only keeps weak ones to tasks
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        _nodelay(writer)
+        self.writer = writer
+        self.read_task = asyncio.ensure_future(self._read_loop(reader, writer))
+
+    async def _read_loop(self, reader, writer):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    raise ConnectionError("tracker closed the connection")
+                decoder.feed(data)
+                for req_id, payload in decoder.frames():
+                    future = self.pending.pop(req_id, None)
+                    if req_id != PUSH_ID and future is not None and not future.done():
+                        future.set_result(payload.decode('utf-8').strip())
+        except (OSError, ProtocolError) as e:
+            if self.writer is writer:
+                self._drop(e)
+
+    def _drop(self, error):
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
+        if self.read_task is not None and self.read_task is not asyncio.current_task():
+            self.read_task.cancel()
+        self.read_task = None
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(str(error)))
+
+    async def _exchange(self, commands):
+        if self.writer is None:
+            raise ConnectionError("tracker connection lost")
+        loop = asyncio.get_running_loop()
+        futures = []
+        frames = []
+        for command in commands:
+            req_id = self.next_id
+            self.next_id = self.next_id % 0xFFFFFFFF + 1
+            future = self.pending[req_id] = loop.create_future()
+            futures.append(future)
+            frames.append(encode_frame(req_id, command))
+        self.writer.write(b''.join(frames))
+        await self.writer.drain()
+        try:
+            return list(await asyncio.wait_for(asyncio.gather(*futures), self.timeout))
+        except asyncio.TimeoutError:
+            self._drop("tracker timed out")
+            raise ConnectionError("tracker timed out")
+
+    async def call_many(self, commands):
+        """
+        Sends several commands in one write and waits for all responses.
+        A connection found broken is reopened and the batch is sent once more.
+
+        :rtype list: response strings, in the order of commands.
+        :raises OSError: if the tracker cannot be reached.
+        """
+        reused = self.writer is not None
+        for attempt in range(2):
+            if self.writer is None:
+                # One connect shared by every coroutine calling meanwhile
+                if self.connecting is None:
+                    self.connecting = asyncio.ensure_future(self._connect())
+                try:
+                    await asyncio.shield(self.connecting)
+                finally:
+                    if self.connecting is not None and self.connecting.done():
+                        self.connecting = None
+            try:
+                return await self._exchange(commands)
+            except OSError as e:
+                self._drop(e)
+                if not reused or attempt:
+                    raise
+
+    async def call(self, command):
+        """Sends one command and returns the response string."""
+        return (await self.call_many([command]))[0]
+
+    def close(self):
+        self._drop("client closed")
+
+
+class AsyncPeerStream:
+    """
+    Framed, windowed connection to one peer (see :class:`p2p.peerwire.PeerStream`).
+    Messages queued while the writer waits are packed into one frame.
+    """
+
+    def __init__(self, reader, writer, window=1024, max_batch_bytes=256 * 1024):
+        self.writer = writer
+        self.window = window
+        self.max_batch_bytes = min(max_batch_bytes, MAX_FRAME - 4)
+        self.queue = deque()
+        self.inflight = deque()
+        self.next_seq = 1
+        self.error = None
+        self.wakeup = asyncio.Event()
+        self.last_used = time.monotonic()
+        self.stats = {'messages': 0, 'frames': 0, 'acks': 0}
+        self.tasks = [asyncio.ensure_future(self._write_loop()), asyncio.ensure_future(self._read_loop(reader))]
+
+    @classmethod
+    async def open(cls, addr, window=1024, timeout=5.0):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*addr), timeout)
+        _nodelay(writer)
+        return cls(reader, writer, window)
+
+    def send(self, message):
+        """
+        Queues one message (bytes, without newline).
+
+        :rtype asyncio.Future: True when acknowledged, False if rejected.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if self.error is not None:
+            future.set_exception(self.error)
+            return future
+        self.queue.append((self.next_seq, message, future))
+        self.next_seq += 1
+        self.last_used = time.monotonic()
+        self.wakeup.set()
+        return future
+
+    def idle(self):
+        return not self.queue and not self.inflight
+
+    async def _write_loop(self):
+        try:
+            while self.error is None:
+                if not self.queue or len(self.inflight) >= self.window:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                batch = []
+                size = 0
+                first_seq = self.queue[0][0]
+                while self.queue and len(self.inflight) < self.window:
+                    seq, message, future = self.queue[0]
+                    if batch and size + len(message) + 1 > self.max_batch_bytes:
+                        break
+                    self.queue.popleft()
+                    self.inflight.append((seq, future))
+                    batch.append(message)
+                    size += len(message) + 1
+                self.writer.write(encode_frame(first_seq, b'\n'.join(batch)))
+                self.stats['messages'] += len(batch)
+                self.stats['frames'] += 1
+                await self.writer.drain()
+        except (OSError, ProtocolError) as e:
+            self._fail(e if isinstance(e, OSError) else ConnectionError(str(e)))
+
+    async def _read_loop(self, reader):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    raise ConnectionError("peer closed the connection")
+                decoder.feed(data)
+                for acked, payload in decoder.frames():
+                    rejected = set()
+                    if payload.startswith(b'ACK:'):
+                        rejected = {int(s) for s in payload[4:].split(b',') if s}
+                    while self.inflight and self.inflight[0][0] <= acked:
+                        seq, future = self.inflight.popleft()
+                        if not future.done():
+                            future.set_result(seq not in rejected)
+                    self.stats['acks'] += 1
+                self.last_used = time.monotonic()
+                self.wakeup.set()
+        except (OSError, ValueError) as e:
+            self._fail(e if isinstance(e, OSError) else ConnectionError(str(e)))
+
+    def _fail(self, error):
+        if self.error is not None:
+            return
+        self.error = error
+        failed = [f for _, f in self.inflight] + [f for _, _, f in self.queue]
+        self.inflight.clear()
+        self.queue.clear()
+        self.wakeup.set()
+        self.writer.close()
+        for future in failed:
+            if not future.done():
+                future.set_exception(error)
+        current = asyncio.current_task()
+        for task in self.tasks:
+            if task is not current:
+                task.cancel()
+
+    def close(self):
+        """Closes the stream; messages not yet acknowledged fail."""
+        self._fail(ConnectionError("stream closed"))
+
+
+class AsyncStreamPool:
+    """
+    One :class:`AsyncPeerStream` per destination, reopened when broken;
+    :meth:`evict_idle` closes the streams unused for ``idle_timeout`` seconds.
+    """
+
+    def __init__(self, idle_timeout=60.0, window=1024, timeout=5.0):
+        self.idle_timeout = idle_timeout
+        self.window = window
+        self.timeout = timeout
+        self.streams = {}
+        self.connecting = {}
+
+    async def get(self, addr, timeout=None):
+        """
+        Returns a working stream to addr, connecting if needed.
+
+        :params timeout (float): how long this caller waits for the connect,
+                                 instead of the pool's timeout.
+        :raises OSError: if addr cannot be reached.
+        """
+        stream = self.streams.get(addr)
+        if stream is not None and stream.error is None:
+            return stream
+        # Coroutines sending to the same peer meanwhile share one connect
+        pending = self.connecting.get(addr)
+        if pending is None:
+            pending = self.connecting[addr] = asyncio.ensure_future(
+                AsyncPeerStream.open(addr, self.window, self.timeout))
+        try:
+            stream = await asyncio.wait_for(asyncio.shield(pending), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError(f"connect to {addr} timed out")
+        finally:
+            if self.connecting.get(addr) is pending and pending.done():
+                del self.connecting[addr]
+        self.streams[addr] = stream
+        return stream
+
+    async def send(self, addr, message, timeout=None):
+        """
+        Sends one message to addr.
+
+        :params timeout (float): connect timeout, see :meth:`get`.
+        :rtype asyncio.Future: see :meth:`AsyncPeerStream.send`.
+        :raises OSError: if addr cannot be reached.
+        """
+        return (await self.get(addr, timeout)).send(message)
+
+    def discard(self, addr):
+        """Closes the stream to addr, e.g. after an acknowledgement timed out."""
+        stream = self.streams.pop(addr, None)
+        if stream is not None:
+            stream.close()
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for addr, stream in list(self.streams.items()):
+            if stream.error is not None or (stream.last_used < deadline and stream.idle()):
+                self.discard(addr)
+
+    def close(self):
+        streams, self.streams = list(self.streams.values()), {}
+        for stream in streams:
+            stream.close()
@@ -0,0 +1,106 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.channels
+~~~~~~~~~~~~~~~~~
+
+This module tracks chat channel membership on the tracker.
+
+Tracker commands::
+
+    JOIN:<channel>:<username>                 -> ACK:Joined
+    PART:<channel>:<username>                 -> ACK:Left
+    MEMBERS:<channel>[:<limit>[:<cursor>]]    -> MEMBERS:{"channel", "members", "next"}
+
+``members`` is a page of usernames in order; peers resolve addresses the
+usual way (their peer list or ``LOOKUP``) and send a channel message only
+to the members instead of to every registered peer.
+
+Channel names are restricted to :data:`CHANNEL_NAME`, since peers also use
+them as directory names for the channel history.
+"""
+import re
+import threading
+from bisect import bisect_right
+
+#: Allowed channel names.
+CHANNEL_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def valid_channel(name):
+    return isinstance(name, str) and CHANNEL_NAME.match(name) is not None
+
+
+class ChannelRegistry:
+    """
+    Members of every channel, with the reverse index needed to remove a peer
+    from all its channels when it leaves or expires.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self.channels_of = {}
+        self.lock = threading.Lock()
+
+    def join(self, channel, username):
+        """Adds username to channel; returns False if it was already a member."""
+        with self.lock:
+            members = self.members.setdefault(channel, set())
+            if username in members:
+                return False
+            members.add(username)
+            self.channels_of.setdefault(username, set()).add(channel)
+            return True
+
+    def part(self, channel, username):
+        """Removes username from channel; returns False if it was not a member."""
+        with self.lock:
+            members = self.members.get(channel)
+            if not members or username not in members:
+                return False
+            self._discard(channel, username)
+            return True
+
+    def remove_user(self, username):
+        """Removes username from all its channels."""
+        with self.lock:
+            for channel in list(self.channels_of.get(username, ())):
+                self._discard(channel, username)
+
+    def _discard(self, channel, username):
+        members = self.members[channel]
+        members.discard(username)
+        if not members:
+            del self.members[channel]
+        channels = self.channels_of[username]
+        channels.discard(channel)
+        if not channels:
+            del self.channels_of[username]
+
+    def page(self, channel, limit, cursor=''):
+        """
+        Returns a page of members of channel in username order, after cursor.
+
+        :rtype dict: {'channel', 'members', 'next'}.
+        """
+        with self.lock:
+            names = sorted(self.members.get(channel, ()))
+        start = bisect_right(names, cursor) if cursor else 0
+        page = names[start:start + limit]
+        more = start + limit < len(names)
+        return {'channel': channel, 'members': page, 'next': page[-1] if more else None}
+
+    def stats(self):
+        with self.lock:
+            return {'channels': len(self.members),
+                    'memberships': sum(len(m) for m in self.members.values())}
@@ -0,0 +1,342 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.client
+~~~~~~~~~~~~~~~~~
+
+This module provides :class:`TrackerClient <TrackerClient>`, which keeps one
+long-lived framed connection to the tracker and reuses it for every command.
+Several commands can be pipelined in a single write with :meth:`call_many`;
+responses are matched to their commands by request id.
+
+:class:`PeerDirectory <PeerDirectory>` keeps a local copy of the tracker
+registry: it downloads it once page by page, then only asks for the joins
+and leaves since the version it holds. With a
+:class:`TrackerSubscription <TrackerSubscription>` the tracker pushes those
+changes as they happen, and no polling is needed at all.
+"""
+import json
+import socket
+import threading
+
+from .protocol import FrameDecoder, ProtocolError, PUSH_ID, encode_frame, read_frame
+from .pubsub import parse_events
+
+#: Responses of a tracker shedding load; the command may be retried later.
+RETRY_LATER = ('NAK:Rate limited', 'NAK:Busy')
+
+
+class TrackerClient:
+    """
+    Persistent, thread-safe connection to the tracker.
+
+    Usage::
+
+      >>> tracker = TrackerClient('localhost', 9000)
+      >>> tracker.call('LOOKUP:*')
+      'PEERS:{"peers": [...]}'
+      >>> tracker.call_many(['LOOKUP:*', 'REGISTER:alice:10.0.0.1:8001'])
+      ['PEERS:{...}', 'ACK:Registered']
+
+    :params host (str): tracker host.
+    :params port (int): tracker port.
+    :params timeout (float): connect and read timeout in seconds.
+    """
+
+    def __init__(self, host='localhost', port=9000, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.decoder = None
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.decoder = FrameDecoder()
+
+    def _drop(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.decoder = None
+
+    def _exchange(self, commands):
+        ids = []
+        frames = []
+        for command in commands:
+            req_id = self.next_id
+            self.next_id = self.next_id % 0xFFFFFFFF + 1
+            ids.append(req_id)
+            frames.append(encode_frame(req_id, command))
+        self.sock.sendall(b''.join(frames))
+
+        responses = {}
+        while len(responses) < len(ids):
+            frame = read_frame(self.sock, self.decoder)
+            if frame is None:
+                raise ConnectionError("tracker closed the connection")
+            req_id, payload = frame
+            if req_id == PUSH_ID:
+                continue
+            responses[req_id] = payload.decode('utf-8').strip()
+        return [responses[req_id] for req_id in ids]
+
+    def call_many(self, commands):
+        """
+        Sends several commands in one write and waits for all responses.
+
+        A connection found broken is reopened and the batch is sent once more.
+
+        :params commands (list): tracker commands, e.g. ``LOOKUP:*``.
+        :rtype list: response strings, in the order of commands.
+        :raises OSError: if the tracker cannot be reached.
+        """
+        with self.lock:
+            reused = self.sock is not None
+            if not reused:
+                self._connect()
+            try:
+                return self._exchange(commands)
+            except (OSError, ProtocolError):
+                self._drop()
+                if not reused:
+                    raise
+            self._connect()
+            try:
+                return self._exchange(commands)
+            except (OSError, ProtocolError):
+                self._drop()
+                raise
+
+    def call(self, command):
+        """
+        Sends one command and returns the response string.
+
+        :raises OSError: if the tracker cannot be reached.
+        """
+        return self.call_many([command])[0]
+
+    def close(self):
+        with self.lock:
+            self._drop()
+
+
+class PeerDirectory:
+    """
+    Local replica of the tracker registry.
+
+    The first :meth:`sync` walks ``LOOKUP_PAGE`` pages and then replays
+    ``LOOKUP_SINCE`` from the version of the first page, which covers changes
+    made while paging. Later calls only transfer ``LOOKUP_SINCE`` deltas. If
+    the tracker answers ``RESYNC`` (its change log no longer covers our
+    version), the registry is downloaded again. Trackers that do not know
+    these commands are read with ``LOOKUP:*``.
+
+    Usage::
+
+      >>> directory = PeerDirectory(TrackerClient('localhost', 9000))
+      >>> directory.sync()
+      {'alice': ('10.0.0.1', 8001), ...}
+
+    :params tracker (TrackerClient): connection to the tracker.
+    :params page_size (int): peers per ``LOOKUP_PAGE`` request.
+    """
+
+    def __init__(self, tracker, page_size=500):
+        self.tracker = tracker
+        self.page_size = page_size
+        self.peers = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def _apply(self, delta):
+        for username in delta['leaves']:
+            self.peers.pop(username, None)
+        for p in delta['joins']:
+            self.peers[p['username']] = (p['ip'], p['port'])
+        self.version = delta['version']
+
+    def _since(self):
+        """Applies the delta since self.version; returns False on RESYNC."""
+        response = self.tracker.call(f"LOOKUP_SINCE:{self.version}")
+        if response.startswith('DELTA:'):
+            self._apply(json.loads(response[6:]))
+            return True
+        if response.startswith('RESYNC:'):
+            return False
+        raise ValueError(f"unexpected tracker response: {response[:80]}")
+
+    def _full(self):
+        peers = {}
+        version = None
+        cursor = ''
+        while True:
+            response = self.tracker.call(f"LOOKUP_PAGE:{cursor}:{self.page_size}")
+            if response.startswith(RETRY_LATER):
+                raise ValueError(f"tracker is overloaded: {response}")
+            if response.startswith('NAK'):
+                return self._legacy()
+            if not response.startswith('PAGE:'):
+                raise ValueError(f"unexpected tracker response: {response[:80]}")
+            page = json.loads(response[5:])
+            if version is None:
+                version = page['version']
+            for p in page['peers']:
+                peers[p['username']] = (p['ip'], p['port'])
+            cursor = page['next']
+            if cursor is None:
+                break
+        self.peers = peers
+        self.version = version
+        if not self._since():
+            self.version = None
+
+    def _legacy(self):
+        response = self.tracker.call("LOOKUP:*")
+        if not response.startswith('PEERS:'):
+            raise ValueError(f"unexpected tracker response: {response[:80]}")
+        data = json.loads(response[6:])
+        self.peers = {p['username']: (p['ip'], p['port']) for p in data['peers']}
+        self.version = None
+
+    def apply_events(self, events):
+        """
+        Applies events pushed by the tracker (see :mod:`p2p.pubsub`). Events
+        already covered are skipped; a gap in the versions or an ``R`` event
+        falls back to :meth:`sync`.
+
+        :rtype dict: copy of {username: (ip, port)}.
+        """
+        with self.lock:
+            for op, version, username, addr in events:
+                if self.version is not None and version <= self.version and op != 'R':
+                    continue
+                if op == 'R' or self.version is None or version != self.version + 1:
+                    break
+                if op == 'L':
+                    self.peers.pop(username, None)
+                else:
+                    self.peers[username] = addr
+                self.version = version
+            else:
+                return dict(self.peers)
+        return self.sync()
+
+    def sync(self):
+        """
+        Brings the replica up to date.
+
+        :rtype dict: copy of {username: (ip, port)}.
+        :raises OSError: if the tracker cannot be reached.
+        :raises ValueError: on an unexpected or malformed response.
+        """
+        with self.lock:
+            if self.version is None or not self._since():
+                self._full()
+            return dict(self.peers)
+
+
+class TrackerSubscription:
+    """
+    Dedicated connection on which the tracker pushes registry events.
+
+    Usage::
+
+      >>> directory.sync()
+      >>> sub = TrackerSubscription('localhost', 9000, directory.version,
+      ...                           lambda events: directory.apply_events(events))
+      >>> sub.start()
+
+    :params since (int): directory version; missed events are sent first.
+    :params on_events (callable): called from the reader thread with the
+                                  parsed events of every push frame.
+    :params on_close (callable): called once when the connection is lost.
+    """
+
+    def __init__(self, host, port, since, on_events, on_close=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.since = since
+        self.on_events = on_events
+        self.on_close = on_close
+        self.timeout = timeout
+        self.sock = None
+        self.version = None
+        self.running = False
+
+    def start(self):
+        """
+        Connects and subscribes.
+
+        :raises OSError: if the tracker cannot be reached or refuses.
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        command = 'SUBSCRIBE' if self.since is None else f"SUBSCRIBE:{self.since}"
+        sock.sendall(encode_frame(1, command))
+        decoder = FrameDecoder()
+        pushed = []
+        while True:
+            frame = read_frame(sock, decoder)
+            if frame is None:
+                sock.close()
+                raise ConnectionError("tracker closed the connection")
+            req_id, payload = frame
+            if req_id == PUSH_ID:
+                pushed.append(payload)
+                continue
+            response = payload.decode('utf-8')
+            break
+        if not response.startswith('ACK:Subscribed'):
+            sock.close()
+            raise ConnectionError(f"subscription refused: {response}")
+        self.version = int(response.rsplit(':', 1)[1])
+        # Events are pushed while idle for minutes; only connecting has a timeout.
+        sock.settimeout(None)
+        self.sock = sock
+        self.running = True
+        for payload in pushed:
+            self.on_events(parse_events(payload.decode('utf-8')))
+        threading.Thread(target=self._read_loop, args=(decoder,), daemon=True).start()
+
+    def _read_loop(self, decoder):
+        try:
+            while self.running:
+                frame = read_frame(self.sock, decoder)
+                if frame is None:
+                    break
+                req_id, payload = frame
+                if req_id == PUSH_ID:
+                    self.on_events(parse_events(payload.decode('utf-8')))
+        except (OSError, ValueError) as e:
+            if self.running:
+                print(f"[Subscription] Connection lost: {e}")
+        finally:
+            was_running, self.running = self.running, False
+            if was_running and self.on_close is not None:
+                self.on_close()
+
+    def close(self):
+        self.running = False
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
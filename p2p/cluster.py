@@ -0,0 +1,384 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.cluster
+~~~~~~~~~~~~~~~~~
+
+This module partitions the tracker registry across several tracker nodes.
+
+Usernames are placed on a consistent-hash ring with virtual nodes
+(:class:`HashRing <HashRing>`). The first node clockwise from a username owns
+it, and the next ``replicas - 1`` distinct nodes hold copies, so adding or
+removing a node only moves the keys next to it and a single node failure
+loses nothing.
+
+- :class:`ClusterClient <ClusterClient>` is a drop-in replacement for
+  :class:`p2p.client.TrackerClient`: it sends each command to the node owning
+  its username, fails over to the replicas, and scatter-gathers ``LOOKUP:*``
+  and the ``SEARCH`` commands.
+- :class:`ClusterNode <ClusterNode>` runs inside every tracker node. It
+  forwards commands that reached the wrong node (so old single-node clients
+  keep working), replicates writes to the successors and answers
+  ``LOOKUP:*`` and the ``SEARCH`` commands for the whole cluster.
+
+Nodes talk to each other with the normal tracker protocol. A command prefixed
+with ``LOCAL:`` is executed on the receiving node only, without routing or
+replication. Every command a node sends to another one (forwarded, replicated
+or scattered) is also prefixed with ``NODE:``; trackers accept that prefix only
+from a node address and do not rate-limit it. A few commands
+(:data:`INTERNAL_COMMANDS`) exist only between nodes and are accepted only
+with the ``NODE:`` prefix.
+"""
+import hashlib
+import json
+import queue
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import TrackerClient
+
+#: Prefix of commands executed on the receiving node only.
+LOCAL_PREFIX = 'LOCAL:'
+
+#: Prefix of commands sent by another node of the cluster.
+NODE_PREFIX = 'NODE:'
+
+#: Commands whose second field is the key they are routed by: the username,
+#: or the channel for the channel commands (see :mod:`p2p.channels`).
+KEYED_COMMANDS = ('REGISTER', 'LOOKUP', 'HEARTBEAT', 'JOIN', 'PART', 'MEMBERS')
+
+#: Commands that change the registry and are replicated.
+WRITE_COMMANDS = ('REGISTER', 'HEARTBEAT', 'JOIN', 'PART')
+
+#: Commands sent by nodes only: ``REFRESH:username:ip:port`` (a replicated
+#: heartbeat carrying the address) and ``PARTALL:username``.
+INTERNAL_COMMANDS = ('REFRESH', 'PARTALL')
+
+
+def parse_node(node):
+    """Splits "host:port" into (host, int port)."""
+    host, _, port = node.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent-hash ring with virtual nodes.
+
+    :params nodes (list): node ids ("host:port").
+    :params vnodes (int): points per node; more points spread keys more evenly.
+    """
+
+    def __init__(self, nodes, vnodes=64):
+        self.nodes = list(dict.fromkeys(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.owners_at = [node for _, node in points]
+
+    def owners(self, key, count=1):
+        """
+        Returns the first count distinct nodes clockwise from key: the owner
+        followed by its successors.
+        """
+        count = min(count, len(self.nodes))
+        result = []
+        index = bisect_right(self.hashes, _hash(key))
+        for step in range(len(self.hashes)):
+            node = self.owners_at[(index + step) % len(self.hashes)]
+            if node not in result:
+                result.append(node)
+                if len(result) == count:
+                    break
+        return result
+
+
+def routing_key(command):
+    """
+    Returns the username (or channel) a command is routed by, or None for
+    commands that are not tied to one key (``LOOKUP:*``, ``STATS``...).
+    """
+    name, _, rest = command.partition(':')
+    if name not in KEYED_COMMANDS or not rest:
+        return None
+    username = rest.split(':', 1)[0]
+    if name == 'LOOKUP' and username == '*':
+        return None
+    return username
+
+
+def merge_peers(responses):
+    """
+    Merges ``PEERS:`` responses of several shards into one, dropping the
+    duplicates held by replicas.
+    """
+    peers = {}
+    for response in responses:
+        if response and response.startswith('PEERS:'):
+            for p in json.loads(response[6:])['peers']:
+                peers.setdefault(p['username'], p)
+    return f"PEERS:{json.dumps({'peers': list(peers.values())})}"
+
+
+def merge_results(responses, limit):
+    """
+    Merges the ``RESULTS:`` pages of several shards (``SEARCH``, ``SEARCH_ANY``) into one page
+    of at most limit peers in username order. Versions are per node, so the
+    merged page has none.
+    """
+    peers = {}
+    more = False
+    for response in responses:
+        if response and response.startswith('RESULTS:'):
+            page = json.loads(response[8:])
+            more = more or page['next'] is not None
+            for p in page['peers']:
+                peers.setdefault(p['username'], p)
+    names = sorted(peers)
+    more = more or len(names) > limit
+    names = names[:limit]
+    page = {'version': None, 'peers': [peers[u] for u in names], 'next': names[-1] if more and names else None}
+    return f"RESULTS:{json.dumps(page)}"
+
+
+def is_search(command):
+    """True for the paged username searches, answered by every shard."""
+    return command.startswith('SEARCH:') or command.startswith('SEARCH_ANY:')
+
+
+def search_limit(command):
+    """Returns the limit of a ``SEARCH[_ANY]:query[:limit[:cursor]]`` command."""
+    parts = command.split(':')
+    try:
+        return int(parts[2]) if len(parts) > 2 and parts[2] else 50
+    except ValueError:
+        return 50
+
+
+class _ShardSet:
+    """Connections to a set of nodes plus a pool for scatter-gather."""
+
+    def __init__(self, nodes, replicas, vnodes, timeout):
+        self.ring = HashRing(nodes, vnodes)
+        self.replicas = replicas
+        self.clients = {node: TrackerClient(*parse_node(node), timeout=timeout) for node in self.ring.nodes}
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.ring.nodes)),
+                                       thread_name_prefix='tracker-scatter')
+
+    def call_node(self, node, command):
+        return self.clients[node].call(command)
+
+    def call_owners(self, key, command):
+        """Sends command to the owner of key, failing over to its replicas."""
+        error = None
+        for node in self.ring.owners(key, self.replicas):
+            try:
+                return self.call_node(node, command)
+            except OSError as e:
+                error = e
+        if error is not None:
+            raise error
+        raise ConnectionError(f"no node available for {key}")
+
+    def scatter(self, nodes, command):
+        """Sends command to every node in parallel; unreachable nodes give None."""
+        def one(node):
+            try:
+                return self.call_node(node, command)
+            except OSError as e:
+                print(f"[Cluster] Node {node} unreachable: {e}")
+                return None
+        return list(self.pool.map(one, nodes))
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+        self.pool.shutdown(wait=False)
+
+
+class ClusterClient:
+    """
+    Client-side router for a tracker cluster, with the interface of
+    :class:`p2p.client.TrackerClient`.
+
+    Usage::
+
+      >>> tracker = ClusterClient(['localhost:9000', 'localhost:9001', 'localhost:9002'])
+      >>> tracker.call('REGISTER:alice:10.0.0.1:8001')   # goes to alice's owner
+      'ACK:Registered'
+      >>> tracker.call('LOOKUP:*')                        # merged from every shard
+      'PEERS:{"peers": [...]}'
+
+    :params nodes (list): node ids ("host:port"), the same list on every node.
+    :params replicas (int): copies of every entry (owner + successors).
+    :params vnodes (int): virtual nodes per node.
+    """
+
+    def __init__(self, nodes, replicas=2, vnodes=64, timeout=5.0):
+        self.shards = _ShardSet(nodes, replicas, vnodes, timeout)
+
+    def call(self, command):
+        """
+        Routes one command and returns the response string.
+
+        :raises OSError: if no owner of the key can be reached.
+        """
+        if command == 'LOOKUP:*':
+            responses = self.shards.scatter(self.shards.ring.nodes, LOCAL_PREFIX + command)
+            if all(r is None for r in responses):
+                raise ConnectionError("no tracker node reachable")
+            return merge_peers(responses)
+        if is_search(command):
+            responses = self.shards.scatter(self.shards.ring.nodes, LOCAL_PREFIX + command)
+            if all(r is None for r in responses):
+                raise ConnectionError("no tracker node reachable")
+            return merge_results(responses, search_limit(command))
+        key = routing_key(command)
+        if key is None:
+            # Not tied to a user: any live node can answer.
+            return self.shards.call_owners(command, command)
+        return self.shards.call_owners(key, command)
+
+    def call_many(self, commands):
+        return [self.call(command) for command in commands]
+
+    def close(self):
+        self.shards.close()
+
+
+class ClusterNode:
+    """
+    Cluster logic of one tracker node.
+
+    :params node_id (str): this node ("host:port" as written in nodes).
+    :params nodes (list): all node ids.
+    :params replicas (int): copies of every entry (owner + successors).
+    :params lookup (callable): returns the local (ip, port) of a username or None.
+    """
+
+    def __init__(self, node_id, nodes, replicas=2, vnodes=64, timeout=5.0, lookup=None):
+        if node_id not in nodes:
+            raise ValueError(f"node {node_id} is not part of the cluster {nodes}")
+        self.node_id = node_id
+        self.lookup = lookup
+        self.replicas = replicas
+        self.shards = _ShardSet(nodes, replicas, vnodes, timeout)
+        self.outboxes = {}
+        for node in self.shards.ring.nodes:
+            if node != node_id:
+                self.outboxes[node] = queue.Queue(maxsize=100000)
+                threading.Thread(target=self._replicate_loop, args=(node,), daemon=True).start()
+        self.stats = {'forwarded': 0, 'replicated': 0, 'replication_dropped': 0}
+
+    def handle(self, data, local):
+        """
+        Executes a command in the cluster.
+
+        :params data (str): command received from a client or another node.
+        :params local (callable): executes a command on this node only.
+        :rtype str: response.
+        """
+        if data.startswith(NODE_PREFIX):
+            data = data[len(NODE_PREFIX):]
+        if data.startswith(LOCAL_PREFIX):
+            return local(data[len(LOCAL_PREFIX):])
+        if data == 'LOOKUP:*':
+            others = [n for n in self.shards.ring.nodes if n != self.node_id]
+            responses = [local(data)] + self.shards.scatter(others, NODE_PREFIX + LOCAL_PREFIX + data)
+            return merge_peers(responses)
+        if is_search(data):
+            others = [n for n in self.shards.ring.nodes if n != self.node_id]
+            responses = [local(data)] + self.shards.scatter(others, NODE_PREFIX + LOCAL_PREFIX + data)
+            if not responses[0].startswith('RESULTS:'):
+                return responses[0]
+            return merge_results(responses, search_limit(data))
+        if data.startswith('LOOKUP_SINCE:') or data.startswith('LOOKUP_PAGE:'):
+            # Versions and cursors are per node; clients fall back to LOOKUP:*.
+            return 'NAK:Unsupported in cluster mode'
+
+        key = routing_key(data)
+        if key is None:
+            return local(data)
+        owners = self.shards.ring.owners(key, self.replicas)
+        if self.node_id not in owners:
+            self.stats['forwarded'] += 1
+            try:
+                return self.shards.call_owners(key, NODE_PREFIX + data)
+            except OSError as e:
+                print(f"[Cluster] Cannot forward '{data}': {e}")
+                return 'NAK:Shard unavailable'
+
+        response = local(data)
+        if response.startswith('ACK') and data.split(':', 1)[0] in WRITE_COMMANDS:
+            self._replicate(owners, data)
+        return response
+
+    def _replicate(self, owners, data):
+        if data.startswith('HEARTBEAT:'):
+            # Carry the address, so a replica that missed the REGISTER catches up.
+            username = routing_key(data)
+            addr = self.lookup(username) if self.lookup else None
+            if addr is not None:
+                data = f"REFRESH:{username}:{addr[0]}:{addr[1]}"
+        for node in owners:
+            if node == self.node_id:
+                continue
+            try:
+                self.outboxes[node].put_nowait(NODE_PREFIX + LOCAL_PREFIX + data)
+            except queue.Full:
+                self.stats['replication_dropped'] += 1
+
+    def notify_others(self, data):
+        """
+        Queues a command for every other node, executed there locally (best
+        effort, through the replication queues). Used for state not sharded
+        by username, e.g. removing an expired peer from channels held elsewhere.
+        """
+        for outbox in self.outboxes.values():
+            try:
+                outbox.put_nowait(NODE_PREFIX + LOCAL_PREFIX + data)
+            except queue.Full:
+                self.stats['replication_dropped'] += 1
+
+    def _replicate_loop(self, node):
+        outbox = self.outboxes[node]
+        client = self.shards.clients[node]
+        while True:
+            batch = [outbox.get()]
+            while len(batch) < 256:
+                try:
+                    batch.append(outbox.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                client.call_many(batch)
+                self.stats['replicated'] += len(batch)
+            except OSError as e:
+                self.stats['replication_dropped'] += len(batch)
+                print(f"[Cluster] Replication to {node} failed ({len(batch)} commands): {e}")
+
+
+def connect_tracker(nodes, **kwargs):
+    """
+    Returns a tracker client for "host:port" or a comma separated list of
+    nodes (cluster mode).
+    """
+    if isinstance(nodes, str):
+        nodes = [n.strip() for n in nodes.split(',') if n.strip()]
+    if len(nodes) == 1:
+        return TrackerClient(*parse_node(nodes[0]), **kwargs)
+    return ClusterClient(nodes, **kwargs)
@@ -0,0 +1,171 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.connpool
+~~~~~~~~~~~~~~~~~
+
+This module keeps long-lived connections between peers, so a burst of chat
+messages pays one TCP handshake instead of one per message.
+
+On a pooled connection every message is one line (``MESSAGE:{json}\\n``;
+JSON never contains a raw newline) and the receiver answers every line with
+one line (``ACK:...\\n``), in order. Receivers still accept the old
+one-message-per-connection form, and old receivers close the connection
+after the first message, which the pool handles by reconnecting.
+
+A connection is reused while it keeps working and closed after
+``idle_timeout`` seconds without traffic. A send on a reused connection
+that turns out to be broken is retried once on a fresh connection, so a
+message can be delivered twice if only the acknowledgement was lost.
+
+Peers now send over :mod:`p2p.peerwire`; this pool is kept as the
+line-mode baseline of ``bench.peer_messaging``, and peers still accept its
+connections.
+"""
+import socket
+import threading
+import time
+
+
+class _Connection:
+    """One pooled connection; the lock serializes request/response pairs."""
+
+    def __init__(self):
+        self.sock = None
+        self.reader = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.reader.close()
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+
+class ConnectionPool:
+    """
+    Long-lived connections to other peers, one per destination.
+
+    Usage::
+
+      >>> pool = ConnectionPool()
+      >>> pool.request(('10.0.0.2', 8002), b'MESSAGE:{...}\\n')
+      'ACK:Message received'
+
+    :params idle_timeout (float): seconds after which an unused connection is closed.
+    :params timeout (float): connect and read timeout of every request.
+    """
+
+    def __init__(self, idle_timeout=60.0, timeout=5.0):
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connections = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+        self.closed = False
+        self.stats = {'connects': 0, 'requests': 0, 'reconnects': 0, 'evicted': 0}
+
+    def _get(self, addr):
+        with self.lock:
+            conn = self.connections.get(addr)
+            if conn is None:
+                conn = self.connections[addr] = _Connection()
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self._reap_loop, daemon=True)
+                self.reaper.start()
+            return conn
+
+    def _connect(self, conn, addr, timeout):
+        sock = socket.create_connection(addr, timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.sock = sock
+        conn.reader = sock.makefile('rb')
+        self.stats['connects'] += 1
+
+    def request(self, addr, line, timeout=None):
+        """
+        Sends one line to addr and returns the reply line (stripped).
+
+        :params addr (tuple): (ip, port) of the receiving peer.
+        :params line (bytes): message ending with a newline.
+        :params timeout (float): connect and read timeout of this request
+                                 (default: the pool timeout).
+        :raises OSError: if the peer cannot be reached.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        conn = self._get(addr)
+        with conn.lock:
+            if self.connections.get(addr) is not conn:
+                # Evicted between _get and the lock: use the new entry.
+                return self.request(addr, line, timeout)
+            reused = conn.sock is not None
+            while True:
+                try:
+                    if conn.sock is None:
+                        self._connect(conn, addr, timeout)
+                    else:
+                        conn.sock.settimeout(timeout)
+                    conn.sock.sendall(line)
+                    reply = conn.reader.readline()
+                    if not reply:
+                        raise ConnectionError("peer closed the connection")
+                    conn.last_used = time.monotonic()
+                    self.stats['requests'] += 1
+                    return reply.decode('utf-8').strip()
+                except OSError:
+                    conn.close()
+                    if not reused:
+                        raise
+                    # The pooled connection went stale; retry once on a new one.
+                    reused = False
+                    self.stats['reconnects'] += 1
+
+    def _reap_loop(self):
+        while not self.closed:
+            time.sleep(max(1.0, self.idle_timeout / 2))
+            self.evict_idle()
+
+    def evict_idle(self):
+        """Closes the connections idle for longer than idle_timeout."""
+        deadline = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [(addr, conn) for addr, conn in self.connections.items()
+                    if conn.last_used < deadline]
+        for addr, conn in idle:
+            # Skip connections in use right now; they are not idle.
+            if not conn.lock.acquire(blocking=False):
+                continue
+            try:
+                if conn.last_used < deadline:
+                    if conn.sock is not None:
+                        self.stats['evicted'] += 1
+                    conn.close()
+                    with self.lock:
+                        if self.connections.get(addr) is conn:
+                            del self.connections[addr]
+            finally:
+                conn.lock.release()
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            connections, self.connections = list(self.connections.values()), {}
+        for conn in connections:
+            with conn.lock:
+                conn.close()
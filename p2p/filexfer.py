@@ -0,0 +1,264 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.filexfer
+~~~~~~~~~~~~~~~~~
+
+This module transfers files between peers in fixed-size chunks, resumable
+after a disconnect.
+
+A transfer is one connection to the receiving peer's listener::
+
+    sender   -> FILE:{"id", "name", "size", "chunk_size", "sender", "checksums"}\\n
+    receiver -> ACCEPT:<offset>\\n            or  NAK:<reason>\\n
+    sender   -> file bytes [offset, size)     (socket.sendfile, zero copy)
+    receiver -> DONE\\n                       or  NAK:Checksum <chunk>\\n
+
+``checksums`` holds the CRC-32 of every chunk, computed by streaming the file
+once, and ``id`` is derived from name, size and checksums. The receiver
+preallocates ``.<id>.part``, reads each chunk into one reused buffer, checks
+it and writes it at its offset; the number of verified chunks is kept in
+``.<id>.part.json``. When the same file (same ``id``) is offered again, the
+receiver answers with the offset after the last verified chunk, so a broken
+transfer resumes instead of starting over. Neither side ever holds more than
+one chunk of the file in memory.
+
+Offers larger than ``max_size`` are refused before any space is reserved,
+and one ``id`` is received by one connection at a time.
+"""
+import re
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+
+#: Default chunk size (bytes).
+CHUNK_SIZE = 1 << 20
+
+#: Verified chunks between two writes of the resume state.
+STATE_EVERY = 16
+
+#: Default largest file a peer accepts (bytes).
+MAX_SIZE = 1 << 30
+
+#: Offer ids, also used to name the partial files.
+FILE_ID = re.compile(r'^[0-9a-f]{16}$')
+
+# Ids being received, so a second connection never writes the same .part
+_active = set()
+_active_lock = threading.Lock()
+
+
+class TransferRejected(ValueError):
+    """Raised when the receiving peer refuses a file."""
+
+
+def file_checksums(path, chunk_size=CHUNK_SIZE):
+    """CRC-32 of every chunk of a file, reading one chunk at a time."""
+    checksums = []
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                return checksums
+            checksums.append(zlib.crc32(view[:n]))
+
+
+def make_offer(path, sender, chunk_size=CHUNK_SIZE):
+    """Builds the FILE header of path."""
+    size = os.path.getsize(path)
+    offer = {'name': os.path.basename(path), 'size': size, 'chunk_size': chunk_size, 'sender': sender,
+             'checksums': file_checksums(path, chunk_size)}
+    key = json.dumps([offer['name'], size, chunk_size, offer['checksums']]).encode('utf-8')
+    offer['id'] = hashlib.sha1(key).hexdigest()[:16]
+    return offer
+
+
+def _read_line(sock, limit=1 << 20):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(1)
+        if not chunk:
+            raise ConnectionError("peer closed the connection")
+        data += chunk
+        if len(data) > limit:
+            raise ConnectionError("reply line too long")
+    return data.decode('utf-8').strip()
+
+
+def send_file(addr, path, sender, chunk_size=CHUNK_SIZE, timeout=10.0, retries=3, offer=None):
+    """
+    Sends a file to the peer listening at addr, resuming after failures.
+
+    :params offer (dict): header from :func:`make_offer`, to skip checksumming again.
+    :rtype dict: {'name', 'size', 'sent', 'resumed_from', 'attempts', 'seconds'}.
+    :raises TransferRejected: if the receiver refuses the file.
+    :raises OSError: if the transfer still fails after retries.
+    """
+    offer = offer or make_offer(path, sender, chunk_size)
+    header = b'FILE:' + json.dumps(offer).encode('utf-8') + b'\n'
+    started = time.perf_counter()
+    sent = 0
+    resumed_from = None
+    for attempt in range(retries + 1):
+        try:
+            with socket.create_connection(addr, timeout=timeout) as sock:
+                sock.sendall(header)
+                reply = _read_line(sock)
+                if not reply.startswith('ACCEPT:'):
+                    raise TransferRejected(reply)
+                offset = int(reply[7:])
+                if resumed_from is None:
+                    resumed_from = offset
+                with open(path, 'rb') as f:
+                    if offset < offer['size']:
+                        sent += sock.sendfile(f, offset, offer['size'] - offset)
+                reply = _read_line(sock)
+                if reply == 'DONE':
+                    return {'name': offer['name'], 'size': offer['size'], 'sent': sent,
+                            'resumed_from': resumed_from, 'attempts': attempt + 1,
+                            'seconds': time.perf_counter() - started}
+                error = ConnectionError(reply)
+        except (OSError, ValueError) as e:
+            if isinstance(e, TransferRejected):
+                raise
+            error = e if isinstance(e, OSError) else ConnectionError(str(e))
+        if attempt < retries:
+            time.sleep(min(5.0, 0.5 * 2 ** attempt))
+    raise error
+
+
+def _safe_name(name):
+    name = os.path.basename(str(name))
+    return name if name not in ('', '.', '..') else None
+
+
+def _load_state(path, file_id):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        return state['verified'] if state.get('id') == file_id else 0
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def _save_state(path, file_id, verified):
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'id': file_id, 'verified': verified}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _final_path(download_dir, name):
+    path = os.path.join(download_dir, name)
+    root, ext = os.path.splitext(path)
+    n = 1
+    while os.path.exists(path):
+        path = f"{root} ({n}){ext}"
+        n += 1
+    return path
+
+
+def receive_file(conn, header, download_dir, max_size=MAX_SIZE):
+    """
+    Serves one FILE offer on an accepted connection (header: the first line,
+    without newline).
+
+    :params max_size (int): largest file accepted, in bytes.
+
+    :rtype dict: {'name', 'path', 'size', 'sender', 'received', 'resumed_from'}
+                 when the file is complete, None otherwise.
+    """
+    try:
+        offer = json.loads(header[5:])
+        name = _safe_name(offer['name'])
+        size, chunk_size = int(offer['size']), int(offer['chunk_size'])
+        checksums, file_id = offer['checksums'], str(offer['id'])
+        valid = (name is not None and FILE_ID.match(file_id) is not None and 0 <= size
+                 and 0 < chunk_size <= 64 << 20 and len(checksums) == -(-size // chunk_size))
+    except (ValueError, KeyError, TypeError):
+        valid = False
+    if not valid:
+        conn.sendall(b'NAK:Invalid offer\n')
+        return None
+    if size > max_size:
+        conn.sendall(b'NAK:File too large\n')
+        return None
+    with _active_lock:
+        if file_id in _active:
+            conn.sendall(b'NAK:Transfer in progress\n')
+            return None
+        _active.add(file_id)
+    try:
+        return _receive(conn, offer, name, size, chunk_size, checksums, file_id, download_dir)
+    finally:
+        with _active_lock:
+            _active.discard(file_id)
+
+
+def _receive(conn, offer, name, size, chunk_size, checksums, file_id, download_dir):
+    os.makedirs(download_dir, exist_ok=True)
+    part = os.path.join(download_dir, f".{file_id}.part")
+    state = part + '.json'
+    verified = _load_state(state, file_id) if os.path.exists(part) else 0
+    if verified == 0:
+        try:
+            with open(part, 'wb') as f:
+                # Reserve the space up front: no fragmentation, and a full disk fails now
+                if hasattr(os, 'posix_fallocate') and size:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                else:
+                    f.truncate(size)
+        except OSError as e:
+            if os.path.exists(part):
+                os.remove(part)
+            conn.sendall(f"NAK:Cannot store file ({e.strerror})\n".encode())
+            return None
+        _save_state(state, file_id, 0)
+    resumed_from = verified * chunk_size
+    conn.sendall(f"ACCEPT:{resumed_from}\n".encode())
+
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    fd = os.open(part, os.O_WRONLY)
+    try:
+        for k in range(verified, len(checksums)):
+            offset = k * chunk_size
+            need = min(chunk_size, size - offset)
+            got = 0
+            while got < need:
+                n = conn.recv_into(view[got:need])
+                if not n:
+                    return None
+                got += n
+            if zlib.crc32(view[:need]) != checksums[k]:
+                conn.sendall(f"NAK:Checksum {k}\n".encode())
+                return None
+            os.pwrite(fd, view[:need], offset)
+            verified = k + 1
+            if verified % STATE_EVERY == 0:
+                _save_state(state, file_id, verified)
+    finally:
+        os.close(fd)
+        if verified < len(checksums):
+            _save_state(state, file_id, verified)
+    path = _final_path(download_dir, name)
+    os.replace(part, path)
+    os.remove(state)
+    conn.sendall(b'DONE\n')
+    return {'name': name, 'path': path, 'size': size, 'sender': offer.get('sender'),
+            'received': size - resumed_from, 'resumed_from': resumed_from}
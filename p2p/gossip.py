@@ -0,0 +1,125 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.gossip
+~~~~~~~~~~~~~~~~~
+
+This module spreads a broadcast epidemically instead of having the sender
+upload it to every peer.
+
+The origin sends the message to ``fanout`` random peers. Every peer that
+receives a message for the first time delivers it and forwards it to
+``fanout`` other random peers, until the hop budget ``ttl`` is spent. With a
+fanout around ``ln(N)`` almost every peer is reached in ``O(log N)`` hops,
+while each peer uploads only ``fanout`` copies.
+
+Every message carries an id; :class:`SeenSet <SeenSet>` remembers the last
+ids seen so duplicates are neither delivered nor forwarded again. The set is
+bounded, so an id can only come back after ``capacity`` newer messages,
+long after its hop budget ran out.
+
+Gossip fields travel inside the usual ``MESSAGE:`` JSON::
+
+    {"sender": ..., "msg": ..., "time": ...,
+     "id": "<hex>", "ttl": <hops left>, "relay": "<peer that forwarded it>"}
+"""
+import random
+import threading
+import uuid
+from collections import OrderedDict
+
+
+def new_message_id():
+    return uuid.uuid4().hex
+
+
+class SeenSet:
+    """
+    Bounded set of recently seen message ids (least recently added evicted).
+
+    :params capacity (int): ids remembered.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, message_id):
+        """Records message_id; returns False if it was already seen."""
+        with self.lock:
+            if message_id in self.ids:
+                return False
+            self.ids[message_id] = None
+            if len(self.ids) > self.capacity:
+                self.ids.popitem(last=False)
+            return True
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class Gossip:
+    """
+    Gossip state of one peer: dedup and choice of the next hops.
+
+    Usage::
+
+      >>> gossip = Gossip(fanout=4, ttl=6)
+      >>> message = gossip.originate('alice', 'hello')
+      >>> gossip.targets(peers, exclude=('alice',))      # first hops
+      >>> gossip.receive(message)                        # on another peer
+      (True, {... 'ttl': 5 ...})
+
+    :params fanout (int): peers every hop forwards to.
+    :params ttl (int): hops a message may travel.
+    :params seen_capacity (int): message ids remembered for dedup.
+    """
+
+    def __init__(self, fanout=4, ttl=6, seen_capacity=10000, rng=None):
+        self.fanout = fanout
+        self.ttl = ttl
+        self.seen = SeenSet(seen_capacity)
+        self.rng = rng or random.Random()
+        self.stats = {'originated': 0, 'delivered': 0, 'duplicates': 0, 'forwarded': 0}
+
+    def originate(self, sender, msg, **fields):
+        """Builds a new gossip message and marks it as seen locally."""
+        message = dict(fields, sender=sender, msg=msg, id=new_message_id(), ttl=self.ttl, relay=sender)
+        self.seen.add(message['id'])
+        self.stats['originated'] += 1
+        return message
+
+    def receive(self, message):
+        """
+        Handles an incoming gossip message.
+
+        :rtype tuple: (deliver, forward): deliver is False for a duplicate;
+                      forward is the message to pass on (with one hop less),
+                      or None when the hop budget is spent.
+        """
+        if not self.seen.add(message['id']):
+            self.stats['duplicates'] += 1
+            return False, None
+        self.stats['delivered'] += 1
+        if message.get('ttl', 0) <= 1:
+            return True, None
+        return True, dict(message, ttl=message['ttl'] - 1)
+
+    def targets(self, peers, exclude=()):
+        """Picks up to fanout random peers, skipping those in exclude."""
+        candidates = [p for p in peers if p not in exclude]
+        if len(candidates) > self.fanout:
+            candidates = self.rng.sample(candidates, self.fanout)
+        self.stats['forwarded'] += len(candidates)
+        return candidates
@@ -0,0 +1,353 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.msgstore
+~~~~~~~~~~~~~~~~~
+
+This module keeps the message history of a peer in bounded memory.
+
+The most recent messages live in a ring buffer. With a data directory, every
+message is also appended to a segmented log::
+
+    msg-00000000000000000001.log   one JSON array per line:
+                                   [seq, received at, sender, msg, time]
+    msg-00000000000000000001.idx   sparse index of that segment:
+                                   ["I", seq, received at, byte offset]
+                                   ["S", sender]  (first message of a sender)
+
+An index point is written for the first message of a segment and then every
+``index_every`` messages, so memory grows with ``messages / index_every``,
+and ``max_segments`` bounds the disk. A time range query bisects the index
+to the closest point before its start and reads from there; a sender query
+skips the segments in which the sender never appears. :meth:`MessageStore.page`
+pages backwards by sequence number, the cursor being the oldest seq returned.
+
+On restart only the small ``.idx`` files are read, plus the tail of the last
+segment after its last index point, which also cuts off a torn last line.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+
+def _segment_name(first_seq, ext):
+    return f"msg-{first_seq:020d}.{ext}"
+
+
+class _Segment:
+    def __init__(self, first_seq, data_dir):
+        self.first_seq = first_seq
+        self.path = os.path.join(data_dir, _segment_name(first_seq, 'log'))
+        self.idx_path = os.path.join(data_dir, _segment_name(first_seq, 'idx'))
+        self.seqs = []
+        self.ats = []
+        self.offsets = []
+        self.senders = set()
+        self.size = 0
+
+
+def _as_message(record):
+    seq, at, sender, msg, stamp = record
+    return {'seq': seq, 'at': at, 'time': stamp, 'sender': sender, 'msg': msg}
+
+
+class MessageStore:
+    """
+    Ring buffer of recent messages, optionally backed by a segmented log.
+
+    Usage::
+
+      >>> store = MessageStore('data/alice', recent=1000)
+      >>> store.append({'time': '2025-10-01 10:00:00', 'sender': 'bob', 'msg': 'hi'})
+      >>> store.recent(5)
+      >>> store.query(start=time.time() - 3600, sender='bob', limit=50)
+
+    :params data_dir (str): directory of the log, None to keep the ring buffer only.
+    :params recent (int): messages kept in memory.
+    :params segment_bytes (int): size after which a new segment is started.
+    :params index_every (int): messages between two index points.
+    :params max_segments (int): segments kept on disk, None for no limit.
+    """
+
+    def __init__(self, data_dir=None, recent=1000, segment_bytes=4 << 20, index_every=64, max_segments=None):
+        self.data_dir = data_dir
+        self.ring = deque(maxlen=recent)
+        self.segment_bytes = segment_bytes
+        self.index_every = index_every
+        self.max_segments = max_segments
+        self.segments = []
+        self.next_seq = 1
+        self.last_at = 0.0
+        self.file = None
+        self.idx_file = None
+        self.lock = threading.Lock()
+        if data_dir is not None:
+            os.makedirs(data_dir, exist_ok=True)
+            self._load()
+
+    # -- recovery -----------------------------------------------------------
+
+    def _load(self):
+        names = sorted(n for n in os.listdir(self.data_dir) if n.startswith('msg-') and n.endswith('.log'))
+        for name in names:
+            segment = _Segment(int(name[4:-4]), self.data_dir)
+            segment.size = os.path.getsize(segment.path)
+            if os.path.exists(segment.idx_path):
+                with open(segment.idx_path, 'rb') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            break  # torn last line
+                        if entry[0] == 'I':
+                            self._add_point(segment, entry[1], entry[2], entry[3])
+                        else:
+                            segment.senders.add(entry[1])
+            # Points whose log line never reached the disk.
+            while segment.offsets and segment.offsets[-1] >= segment.size:
+                for points in (segment.seqs, segment.ats, segment.offsets):
+                    points.pop()
+            if not segment.offsets and segment.size:
+                self._reindex(segment)
+            self.segments.append(segment)
+        if not self.segments:
+            return
+        last = self.segments[-1]
+        offset = last.offsets[-1] if last.offsets else 0
+        end = offset
+        for record, end in self._scan(last, offset, last.size):
+            last.senders.add(record[2])
+            self.next_seq = record[0] + 1
+            self.last_at = record[1]
+        if end < last.size:
+            print(f"[History] Truncating torn message at the end of {os.path.basename(last.path)}")
+            with open(last.path, 'r+b') as f:
+                f.truncate(end)
+            last.size = end
+        if self.next_seq == 1:
+            self.next_seq = last.first_seq
+        # Refill the ring buffer with the newest messages.
+        start = max(1, self.next_seq - self.ring.maxlen)
+        self.ring.extend(self._range_by_seq(start))
+
+    def _reindex(self, segment):
+        """Rebuilds a missing or empty .idx file by reading the whole segment."""
+        print(f"[History] Rebuilding the index of {os.path.basename(segment.path)}")
+        entries = []
+        offset = 0
+        for record, end in self._scan(segment, 0, segment.size):
+            if not segment.seqs or record[0] - segment.seqs[-1] >= self.index_every:
+                self._add_point(segment, record[0], record[1], offset)
+                entries.append(['I', record[0], record[1], offset])
+            if record[2] not in segment.senders:
+                segment.senders.add(record[2])
+                entries.append(['S', record[2]])
+            offset = end
+        with open(segment.idx_path, 'wb') as f:
+            f.write(b''.join(json.dumps(e).encode('utf-8') + b'\n' for e in entries))
+
+    @staticmethod
+    def _add_point(segment, seq, at, offset):
+        segment.seqs.append(seq)
+        segment.ats.append(at)
+        segment.offsets.append(offset)
+
+    def _scan(self, segment, offset, end, contains=None):
+        """
+        Yields (record, end offset) of the complete lines of segment in
+        [offset, end). Lines not containing the bytes contains are skipped
+        without being decoded.
+        """
+        with open(segment.path, 'rb') as f:
+            f.seek(offset)
+            while offset < end:
+                line = f.readline(end - offset)
+                if not line.endswith(b'\n'):
+                    return
+                offset += len(line)
+                if contains is not None and contains not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    return
+                yield record, offset
+
+    def _range_by_seq(self, start, stop=None, segments=None):
+        """Messages with start <= seq < stop, read from the log."""
+        segments = self.segments if segments is None else segments
+        messages = []
+        for k, segment in enumerate(segments):
+            if k + 1 < len(segments) and segments[k + 1].first_seq <= start:
+                continue
+            if stop is not None and segment.first_seq >= stop:
+                break
+            i = max(0, bisect_right(segment.seqs, start) - 1)
+            offset = segment.offsets[i] if segment.offsets else 0
+            for record, _ in self._scan(segment, offset, segment.size):
+                if stop is not None and record[0] >= stop:
+                    return messages
+                if record[0] >= start:
+                    messages.append(_as_message(record))
+        return messages
+
+    # -- writes -------------------------------------------------------------
+
+    def _roll(self, first_seq):
+        if self.file is not None:
+            self.file.close()
+            self.idx_file.close()
+        segment = _Segment(first_seq, self.data_dir)
+        self.segments.append(segment)
+        self.file = open(segment.path, 'ab')
+        self.idx_file = open(segment.idx_path, 'ab')
+        if self.max_segments is not None:
+            while len(self.segments) > self.max_segments:
+                old = self.segments.pop(0)
+                os.remove(old.path)
+                if os.path.exists(old.idx_path):
+                    os.remove(old.idx_path)
+
+    def append(self, message):
+        """
+        Stores a message dict ({'time', 'sender', 'msg'}).
+
+        :rtype int: sequence number of the message.
+        """
+        with self.lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            # Receive times never go backwards, so the log stays sorted by time.
+            at = self.last_at = max(self.last_at, round(time.time(), 3))
+            record = [seq, at, message.get('sender'), message.get('msg'), message.get('time')]
+            self.ring.append(_as_message(record))
+            if self.data_dir is None:
+                return seq
+            if self.file is None:
+                if self.segments:
+                    last = self.segments[-1]
+                    self.file = open(last.path, 'ab')
+                    self.idx_file = open(last.idx_path, 'ab')
+                else:
+                    self._roll(seq)
+            segment = self.segments[-1]
+            if segment.size >= self.segment_bytes:
+                self._roll(seq)
+                segment = self.segments[-1]
+            line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+            index = []
+            if not segment.seqs or seq - segment.seqs[-1] >= self.index_every:
+                self._add_point(segment, seq, at, segment.size)
+                index.append(['I', seq, at, segment.size])
+            if record[2] not in segment.senders:
+                segment.senders.add(record[2])
+                index.append(['S', record[2]])
+            self.file.write(line)
+            self.file.flush()
+            if index:
+                self.idx_file.write(b''.join(json.dumps(e).encode('utf-8') + b'\n' for e in index))
+                self.idx_file.flush()
+            segment.size += len(line)
+            return seq
+
+    # -- reads --------------------------------------------------------------
+
+    def recent(self, count=None):
+        """Returns the newest count messages (all of the ring buffer by default)."""
+        with self.lock:
+            messages = list(self.ring)
+        return messages if count is None else messages[-count:]
+
+    def query(self, start=None, end=None, sender=None, limit=100):
+        """
+        Messages received between start and end (Unix times, inclusive), in
+        order, optionally from one sender only.
+
+        :params limit (int): at most this many messages, the newest ones.
+        :rtype list: message dicts with 'seq', 'at', 'time', 'sender', 'msg'.
+        """
+        start = float('-inf') if start is None else start
+        end = float('inf') if end is None else end
+
+        def wanted(m):
+            return start <= m['at'] <= end and (sender is None or m['sender'] == sender)
+
+        with self.lock:
+            ring = list(self.ring)
+            segments = [(s, s.size, list(s.ats), list(s.offsets), sender is None or sender in s.senders)
+                        for s in self.segments]
+        if self.data_dir is None or not segments or (ring and (ring[0]['at'] < start or ring[0]['seq'] == 1)):
+            # Every message received after start is still in the ring buffer.
+            return [m for m in ring if wanted(m)][-limit:]
+
+        found = deque(maxlen=limit)
+        needle = None if sender is None else json.dumps(sender).encode('utf-8')
+        for k, (segment, size, ats, offsets, has_sender) in enumerate(segments):
+            if not has_sender or not ats or ats[0] > end:
+                continue
+            if k + 1 < len(segments) and segments[k + 1][2] and segments[k + 1][2][0] < start:
+                continue  # the whole segment is older than start
+            i = max(0, bisect_left(ats, start) - 1)
+            for record, _ in self._scan(segment, offsets[i], size, needle):
+                at = record[1]
+                if at > end:
+                    break
+                if at >= start and (sender is None or record[2] == sender):
+                    found.append(_as_message(record))
+        return list(found)
+
+    def page(self, before=None, limit=50):
+        """
+        Cursor pagination from the newest message backwards.
+
+        Returns the limit messages just before sequence number before (the
+        newest ones when None), in order, and the cursor of the next older
+        page, None once the oldest stored message was returned::
+
+          >>> messages, cursor = store.page(limit=20)
+          >>> older, cursor = store.page(before=cursor, limit=20)
+
+        Sequence numbers are dense, so a page is a seq range: served from the
+        ring buffer when it holds the range, else from the log by the index.
+        """
+        with self.lock:
+            ring = list(self.ring)
+            segments = list(self.segments)
+            before = self.next_seq if before is None else min(before, self.next_seq)
+        if segments:
+            oldest = segments[0].first_seq
+        elif ring:
+            oldest = ring[0]['seq']
+        else:
+            return [], None
+        start = max(oldest, before - limit)
+        if start >= before:
+            return [], None
+        if ring and ring[0]['seq'] <= start:
+            messages = ring[start - ring[0]['seq']:before - ring[0]['seq']]
+        else:
+            messages = self._range_by_seq(start, before, segments)
+        return messages, (start if start > oldest else None)
+
+    def __len__(self):
+        return self.next_seq - 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.idx_file.close()
+                self.file = None
@@ -0,0 +1,84 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.nameindex
+~~~~~~~~~~~~~~~~~
+
+This module indexes usernames by trigram, for substring search on the
+tracker (``SEARCH_ANY``).
+
+Every username is filed under each 3-character substring it contains. A
+query of 3 characters or more only has to look at the names filed under
+the rarest of its trigrams, instead of scanning the whole registry; those
+candidates are then checked with ``in``. Shorter queries have no trigram
+to narrow them down and are answered by scanning the sorted names.
+
+The index is updated incrementally with :meth:`NgramIndex.add` and
+:meth:`NgramIndex.remove`; it is not thread-safe, the tracker calls it
+with ``PEERS_LOCK`` held.
+"""
+
+
+class NgramIndex:
+    """
+    Usernames by n-gram.
+
+    Usage::
+
+      >>> index = NgramIndex()
+      >>> index.add('alice'); index.add('malik')
+      >>> sorted(index.candidates('ali'))
+      ['alice', 'malik']
+      >>> index.candidates('al') is None     # too short: scan instead
+      True
+
+    :params n (int): n-gram length.
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = {}
+
+    def grams(self, name):
+        return {name[i:i + self.n] for i in range(len(name) - self.n + 1)}
+
+    def add(self, name):
+        for gram in self.grams(name):
+            self.postings.setdefault(gram, set()).add(name)
+
+    def remove(self, name):
+        for gram in self.grams(name):
+            names = self.postings.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self.postings[gram]
+
+    def rebuild(self, names):
+        self.postings = {}
+        for name in names:
+            self.add(name)
+
+    def candidates(self, substring):
+        """
+        Names that may contain substring (a superset, to be checked with
+        ``in``), or None if substring is shorter than n.
+        """
+        grams = self.grams(substring)
+        if not grams:
+            return None
+        smallest = min((self.postings.get(g, ()) for g in grams), key=len)
+        return set(smallest)
+
+    def __len__(self):
+        return len(self.postings)
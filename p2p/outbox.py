@@ -0,0 +1,270 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.outbox
+~~~~~~~~~~~~~~~~~
+
+This module keeps the messages a peer could not deliver, one queue per
+recipient, until the recipient is reachable again (store-and-forward).
+
+A recipient whose delivery failed is retried with exponential backoff
+(``base_delay * 2**attempts``, capped at ``max_delay``, with jitter so many
+senders do not retry in step). :meth:`Outbox.wake` makes a recipient due at
+once, e.g. when the tracker announces it joined again. A due recipient is
+flushed as one batch: :meth:`Outbox.take` hands out all its messages and
+:meth:`Outbox.finish` reports which ones were acknowledged.
+
+Depth is bounded per recipient and in total; a full queue refuses new
+messages (counted as ``dropped``), and messages older than ``expire_after``
+seconds are discarded (``expired``).
+
+With a data directory, the queue survives restarts in ``outbox.log``, one
+JSON array per line::
+
+    ["Q", id, recipient, message, queued at]    message queued
+    ["D", id]                                   message delivered or expired
+
+The journal is rewritten with the live messages only once most of its lines
+are dead.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+JOURNAL = 'outbox.log'
+
+
+class _Recipient:
+    def __init__(self):
+        self.messages = OrderedDict()  # id -> (message, queued at)
+        self.attempts = 0
+        self.next_at = 0.0
+        self.busy = False
+
+
+class Outbox:
+    """
+    Durable per-recipient queues of undelivered messages.
+
+    Usage::
+
+      >>> outbox = Outbox('data/alice/outbox')
+      >>> outbox.put('bob', {'time': '...', 'sender': 'alice', 'msg': 'hi'})
+      True
+      >>> for recipient in outbox.due():
+      ...     batch = outbox.take(recipient)
+      ...     outbox.finish(recipient, [i for i, message in batch if deliver(message)])
+
+    :params data_dir (str): directory of the journal, None to keep the queue in memory.
+    :params max_per_peer (int): messages queued per recipient.
+    :params max_total (int): messages queued in total.
+    :params base_delay (float): first retry delay in seconds.
+    :params max_delay (float): longest retry delay in seconds.
+    :params expire_after (float): seconds after which a queued message is dropped.
+    """
+
+    def __init__(self, data_dir=None, max_per_peer=1000, max_total=100000, base_delay=1.0, max_delay=300.0,
+                 expire_after=24 * 3600.0, rng=None):
+        self.data_dir = data_dir
+        self.max_per_peer = max_per_peer
+        self.max_total = max_total
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expire_after = expire_after
+        self.rng = rng or random.Random()
+        self.recipients = {}
+        self.total = 0
+        self.next_id = 1
+        self.dead = 0
+        self.file = None
+        self.lock = threading.Lock()
+        self.stats = {'queued': 0, 'delivered': 0, 'retried': 0, 'expired': 0, 'dropped': 0}
+        if data_dir is not None:
+            os.makedirs(data_dir, exist_ok=True)
+            self._load()
+
+    # -- journal ------------------------------------------------------------
+
+    def _load(self):
+        path = os.path.join(self.data_dir, JOURNAL)
+        entries = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn last line
+                    if entry[0] == 'Q':
+                        entries[entry[1]] = entry
+                        self.next_id = max(self.next_id, entry[1] + 1)
+                    else:
+                        entries.pop(entry[1], None)
+        for _, id, recipient, message, queued_at in entries.values():
+            self.recipients.setdefault(recipient, _Recipient()).messages[id] = (message, queued_at)
+        self.total = len(entries)
+        self._rewrite()
+        if self.total:
+            print(f"[Outbox] Restored {self.total} undelivered messages for {len(self.recipients)} peers")
+
+    def _rewrite(self):
+        """Replaces the journal with the live messages only."""
+        path = os.path.join(self.data_dir, JOURNAL)
+        if self.file is not None:
+            self.file.close()
+        with open(path + '.tmp', 'wb') as f:
+            for recipient, state in self.recipients.items():
+                for id, (message, queued_at) in state.messages.items():
+                    f.write(self._encode(['Q', id, recipient, message, queued_at]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self.file = open(path, 'ab')
+        self.dead = 0
+
+    @staticmethod
+    def _encode(entry):
+        return json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def _journal(self, entries):
+        if self.file is None or not entries:
+            return
+        self.file.write(b''.join(self._encode(e) for e in entries))
+        self.file.flush()
+
+    def _remove(self, state, ids):
+        """Drops ids from a recipient queue (lock held) and journals it."""
+        for id in ids:
+            del state.messages[id]
+        self.total -= len(ids)
+        self._journal([['D', id] for id in ids])
+        if self.file is not None:
+            self.dead += 2 * len(ids)
+            if self.dead > max(1024, 4 * self.total):
+                self._rewrite()
+
+    # -- queue --------------------------------------------------------------
+
+    def put(self, recipient, message):
+        """
+        Queues a message (JSON-serialisable) for recipient.
+
+        :rtype bool: False if the queue is full and the message was dropped.
+        """
+        with self.lock:
+            state = self.recipients.setdefault(recipient, _Recipient())
+            if len(state.messages) >= self.max_per_peer or self.total >= self.max_total:
+                self.stats['dropped'] += 1
+                return False
+            id = self.next_id
+            self.next_id += 1
+            queued_at = round(time.time(), 3)
+            state.messages[id] = (message, queued_at)
+            self.total += 1
+            self.stats['queued'] += 1
+            if len(state.messages) == 1 and not state.busy:
+                # First failure: the next retry waits like any other.
+                self._backoff(state)
+            self._journal([['Q', id, recipient, message, queued_at]])
+            return True
+
+    def _backoff(self, state):
+        delay = min(self.max_delay, self.base_delay * 2 ** state.attempts)
+        state.next_at = time.monotonic() + delay * self.rng.uniform(0.5, 1.0)
+        state.attempts += 1
+
+    def due(self, now=None):
+        """Recipients with queued messages whose retry time has come."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return [r for r, s in self.recipients.items() if s.messages and not s.busy and s.next_at <= now]
+
+    def wake(self, recipient):
+        """
+        Makes recipient due now (it is reachable again) and resets its backoff.
+
+        :rtype bool: True if messages are queued for it.
+        """
+        with self.lock:
+            state = self.recipients.get(recipient)
+            if state is None or not state.messages:
+                return False
+            state.attempts = 0
+            state.next_at = 0.0
+            return True
+
+    def take(self, recipient):
+        """
+        Hands out every message queued for recipient as [(id, message)].
+        Until :meth:`finish` is called, the recipient is not handed out again.
+        """
+        with self.lock:
+            state = self.recipients.get(recipient)
+            if state is None or state.busy or not state.messages:
+                return []
+            state.busy = True
+            # Messages are queued after a failed attempt, so every flush is a retry.
+            self.stats['retried'] += len(state.messages)
+            return [(id, message) for id, (message, _) in state.messages.items()]
+
+    def finish(self, recipient, delivered):
+        """
+        Ends a flush: removes the delivered ids; if messages remain, the
+        recipient is retried after the next backoff delay.
+        """
+        with self.lock:
+            state = self.recipients.get(recipient)
+            if state is None:
+                return
+            state.busy = False
+            ids = [id for id in delivered if id in state.messages]
+            self.stats['delivered'] += len(ids)
+            self._remove(state, ids)
+            if state.messages:
+                self._backoff(state)
+            else:
+                del self.recipients[recipient]
+
+    def expire(self, now=None):
+        """Drops messages queued more than expire_after seconds ago; returns how many."""
+        deadline = (time.time() if now is None else now) - self.expire_after
+        count = 0
+        with self.lock:
+            for recipient, state in list(self.recipients.items()):
+                if state.busy:
+                    continue
+                ids = [id for id, (_, queued_at) in state.messages.items() if queued_at < deadline]
+                if ids:
+                    self._remove(state, ids)
+                    count += len(ids)
+                if not state.messages:
+                    del self.recipients[recipient]
+            self.stats['expired'] += count
+        return count
+
+    def pending(self, recipient=None):
+        """Messages queued for recipient, or in total."""
+        with self.lock:
+            if recipient is None:
+                return self.total
+            state = self.recipients.get(recipient)
+            return len(state.messages) if state else 0
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,337 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.peerwire
+~~~~~~~~~~~~~~~~~
+
+This module carries peer-to-peer messages over the length-prefixed frames of
+:mod:`p2p.protocol`, batched and acknowledged by window.
+
+Every message sent on a connection gets a sequence number (1, 2, ...). The
+sender packs the messages waiting in its queue into one frame::
+
+    req id = sequence number of the first message
+    payload = MESSAGE:{json}\\nMESSAGE:{json}\\n...
+
+The receiver handles every frame of a read and answers with a single frame
+acknowledging everything up to the last sequence number it handled::
+
+    req id = last sequence number handled
+    payload = ACK  or  ACK:<seq>,<seq>,...   (sequence numbers rejected)
+
+At most ``window`` messages are sent and not yet acknowledged; the sender
+waits for acknowledgements beyond that. The receiver therefore never holds
+more than a window of unprocessed messages per connection, and a full window
+travels in a few frames instead of one round trip per message.
+
+:class:`PeerStream <PeerStream>` is one such connection and
+:class:`StreamPool <StreamPool>` keeps one per destination. On the receiving
+side, :func:`open_session` turns what a connection reads into the replies to
+write back, so the threaded and the asyncio listeners only move bytes.
+"""
+import json
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from .protocol import FrameDecoder, MAX_FRAME, encode_frame, is_framed, read_frame
+
+
+def encode_ack(seq, rejected=()):
+    """Encodes the acknowledgement of every message up to seq."""
+    if not rejected:
+        return encode_frame(seq, b'ACK')
+    return encode_frame(seq, b'ACK:' + b','.join(str(s).encode() for s in rejected))
+
+
+def decode_batch(first_seq, payload):
+    """Splits a message frame into (seq, message bytes) pairs."""
+    return [(first_seq + i, line) for i, line in enumerate(payload.split(b'\n')) if line]
+
+
+class FrameSession:
+    """
+    Receiving side of a framed connection: the frames of every read are
+    handled, then answered with one acknowledgement up to the last sequence
+    number.
+
+    :params handle (callable): handles one message line, returns its reply line.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.decoder = FrameDecoder()
+
+    def feed(self, data):
+        """
+        Handles the bytes of one read.
+
+        :rtype tuple: (bytes to write back, whether to keep reading).
+        :raises ProtocolError: on a malformed frame.
+        """
+        self.decoder.feed(data)
+        last = None
+        rejected = []
+        for first_seq, payload in self.decoder.frames():
+            for seq, line in decode_batch(first_seq, payload):
+                if not self.handle(line.strip()).startswith(b'ACK'):
+                    rejected.append(seq)
+                last = seq
+        return (encode_ack(last, rejected) if last is not None else b''), True
+
+
+class LineSession:
+    """
+    Receiving side of a line-mode connection (:mod:`p2p.connpool`), answered
+    line by line. An old peer sending one message without newline is still
+    understood once its JSON is complete.
+
+    :params handle (callable): handles one message line, returns its reply line.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.buffer = b''
+
+    def feed(self, data):
+        """
+        Handles the bytes of one read.
+
+        :rtype tuple: (bytes to write back, whether to keep reading).
+        """
+        self.buffer += data
+        lines = self.buffer.split(b'\n')
+        self.buffer = lines.pop()
+        if not lines and self.buffer.startswith(b'MESSAGE:'):
+            try:
+                json.loads(self.buffer[8:])
+                lines, self.buffer = [self.buffer], b''
+            except ValueError:
+                pass
+        elif not lines and not b'MESSAGE:'.startswith(self.buffer[:8]):
+            # Not a message, not even an old-style one: refuse and close
+            return b'NAK:Invalid message\n', False
+        return b''.join(self.handle(line.strip()) for line in lines if line.strip()), True
+
+
+def open_session(data, handle):
+    """Session of a new incoming connection, chosen from its first read."""
+    return FrameSession(handle) if is_framed(data) else LineSession(handle)
+
+
+class PeerStream:
+    """
+    Framed, windowed connection to one peer.
+
+    Usage::
+
+      >>> stream = PeerStream(('10.0.0.2', 8002))
+      >>> futures = [stream.send(b'MESSAGE:{...}') for _ in range(1000)]
+      >>> all(f.result(timeout=5) for f in futures)     # True when delivered
+      True
+
+    :params addr (tuple): (ip, port) of the receiving peer.
+    :params window (int): messages in flight before send waits for acks.
+    :params max_batch_bytes (int): payload size above which a batch is cut.
+    :params timeout (float): connect timeout.
+    """
+
+    def __init__(self, addr, window=1024, max_batch_bytes=256 * 1024, timeout=5.0):
+        self.addr = addr
+        self.window = window
+        self.max_batch_bytes = min(max_batch_bytes, MAX_FRAME - 4)
+        self.sock = socket.create_connection(addr, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Acks may take arbitrarily long on an idle stream; callers time out on futures.
+        self.sock.settimeout(None)
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.inflight = deque()
+        self.next_seq = 1
+        self.error = None
+        self.last_used = time.monotonic()
+        self.stats = {'messages': 0, 'frames': 0, 'acks': 0}
+        threading.Thread(target=self._write_loop, daemon=True).start()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def send(self, message):
+        """
+        Queues one message (bytes, without newline).
+
+        :rtype Future: resolves to True when acknowledged, False if the peer
+                       rejected it; fails with the connection error if the
+                       stream breaks first.
+        """
+        future = Future()
+        with self.cond:
+            if self.error is not None:
+                future.set_exception(self.error)
+                return future
+            self.queue.append((self.next_seq, message, future))
+            self.next_seq += 1
+            self.last_used = time.monotonic()
+            self.cond.notify_all()
+        return future
+
+    def idle(self):
+        with self.cond:
+            return not self.queue and not self.inflight
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while self.error is None and (not self.queue or len(self.inflight) >= self.window):
+                    self.cond.wait()
+                if self.error is not None:
+                    return
+                batch = []
+                size = 0
+                first_seq = self.queue[0][0]
+                while self.queue and len(self.inflight) < self.window:
+                    seq, message, future = self.queue[0]
+                    if batch and size + len(message) + 1 > self.max_batch_bytes:
+                        break
+                    self.queue.popleft()
+                    self.inflight.append((seq, future))
+                    batch.append(message)
+                    size += len(message) + 1
+            try:
+                self.sock.sendall(encode_frame(first_seq, b'\n'.join(batch)))
+                self.stats['messages'] += len(batch)
+                self.stats['frames'] += 1
+            except (OSError, ValueError) as e:
+                self._fail(e if isinstance(e, OSError) else ConnectionError(str(e)))
+                return
+
+    def _read_loop(self):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                frame = read_frame(self.sock, decoder)
+                if frame is None:
+                    raise ConnectionError("peer closed the connection")
+                acked, payload = frame
+                rejected = set()
+                if payload.startswith(b'ACK:'):
+                    rejected = {int(s) for s in payload[4:].split(b',') if s}
+                done = []
+                with self.cond:
+                    while self.inflight and self.inflight[0][0] <= acked:
+                        done.append(self.inflight.popleft())
+                    self.last_used = time.monotonic()
+                    self.stats['acks'] += 1
+                    self.cond.notify_all()
+                for seq, future in done:
+                    future.set_result(seq not in rejected)
+        except (OSError, ValueError) as e:
+            self._fail(e if isinstance(e, OSError) else ConnectionError(str(e)))
+
+    def _fail(self, error):
+        with self.cond:
+            if self.error is not None:
+                return
+            self.error = error
+            failed = [f for _, f in self.inflight] + [f for _, _, f in self.queue]
+            self.inflight.clear()
+            self.queue.clear()
+            self.cond.notify_all()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for future in failed:
+            future.set_exception(error)
+
+    def close(self):
+        """Closes the stream; messages not yet acknowledged fail."""
+        self._fail(ConnectionError("stream closed"))
+
+
+class StreamPool:
+    """
+    One :class:`PeerStream` per destination, reopened when broken and closed
+    after ``idle_timeout`` seconds without traffic.
+    """
+
+    def __init__(self, idle_timeout=60.0, window=1024, timeout=5.0):
+        self.idle_timeout = idle_timeout
+        self.window = window
+        self.timeout = timeout
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+        self.closed = False
+
+    def get(self, addr, timeout=None):
+        """
+        Returns a working stream to addr, connecting if needed.
+
+        :params timeout (float): connect timeout, instead of the pool's.
+        :raises OSError: if addr cannot be reached.
+        """
+        with self.lock:
+            stream = self.streams.get(addr)
+            if stream is not None and stream.error is None:
+                return stream
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self._reap_loop, daemon=True)
+                self.reaper.start()
+        # Connect outside the pool lock: one unreachable peer must not block the others.
+        stream = PeerStream(addr, window=self.window, timeout=timeout or self.timeout)
+        with self.lock:
+            current = self.streams.get(addr)
+            if current is not None and current.error is None:
+                stream.close()
+                return current
+            self.streams[addr] = stream
+            return stream
+
+    def send(self, addr, message, timeout=None):
+        """
+        Sends one message to addr.
+
+        :params timeout (float): connect timeout, instead of the pool's.
+        :rtype Future: see :meth:`PeerStream.send`.
+        :raises OSError: if addr cannot be reached.
+        """
+        return self.get(addr, timeout).send(message)
+
+    def discard(self, addr):
+        """Closes the stream to addr, e.g. after an acknowledgement timed out."""
+        with self.lock:
+            stream = self.streams.pop(addr, None)
+        if stream is not None:
+            stream.close()
+
+    def _reap_loop(self):
+        while not self.closed:
+            time.sleep(max(1.0, self.idle_timeout / 2))
+            deadline = time.monotonic() - self.idle_timeout
+            # Check and pop under one lock, so a stream that get() just put in
+            # place of a reaped one is never closed by mistake.
+            with self.lock:
+                idle = [addr for addr, s in self.streams.items()
+                        if s.error is not None or (s.last_used < deadline and s.idle())]
+                idle = [self.streams.pop(addr) for addr in idle]
+            for stream in idle:
+                stream.close()
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            streams, self.streams = list(self.streams.values()), {}
+        for stream in streams:
+            stream.close()
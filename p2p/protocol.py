@@ -0,0 +1,123 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.protocol
+~~~~~~~~~~~~~~~~~
+
+Length-prefixed framing shared by the tracker and the peers.
+
+Frame layout::
+
+    +----------------+----------------+------------------------+
+    | length (4, BE) | req id (4, BE) | payload (length - 4)   |
+    +----------------+----------------+------------------------+
+
+``length`` counts the request id and the payload. Frames are limited to
+``MAX_FRAME`` bytes (< 16 MiB), so the first byte of a framed connection is
+always ``0x00``. Legacy text commands (``REGISTER:...``, ``LOOKUP:...``,
+``MESSAGE:...``) never start with ``0x00``, which lets a server accept both
+on the same port by looking at the first byte only.
+
+Request id 0 is reserved for frames pushed by the server without a request.
+"""
+import struct
+
+HEADER = struct.Struct('!II')
+
+#: Largest value of the length field.
+MAX_FRAME = (1 << 24) - 1
+
+#: First byte of every framed connection.
+FRAME_MAGIC = b'\x00'
+
+#: Request id of server pushed frames.
+PUSH_ID = 0
+
+
+class ProtocolError(ValueError):
+    """Raised on a malformed or oversized frame."""
+
+
+def is_framed(data):
+    """Returns True if data starts a framed connection."""
+    return data[:1] == FRAME_MAGIC
+
+
+def encode_frame(req_id, payload):
+    """
+    Encodes one frame.
+
+    :param req_id: request id (0 for pushes).
+    :param payload: bytes or str (UTF-8 encoded).
+    :rtype: bytes
+    """
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    length = len(payload) + 4
+    if length > MAX_FRAME:
+        raise ProtocolError(f"frame too large ({length} bytes)")
+    return HEADER.pack(length, req_id) + payload
+
+
+class FrameDecoder:
+    """
+    Incremental decoder: feed it received bytes and collect complete frames.
+
+    Usage::
+
+      >>> decoder = FrameDecoder()
+      >>> decoder.feed(sock.recv(65536))
+      >>> for req_id, payload in decoder.frames():
+      ...     handle(req_id, payload)
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+
+    def frames(self):
+        """Yields every complete (req_id, payload) in the buffer."""
+        buf = self.buffer
+        offset = 0
+        try:
+            while len(buf) - offset >= HEADER.size:
+                length, req_id = HEADER.unpack_from(buf, offset)
+                if length < 4 or length > MAX_FRAME:
+                    raise ProtocolError(f"invalid frame length {length}")
+                end = offset + 4 + length
+                if len(buf) < end:
+                    break
+                frame = req_id, bytes(buf[offset + HEADER.size:end])
+                offset = end
+                yield frame
+        finally:
+            del buf[:offset]
+
+
+def read_frame(sock, decoder):
+    """
+    Blocks until one frame is available on a socket.
+
+    :param sock: connected socket.
+    :param decoder: :class:`FrameDecoder` holding bytes already received.
+    :return: (req_id, payload), or None if the peer closed the connection.
+    """
+    while True:
+        for frame in decoder.frames():
+            return frame
+        chunk = sock.recv(65536)
+        if not chunk:
+            return None
+        decoder.feed(chunk)
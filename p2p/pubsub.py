@@ -0,0 +1,137 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.pubsub
+~~~~~~~~~~~~~~~~~
+
+This module pushes registry changes from the tracker to subscribed peers.
+
+Events are compact text lines, several per push frame (request id 0)::
+
+    J:<version>:<username>:<ip>:<port>    peer joined
+    U:<version>:<username>:<ip>:<port>    peer changed address
+    L:<version>:<username>                peer left
+    R:<version>                           events were dropped, resync
+
+Every subscriber has a bounded queue. When a subscriber reads too slowly
+and its queue fills up, the queue is cleared and replaced by a single ``R``
+event. Memory per subscriber stays bounded, and the subscriber catches up
+with ``LOOKUP_SINCE`` instead of receiving a backlog.
+"""
+import threading
+from collections import deque
+
+
+def encode_event(version, op, username, addr=None):
+    """Encodes one event line; op is 'J', 'U' or 'L'."""
+    if addr is None:
+        return f"{op}:{version}:{username}"
+    return f"{op}:{version}:{username}:{addr[0]}:{addr[1]}"
+
+
+def parse_events(payload):
+    """
+    Parses a push frame.
+
+    :rtype list: (op, version, username or None, (ip, port) or None) tuples.
+    """
+    events = []
+    for line in payload.split('\n'):
+        parts = line.split(':')
+        if len(parts) < 2:
+            continue
+        op, version = parts[0], int(parts[1])
+        username = parts[2] if len(parts) > 2 else None
+        addr = (parts[3], int(parts[4])) if len(parts) == 5 else None
+        events.append((op, version, username, addr))
+    return events
+
+
+class Subscription:
+    """
+    Bounded event queue of one subscriber.
+
+    :params limit (int): events kept before the subscriber is resynced.
+    :params wakeup (callable): called (from any thread) when events are queued.
+    :params version (callable): returns the current registry version, for ``R`` events.
+    """
+
+    def __init__(self, limit, wakeup, version):
+        self.limit = limit
+        self.wakeup = wakeup
+        self.version = version
+        self.events = deque()
+        self.lock = threading.Lock()
+        self.resyncs = 0
+        self.closed = False
+
+    def offer(self, event):
+        with self.lock:
+            if self.events and self.events[0] is None:
+                # A resync is pending: later events are covered by LOOKUP_SINCE.
+                return
+            if len(self.events) >= self.limit:
+                self.events.clear()
+                self.events.append(None)
+                self.resyncs += 1
+            else:
+                self.events.append(event)
+        self.wakeup()
+
+    def drain(self):
+        """Returns the queued events as one push payload, or None."""
+        with self.lock:
+            if not self.events:
+                return None
+            if self.events[0] is None:
+                self.events.clear()
+                return f"R:{self.version()}"
+            events = list(self.events)
+            self.events.clear()
+        return '\n'.join(events)
+
+
+class Broker:
+    """Set of subscriptions receiving every published event."""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def drop(self, subscription):
+        """Removes a subscriber that stopped reading altogether."""
+        self.unsubscribe(subscription)
+        self.dropped += 1
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+            self.published += 1
+        for subscription in subscriptions:
+            subscription.offer(event)
+
+    def stats(self):
+        with self.lock:
+            return {'subscribers': len(self.subscriptions), 'published': self.published,
+                    'dropped': self.dropped,
+                    'resyncs': sum(s.resyncs for s in self.subscriptions)}
@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.ratelimit
+~~~~~~~~~~~~~~~~~
+
+This module keeps one misbehaving client from starving the others.
+
+:class:`RateLimiter <RateLimiter>` holds token buckets per source IP and per
+username, with a separate budget per command class. A command is checked
+from its first two fields only (``NAME:username...``), before the tracker
+parses or routes it, so a rejection costs a dict lookup and a subtraction.
+
+Buckets refill lazily when they are checked, so idle clients cost nothing.
+At most ``max_keys`` buckets are kept; the least recently used are evicted,
+which bounds memory when an attacker rotates usernames.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+#: Command classes; commands not listed here are not limited.
+COMMAND_CLASSES = {
+    'REGISTER': 'REGISTER',
+    'HEARTBEAT': 'HEARTBEAT',
+    'LOOKUP': 'LOOKUP',
+    'LOOKUP_SINCE': 'LOOKUP',
+    'LOOKUP_PAGE': 'LOOKUP',
+    'SEARCH': 'LOOKUP',
+    'SEARCH_ANY': 'LOOKUP',
+    'JOIN': 'LOOKUP',
+    'PART': 'LOOKUP',
+    'PARTALL': 'LOOKUP',
+    'MEMBERS': 'LOOKUP',
+}
+
+#: Classes whose second field is the username issuing the command. LOOKUP
+#: names the peer looked up (or a channel), not the caller, so it is only
+#: limited per IP.
+USER_CLASSES = ('REGISTER', 'HEARTBEAT')
+
+
+class RateLimiter:
+    """
+    Token buckets per (source IP, class) and (username, class).
+
+    Usage::
+
+      >>> limiter = RateLimiter({'LOOKUP': (200, 1000, None, None),
+      ...                        'REGISTER': (50, 200, 2, 10)})
+      >>> limiter.allow('10.0.0.5', 'LOOKUP:*')
+      True
+
+    :params budgets (dict): class -> (ip rate, ip burst, user rate, user burst);
+                            rates are tokens per second, None disables a bucket.
+    :params max_keys (int): buckets kept before the least recently used are evicted.
+    :params exempt (set): source IPs never limited (e.g. other cluster nodes).
+    """
+
+    def __init__(self, budgets, max_keys=100000, exempt=()):
+        self.budgets = budgets
+        self.max_keys = max_keys
+        self.exempt = set(exempt)
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def _take(self, key, rate, burst, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets.popitem(last=False)
+            bucket = self.buckets[key] = [float(burst), now]
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def allow(self, source, command):
+        """
+        Takes one token for command from the buckets of source and of the
+        username in command.
+
+        :rtype bool: False if either bucket is empty.
+        """
+        if source in self.exempt:
+            return True
+        name, _, rest = command.partition(':')
+        cls = COMMAND_CLASSES.get(name)
+        budget = self.budgets.get(cls) if cls else None
+        if budget is None:
+            return True
+        ip_rate, ip_burst, user_rate, user_burst = budget
+        now = time.monotonic()
+        with self.lock:
+            if ip_rate is not None and not self._take((source, cls), ip_rate, ip_burst, now):
+                self.rejected += 1
+                return False
+            if user_rate is not None and cls in USER_CLASSES:
+                username = rest.partition(':')[0]
+                if not self._take(('user', username, cls), user_rate, user_burst, now):
+                    self.rejected += 1
+                    return False
+        return True
+
+    def stats(self):
+        with self.lock:
+            return {'rejected': self.rejected, 'buckets': len(self.buckets)}
@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.timerwheel
+~~~~~~~~~~~~~~~~~
+
+This module provides a hierarchical timer wheel used by the tracker to expire
+peers that stopped sending heartbeats.
+
+Scheduling, rescheduling and cancelling a key are O(1). Each wheel level has
+``slots`` buckets; level ``L`` buckets span ``slots ** L`` ticks. A key far in
+the future sits in a coarse bucket and is cascaded to a finer level when the
+clock reaches that bucket, so a key moves at most ``levels - 1`` times before
+it fires, and advancing the clock never scans keys that are not due.
+"""
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel keyed by arbitrary hashable keys.
+
+    Usage::
+
+      >>> wheel = TimerWheel(tick=1.0)
+      >>> wheel.schedule('alice', time.monotonic() + 30)
+      >>> wheel.schedule('alice', time.monotonic() + 30)   # heartbeat: push back
+      >>> expired = wheel.advance(time.monotonic())
+
+    :params tick (float): resolution in seconds.
+    :params slots (int): buckets per level.
+    :params levels (int): number of levels; the horizon is ``slots ** levels`` ticks.
+    :params now (float): current time in seconds (same clock as deadlines).
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=4, now=0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.spans = [slots ** level for level in range(levels + 1)]
+        self.current = int(now / tick)
+        #: key -> (expiry tick, level, slot)
+        self.where = {}
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def _place(self, key, when):
+        # Keys beyond the horizon are parked in the last bucket and placed
+        # again when it is cascaded.
+        delta = min(max(when - self.current, 0), self.spans[-1] - 1)
+        for level in range(self.levels):
+            if delta < self.spans[level + 1]:
+                index = ((self.current + delta) // self.spans[level]) % self.slots
+                self.wheels[level][index].add(key)
+                self.where[key] = (when, level, index)
+                return
+
+    def schedule(self, key, deadline):
+        """
+        Schedules key to expire at deadline, replacing any earlier schedule.
+
+        :params deadline (float): absolute time in seconds.
+        """
+        self.cancel(key)
+        # Round up, so a key never fires before its deadline.
+        self._place(key, -int(-deadline // self.tick))
+
+    def cancel(self, key):
+        """Removes key; returns False if it was not scheduled."""
+        entry = self.where.pop(key, None)
+        if entry is None:
+            return False
+        _, level, index = entry
+        self.wheels[level][index].discard(key)
+        return True
+
+    def advance(self, now):
+        """
+        Moves the clock to now and returns the keys whose deadline has passed.
+
+        :rtype list: expired keys, in expiry order.
+        """
+        target = int(now / self.tick)
+        expired = []
+        if not self.where:
+            self.current = max(self.current, target)
+            return expired
+        while self.current < target:
+            self.current += 1
+            # Cascade coarse buckets whose span starts now, highest level first.
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % self.spans[level] == 0:
+                    index = (self.current // self.spans[level]) % self.slots
+                    bucket = self.wheels[level][index]
+                    self.wheels[level][index] = set()
+                    for key in bucket:
+                        self._place(key, self.where[key][0])
+            bucket = self.wheels[0][self.current % self.slots]
+            self.wheels[0][self.current % self.slots] = set()
+            for key in bucket:
+                if self.where[key][0] > self.current:
+                    self._place(key, self.where[key][0])
+                    continue
+                del self.where[key]
+                expired.append(key)
+            if not self.where:
+                self.current = target
+        return expired
@@ -0,0 +1,304 @@
+#
+# Copyright (C) 2025 pdnguyen of HCMC University of Technology VNU-HCM.
+# All rights reserved.
+# This file is part of the CO3093/CO3094 course.
+#
+# WeApRous release
+#
+# The authors hereby grant to Licensee personal permission to use
+# and modify the Licensed Source Code for the sole purpose of studying
+# while attending the course
+#
+
+"""
+p2p.wal
+~~~~~~~~~~~~~~~~~
+
+This module makes the tracker registry durable with an append-only
+write-ahead log and periodic snapshots.
+
+Layout of the data directory::
+
+    snapshot.json                 latest compacted registry (flat JSON array)
+    wal-00000000000000000001.log  log segment, named by its first version
+    wal-...
+
+A record is a JSON array ``[version, op, username, ip, port]``; ``op`` is
+``"J"`` (join or address change) or ``"L"`` (leave). Records carry the
+registry version, so a record already included in the snapshot is skipped on
+replay.
+
+Writers append records to an in-memory batch and a single flusher thread
+writes and fsyncs everything queued so far in one go (group commit). A
+writer that needs durability waits for the flusher, so N concurrent
+registrations cost one fsync instead of N. Each batch is written as one
+block ``length (4) | crc32 (4) | records separated by newlines``, which is
+also the unit a crash can tear.
+
+Recovery loads ``snapshot.json``, checks the blocks of each segment, cuts off
+a torn block at the tail and decodes all the records of a segment with a
+single ``json.loads`` call.
+"""
+import json
+import os
+import struct
+import threading
+import zlib
+
+BLOCK = struct.Struct('!II')
+
+SNAPSHOT = 'snapshot.json'
+
+
+def _segment_name(version):
+    return f"wal-{version:020d}.log"
+
+
+def encode_record(version, op, username, addr=None):
+    """Encodes one log record (without newline)."""
+    if addr is None:
+        fields = [version, op, username]
+    else:
+        fields = [version, op, username, addr[0], addr[1]]
+    return json.dumps(fields, separators=(',', ':')).encode('utf-8')
+
+
+def encode_block(records):
+    """Encodes a batch of records as one checksummed block."""
+    payload = b'\n'.join(records)
+    return BLOCK.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path):
+    """
+    Reads the valid records of a segment.
+
+    :rtype tuple: (list of records, offset of the end of the last valid block).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    payloads = []
+    offset = 0
+    end = len(data)
+    while offset + BLOCK.size <= end:
+        length, crc = BLOCK.unpack_from(data, offset)
+        start = offset + BLOCK.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        payloads.append(payload.replace(b'\n', b','))
+        offset = start + length
+    if not payloads:
+        return [], offset
+    # JSON escapes newlines inside strings, so every raw newline separates two
+    # records and the whole segment decodes as one array.
+    return json.loads(b'[' + b','.join(payloads) + b']'), offset
+
+
+class RegistryLog:
+    """
+    Write-ahead log and snapshots of the tracker registry.
+
+    Usage::
+
+      >>> log = RegistryLog('data/tracker')
+      >>> version, peers = log.recover()
+      >>> seq = log.append(version + 1, 'J', 'alice', ('10.0.0.1', 8001))
+      >>> log.wait(seq)          # returns once the record is on disk
+
+    :params data_dir (str): directory holding the snapshot and log segments.
+    :params snapshot_every (int): records after which :meth:`needs_snapshot` is True.
+    :params fsync (bool): fsync every batch (disable only for tests).
+    """
+
+    def __init__(self, data_dir, snapshot_every=100000, fsync=True):
+        self.data_dir = data_dir
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.flushed = threading.Condition(self.lock)
+        self.pending = []
+        self.seq = 0
+        self.durable = 0
+        self.file = None
+        self.retired = []
+        self.error = None
+        self.closed = False
+        self.since_snapshot = 0
+        self.snapshotting = False
+        #: Number of fsyncs issued, for the group commit statistics.
+        self.syncs = 0
+        os.makedirs(data_dir, exist_ok=True)
+        self.flusher = None
+
+    def _path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def _segments(self):
+        return sorted(n for n in os.listdir(self.data_dir)
+                      if n.startswith('wal-') and n.endswith('.log'))
+
+    def recover(self):
+        """
+        Loads the snapshot, replays the log and opens the log for appends.
+
+        :rtype tuple: (version, {username: (ip, port)}); version is 0 for an
+                      empty directory.
+        """
+        version = 0
+        peers = {}
+        path = self._path(SNAPSHOT)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                snapshot = json.load(f)
+            version = snapshot['version']
+            fields = iter(snapshot['peers'])
+            peers = {u: (ip, port) for u, ip, port in zip(fields, fields, fields)}
+
+        replayed = 0
+        for name in self._segments():
+            records, end = read_records(self._path(name))
+            if end < os.path.getsize(self._path(name)):
+                print(f"[WAL] Truncating torn record at the end of {name} (offset {end})")
+                with open(self._path(name), 'r+b') as f:
+                    f.truncate(end)
+            for record in records:
+                if record[0] <= version:
+                    continue
+                if record[1] == 'J':
+                    peers[record[2]] = (record[3], record[4])
+                else:
+                    peers.pop(record[2], None)
+                version = record[0]
+                replayed += 1
+        self.since_snapshot = replayed
+        self.file = open(self._path(_segment_name(version + 1)), 'ab')
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+        return version, peers
+
+    def append(self, version, op, username, addr=None):
+        """
+        Queues one record; does not wait for the disk.
+
+        Callers append under the registry lock, so records are logged in
+        version order.
+
+        :rtype int: sequence number to pass to :meth:`wait`.
+        """
+        record = encode_record(version, op, username, addr)
+        with self.lock:
+            self.pending.append(record)
+            self.seq += 1
+            self.since_snapshot += 1
+            self.wakeup.notify()
+            return self.seq
+
+    def wait(self, seq):
+        """
+        Blocks until record seq is durable.
+
+        :raises OSError: if writing the log failed.
+        """
+        with self.lock:
+            while self.durable < seq and self.error is None:
+                self.flushed.wait()
+            if self.error is not None:
+                raise self.error
+
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.wakeup.wait()
+                if not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+                seq = self.seq
+                f = self.file
+                retired, self.retired = self.retired, []
+            try:
+                f.write(encode_block(batch))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                for old in retired:
+                    old.close()
+            except OSError as e:
+                print(f"[WAL] Write error: {e}")
+                with self.lock:
+                    self.error = e
+                    self.flushed.notify_all()
+                return
+            with self.lock:
+                self.syncs += 1
+                self.durable = seq
+                self.flushed.notify_all()
+
+    def needs_snapshot(self):
+        """True when enough records were logged since the last snapshot."""
+        return not self.snapshotting and self.since_snapshot >= self.snapshot_every
+
+    def rotate(self, version):
+        """
+        Starts a new segment for records after version. Called under the
+        registry lock, together with the copy of the registry that
+        :meth:`write_snapshot` will store.
+        """
+        with self.lock:
+            self.snapshotting = True
+            self.since_snapshot = 0
+            self.retired.append(self.file)
+            self.file = open(self._path(_segment_name(version + 1)), 'ab')
+
+    def write_snapshot(self, version, peers):
+        """
+        Writes a compacted snapshot atomically, then deletes the log segments
+        it covers.
+
+        :params version (int): registry version of peers (the one passed to :meth:`rotate`).
+        :params peers (dict): {username: (ip, port)}.
+        """
+        try:
+            tmp = self._path(SNAPSHOT + '.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                # Flat [username, ip, port, ...] array: decodes much faster than
+                # a list of lists or an object.
+                flat = [field for u, (ip, port) in peers.items() for field in (u, ip, port)]
+                json.dump({'version': version, 'peers': flat}, f, separators=(',', ':'))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp, self._path(SNAPSHOT))
+            if self.fsync:
+                fd = os.open(self.data_dir, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            current = _segment_name(version + 1)
+            for name in self._segments():
+                if name < current:
+                    os.remove(self._path(name))
+            print(f"[WAL] Snapshot of {len(peers)} peers at version {version}")
+        finally:
+            with self.lock:
+                self.snapshotting = False
+
+    def stats(self):
+        with self.lock:
+            return {'records': self.seq, 'durable': self.durable, 'fsyncs': self.syncs,
+                    'since_snapshot': self.since_snapshot}
+
+    def close(self):
+        """Flushes the queued records and stops the flusher."""
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        if self.flusher is not None:
+            self.flusher.join()
+        if self.file is not None:
+            self.file.close()
+        for old in self.retired:
+            old.close()
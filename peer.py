@@ -1,40 +1,482 @@
+import asyncio
 import socket
+import sys
 import threading
 import json
+import os
 import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
 from datetime import datetime
 
+from p2p.addrcache import NOT_FOUND, AddressCache
+from p2p.aio import AsyncStreamPool, AsyncTrackerClient
+from p2p.channels import valid_channel
+from p2p.client import PeerDirectory, TrackerClient, TrackerSubscription
+from p2p.cluster import connect_tracker
+from p2p.filexfer import MAX_SIZE as MAX_FILE_SIZE, TransferRejected, receive_file, send_file
+from p2p.gossip import Gossip
+from p2p.msgstore import MessageStore
+from p2p.outbox import Outbox
+from p2p.peerwire import StreamPool, open_session
+from p2p.protocol import ProtocolError
 
-class Peer:
+
+# Kích thước tối đa dòng FILE: (danh sách checksum của file, ~11 byte mỗi MB)
+MAX_FILE_HEADER = 16 << 20
+
+
+def run_steps(steps, perform):
+    """
+    Chạy một generator *_steps của PeerCore: mỗi thao tác I/O nó yield (op, *args) được
+    thực hiện bằng perform, kết quả (hoặc exception) được gửi lại vào generator.
+    :return: Giá trị return của generator.
+    """
+    value, error = None, None
+    while True:
+        try:
+            request = steps.send(value) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = perform(*request), None
+        except Exception as e:
+            value, error = None, e
+
+
+async def run_steps_async(steps, perform):
+    """Như run_steps, với perform là coroutine (AsyncPeer)."""
+    value, error = None, None
+    while True:
+        try:
+            request = steps.send(value) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = await perform(*request), None
+        except Exception as e:
+            value, error = None, e
+
+
+class PeerCore:
+    """
+    Phần dùng chung của Peer (thread) và AsyncPeer (asyncio): trạng thái của peer, xử lý
+    tin nhận được, gossip, kênh và outbox. Các thao tác cần mạng được viết thành generator
+    (*_steps) yield ra thao tác I/O, ví dụ ('call', 'LOOKUP:bob') hay ('send', addr, line,
+    timeout); Peer thực hiện chúng bằng socket chặn, AsyncPeer bằng await, nên hai lớp con
+    chỉ giữ phần transport:
+      - call(command), call_many(commands): gọi tracker;
+      - send(addr, line, timeout): gửi một tin qua stream, trả future chờ ACK;
+      - wait(future, timeout): chờ ACK, hết giờ thì raise TimeoutError;
+      - send_all(targets, msg, ...): gửi song song (xem Peer._send_all);
+      - refresh_peers(): làm mới danh sách peers;
+    cùng _gossip_send và _wake_outbox (gửi nền, không chờ).
+    """
+
+    def __init__(self, username, listen_port, history_dir=None, ip=None):
+        self.username = username
+        self.listen_port = listen_port
+        self.ip = ip
+        self.peers = {}  # Cache peers: {username: (ip, port)}
+        # Địa chỉ dùng khi gửi tin: có TTL, nhớ cả username không tồn tại (p2p/addrcache.py)
+        self.addresses = AddressCache()
+        # Lịch sử tin nhắn: ring buffer tin gần nhất + log phân đoạn trên đĩa (p2p/msgstore.py)
+        self.messages = MessageStore(history_dir)
+        self.history_dir = history_dir
+        self.channels = {}  # Lịch sử riêng của từng kênh: {channel: MessageStore}
+        self.joined = set()  # Các kênh peer đang tham gia
+        # Tin chưa gửi được, xếp theo người nhận và gửi lại khi họ online (p2p/outbox.py)
+        self.outbox = Outbox(os.path.join(history_dir, 'outbox') if history_dir else None, max_delay=60.0)
+        self.gossip = Gossip()  # Chống trùng + chọn peer ngẫu nhiên cho broadcast kiểu gossip
+        self.lock = threading.Lock()  # Thread-safe cho shared data
+        self.running = True
+
+    def _register_command(self):
+        ip = self.ip or socket.gethostbyname(socket.gethostname())
+        return f"REGISTER:{self.username}:{ip}:{self.listen_port}"
+
+    def _new_message(self, msg, channel=None):
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        message_data = {
+            'time': timestamp,
+            'sender': self.username,
+            'msg': msg
+        }
+        if channel is not None:
+            message_data['channel'] = channel
+        return message_data
+
+    def _parse_found(self, target_username, response):
+        """Đọc response LOOKUP vào cache địa chỉ; trả addr hoặc None."""
+        if response.startswith('FOUND:'):
+            ip, port_str = response[6:].strip().split(':')
+            addr = (ip, int(port_str))
+            self.addresses.put(target_username, addr)
+            return addr
+        if response.startswith('NAK:Peer not found'):
+            self.addresses.put(target_username, None)
+        return None
+
+    def _channel_store(self, channel):
+        """Lịch sử của kênh, tạo khi cần (thư mục <history_dir>/channels/<channel>)."""
+        with self.lock:
+            store = self.channels.get(channel)
+            if store is None:
+                data_dir = None
+                if self.history_dir is not None:
+                    data_dir = os.path.join(self.history_dir, 'channels', channel)
+                store = self.channels[channel] = MessageStore(data_dir)
+            return store
+
+    def _handle_line(self, line):
+        """
+        Xử lý một tin nhận được (một dòng MESSAGE:{json}), trả dòng ACK/NAK trả lời.
+        Lỗi khi xử lý một tin chỉ làm tin đó bị NAK, các tin cùng frame vẫn được xử lý.
+        """
+        try:
+            return self._handle_message(line)
+        except Exception as e:
+            print(f"[Peer {self.username}] Lỗi xử lý tin nhắn: {e}")
+            return b'NAK:Invalid message\n'
+
+    def _handle_message(self, line):
+        if not line.startswith(b'MESSAGE:'):
+            return b'NAK:Invalid message\n'
+        try:
+            msg_data = json.loads(line[8:])  # Parse JSON message
+            sender, text = msg_data['sender'], msg_data['msg']
+        except (ValueError, KeyError, TypeError):
+            return b'NAK:Invalid message\n'
+        channel = msg_data.get('channel')
+        if channel is not None:
+            # Tin kênh: chỉ nhận cho kênh đang tham gia, lưu vào lịch sử của kênh
+            if not valid_channel(channel) or channel not in self.joined:
+                return b'NAK:Not a member\n'
+            self._channel_store(channel).append(msg_data)
+            print(f"[Peer {self.username}] #{channel} {sender}: {text}")
+            return b'ACK:Message received\n'
+        if 'id' in msg_data:
+            # Tin gossip: bỏ qua bản trùng, chuyển tiếp nếu còn TTL
+            if not isinstance(msg_data['id'], str) or not isinstance(msg_data.get('ttl', 0), int):
+                return b'NAK:Invalid message\n'
+            deliver, forward = self.gossip.receive(msg_data)
+            if not deliver:
+                return b'ACK:Duplicate\n'
+            if forward is not None:
+                exclude = (self.username, sender, msg_data.get('relay'))
+                self._gossip_send(dict(forward, relay=self.username), exclude)
+            msg_data = {'time': msg_data.get('time'), 'sender': sender, 'msg': text}
+        with self.lock:
+            self.messages.append(msg_data)
+        print(f"[Peer {self.username}] Nhận từ {sender}: {text}")
+        if self.outbox.pending(sender):
+            # Người gửi đang online: gửi luôn các tin đang chờ cho họ
+            self._wake_outbox(sender)
+        return b'ACK:Message received\n'
+
+    def _gossip_targets(self, message, exclude):
+        """Dòng cần gửi, bản sao danh sách peers và fanout peers được chọn cho một tin gossip."""
+        line = f"MESSAGE:{json.dumps(message)}".encode('utf-8')
+        with self.lock:
+            peers = dict(self.peers)
+        return line, peers, self.gossip.targets(peers, exclude)
+
+    def _heartbeat_steps(self):
+        """Một nhịp heartbeat; trả các peer có tin outbox tới lượt gửi lại."""
+        try:
+            response = yield ('call', f"HEARTBEAT:{self.username}")
+            if response.startswith('NAK:Peer not found'):
+                response = yield ('call', self._register_command())
+                print(f"[Peer {self.username}] Tracker đã loại peer, đăng ký lại: {response}")
+                # Tracker đã xoá peer khỏi mọi kênh khi loại peer
+                for channel in list(self.joined):
+                    yield ('call', f"JOIN:{channel}:{self.username}")
+        except (OSError, ProtocolError) as e:
+            print(f"[Peer {self.username}] Lỗi heartbeat: {e}")
+        self.outbox.expire()
+        return self.outbox.due()
+
+    def _search_steps(self, prefix, limit, cursor, substring):
+        command = 'SEARCH_ANY' if substring else 'SEARCH'
+        try:
+            response = yield ('call', f"{command}:{prefix}:{limit}:{cursor}")
+            if response.startswith('RESULTS:'):
+                page = json.loads(response[8:])
+                return page['peers'], page['next']
+            print(f"[Peer {self.username}] Tìm kiếm thất bại: {response}")
+        except (OSError, ProtocolError) as e:
+            print(f"[Peer {self.username}] Lỗi tìm kiếm: {e}")
+        return [], None
+
+    def _resolve_steps(self, target_username):
+        addr = self.addresses.get(target_username)
+        if addr is NOT_FOUND:
+            print(f"[Peer {self.username}] Không tìm thấy peer: {target_username} (cache)")
+            return None
+        if addr is not None:
+            return addr
+        try:
+            response = yield ('call', f"LOOKUP:{target_username}")
+            addr = self._parse_found(target_username, response)
+            if addr is not None:
+                print(f"[Peer {self.username}] Tìm thấy {target_username} tại {addr}")
+                return addr
+            print(f"[Peer {self.username}] Không tìm thấy peer: {response}")
+        except (OSError, ValueError) as e:
+            print(f"[Peer {self.username}] Lỗi tìm kiếm: {e}")
+        return None
+
+    def _prefetch_steps(self, usernames):
+        missing = self.addresses.missing([u for u in usernames if u != self.username])
+        if not missing:
+            return 0
+        try:
+            responses = yield ('call_many', [f"LOOKUP:{u}" for u in missing])
+        except (OSError, ProtocolError) as e:
+            print(f"[Peer {self.username}] Lỗi tải trước địa chỉ: {e}")
+            return 0
+        for target_username, response in zip(missing, responses):
+            try:
+                self._parse_found(target_username, response)
+            except ValueError:
+                pass
+        return len(missing)
+
+    def _deliver_steps(self, addr, message_data, target_username, timeout=None):
+        """
+        Gửi một tin qua kết nối framed đã mở sẵn tới peer đích; các tin gửi đồng thời được
+        gom vào cùng frame và được ACK chung (xem p2p/peerwire.py).
+        :return: True nếu được ACK, False nếu peer từ chối, None nếu không tới được peer.
+        """
+        line = f"MESSAGE:{json.dumps(message_data)}".encode('utf-8')
+        # timeout tính cho cả kết nối lẫn chờ ACK
+        timeout = timeout or self.streams.timeout
+        deadline = time.monotonic() + timeout
+        try:
+            future = yield ('send', addr, line, timeout)
+            return (yield ('wait', future, max(0.0, deadline - time.monotonic())))
+        except TimeoutError:
+            self.streams.discard(addr)
+            print(f"[Peer {self.username}] Hết thời gian kết nối/chờ ACK từ {target_username}")
+        except OSError as e:
+            print(f"[Peer {self.username}] Lỗi gửi: {e}")
+        # Địa chỉ có thể đã cũ (peer đổi địa chỉ): lần sau LOOKUP lại
+        self.addresses.invalidate(target_username)
+        return None
+
+    def _send_message_steps(self, target_username, msg, timeout=None, channel=None, queue=True):
+        message_data = self._new_message(msg, channel)
+        # Còn tin chờ cho peer này thì xếp sau chúng để giữ thứ tự
+        if not (queue and self.outbox.pending(target_username)):
+            addr = yield from self._resolve_steps(target_username)
+            delivered = None
+            if addr is not None:
+                delivered = yield from self._deliver_steps(addr, message_data, target_username, timeout)
+            if delivered is None and addr is not None:
+                # Địa chỉ trong cache không kết nối được: hỏi lại tracker, thử lại nếu peer đã đổi địa chỉ
+                fresh = yield from self._resolve_steps(target_username)
+                if fresh is not None and fresh != addr:
+                    delivered = yield from self._deliver_steps(fresh, message_data, target_username, timeout)
+            if delivered:
+                if channel is None:
+                    with self.lock:
+                        self.messages.append(message_data)
+                print(f"[Peer {self.username}] Đã gửi tới {target_username}: {msg}")
+                return True
+            if delivered is False:
+                print(f"[Peer {self.username}] Gửi thất bại: {target_username} từ chối tin nhắn")
+                return False
+        if queue and self.outbox.put(target_username, message_data):
+            print(f"[Peer {self.username}] Chưa gửi được tới {target_username}, đã xếp vào outbox "
+                  f"({self.outbox.pending(target_username)} tin chờ)")
+        return False
+
+    def _flush_outbox_steps(self, target_username):
+        """Gửi cả lô tin đang chờ cho một peer; tin không được ACK sẽ thử lại sau (backoff)."""
+        batch = self.outbox.take(target_username)
+        if not batch:
+            return 0
+        handled = []
+        addr = None
+        try:
+            addr = yield from self._resolve_steps(target_username)
+            if addr is not None:
+                futures = []
+                for id, message in batch:
+                    line = f"MESSAGE:{json.dumps(message)}".encode('utf-8')
+                    futures.append((id, message, (yield ('send', addr, line, None))))
+                for id, message, future in futures:
+                    if (yield ('wait', future, self.streams.timeout)) and 'channel' not in message:
+                        with self.lock:
+                            self.messages.append(message)
+                    # Tin bị peer từ chối cũng bỏ khỏi outbox: gửi lại vẫn bị từ chối
+                    handled.append(id)
+        except TimeoutError:
+            self.streams.discard(addr)
+            self.addresses.invalidate(target_username)
+        except OSError as e:
+            print(f"[Peer {self.username}] Gửi lại outbox tới {target_username} lỗi: {e}")
+            self.addresses.invalidate(target_username)
+        finally:
+            self.outbox.finish(target_username, handled)
+        if handled:
+            print(f"[Peer {self.username}] Đã gửi lại {len(handled)}/{len(batch)} tin chờ tới {target_username}")
+        return len(handled)
+
+    def _broadcast_steps(self, msg, target_timeout, deadline, max_workers):
+        yield ('refresh_peers',)
+        targets = [u for u in self.peers if u != self.username]  # Avoid self-send
+        if not targets:
+            return {}
+        results = yield ('send_all', targets, msg, target_timeout, deadline, max_workers)
+        success_count = sum(r == 'delivered' for r in results.values())
+        print(f"[Peer {self.username}] Truyền tới {success_count}/{len(targets)} peers: {msg}")
+        return results
+
+    def _gossip_steps(self, msg):
+        if not self.peers:
+            yield ('refresh_peers',)
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        message = self.gossip.originate(self.username, msg, time=timestamp)
+        with self.lock:
+            self.messages.append({'time': timestamp, 'sender': self.username, 'msg': msg})
+        targets = self._gossip_send(message, (self.username,))
+        print(f"[Peer {self.username}] Gossip tới {len(targets)} peers: {msg}")
+        return targets
+
+    def _join_steps(self, channel):
+        if not valid_channel(channel):
+            print(f"[Peer {self.username}] Tên kênh không hợp lệ: {channel}")
+            return False
+        try:
+            response = yield ('call', f"JOIN:{channel}:{self.username}")
+        except (OSError, ProtocolError) as e:
+            print(f"[Peer {self.username}] Lỗi kết nối tracker: {e}")
+            return False
+        if not response.startswith('ACK'):
+            print(f"[Peer {self.username}] Không vào được kênh #{channel}: {response}")
+            return False
+        self._channel_store(channel)
+        with self.lock:
+            self.joined.add(channel)
+        print(f"[Peer {self.username}] Đã vào kênh #{channel}")
+        return True
+
+    def _part_steps(self, channel):
+        with self.lock:
+            self.joined.discard(channel)
+        try:
+            return (yield ('call', f"PART:{channel}:{self.username}")).startswith('ACK')
+        except (OSError, ProtocolError) as e:
+            print(f"[Peer {self.username}] Lỗi kết nối tracker: {e}")
+            return False
+
+    def _members_steps(self, channel, page_size=1000):
+        members = []
+        cursor = ''
+        while True:
+            response = yield ('call', f"MEMBERS:{channel}:{page_size}:{cursor}")
+            if not response.startswith('MEMBERS:'):
+                raise ValueError(f"unexpected response: {response}")
+            page = json.loads(response[8:])
+            members.extend(page['members'])
+            cursor = page['next']
+            if cursor is None:
+                return members
+
+    def _channel_message_steps(self, channel, msg, target_timeout, deadline, max_workers):
+        if channel not in self.joined:
+            print(f"[Peer {self.username}] Chưa vào kênh #{channel}")
+            return {}
+        try:
+            members = yield from self._members_steps(channel)
+        except (OSError, ValueError) as e:
+            print(f"[Peer {self.username}] Không tải được thành viên kênh #{channel}: {e}")
+            return {}
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._channel_store(channel).append({'time': timestamp, 'sender': self.username, 'msg': msg})
+        targets = [u for u in members if u != self.username]
+        yield from self._prefetch_steps(targets)
+        results = yield ('send_all', targets, msg, target_timeout, deadline, max_workers, channel)
+        success_count = sum(r == 'delivered' for r in results.values())
+        print(f"[Peer {self.username}] #{channel}: gửi tới {success_count}/{len(targets)} thành viên: {msg}")
+        return results
+
+    def _close_stores(self):
+        self.messages.close()
+        self.outbox.close()
+        for store in self.channels.values():
+            store.close()
+
+
+class Peer(PeerCore):
     """
     Class Peer đại diện cho peer process trong hybrid chat application.
     Hỗ trợ đăng ký với tracker, khám phá peers, gửi/nhận tin nhắn P2P qua TCP socket,
     và polling messages. Tích hợp concurrency qua threading cho multi-peer connections.
+    Logic tin nhắn/kênh/outbox nằm ở PeerCore; lớp này thực hiện I/O bằng socket chặn.
     """
-    
-    def __init__(self, username, listen_port, tracker_host='localhost', tracker_port=9000):
+
+    def __init__(self, username, listen_port, tracker_host='localhost', tracker_port=9000, tracker_nodes=None,
+                 history_dir=None, download_dir='downloads', max_file_size=MAX_FILE_SIZE):
         """
         Khởi tạo Peer.
         :param username: Tên peer (để đăng ký và gửi tin nhắn).
         :param listen_port: Port lắng nghe P2P connections.
         :param tracker_host: Host của tracker server.
         :param tracker_port: Port của tracker server.
+        :param tracker_nodes: Danh sách "host:port" của cluster tracker (thay cho host/port).
+        :param history_dir: Thư mục lưu lịch sử tin nhắn trên đĩa (None: chỉ giữ tin gần nhất trong RAM).
+        :param download_dir: Thư mục lưu file nhận từ peers khác (xem p2p/filexfer.py).
+        :param max_file_size: Kích thước file lớn nhất (bytes) chấp nhận nhận từ peers khác.
         """
-        self.username = username
-        self.listen_port = listen_port
+        super().__init__(username, listen_port, history_dir)
         self.tracker_host = tracker_host
         self.tracker_port = tracker_port
-        self.peers = {}  # Cache peers: {username: (ip, port)}
-        self.messages = []  # Lưu lịch sử tin nhắn local
-        self.running = True
+        # Một kết nối framed dùng chung, hoặc router tới node sở hữu username ở chế độ cluster
+        self.tracker = connect_tracker(tracker_nodes or f"{tracker_host}:{tracker_port}")
+        self.directory = PeerDirectory(self.tracker)  # Bản sao registry, đồng bộ theo delta
+        self.download_dir = download_dir
+        self.max_file_size = max_file_size
         self.listener_thread = None
-        self.lock = threading.Lock()  # Thread-safe cho shared data
+        self.heartbeat_thread = None
+        self.subscription = None  # Kết nối nhận sự kiện join/leave từ tracker
+        self.streams = StreamPool()  # Kết nối P2P framed dùng lại cho mỗi peer đích
+        self.fanout = None  # Thread pool gửi outbox/gossip ở nền (tạo khi cần); broadcast có pool riêng
         
+    def _run(self, steps):
+        return run_steps(steps, self._perform)
+
+    def _perform(self, op, *args):
+        return getattr(self, '_op_' + op)(*args)
+
+    def _op_call(self, command):
+        return self.tracker.call(command)
+
+    def _op_call_many(self, commands):
+        return self.tracker.call_many(commands)
+
+    def _op_send(self, addr, line, timeout):
+        return self.streams.send(addr, line, timeout)
+
+    def _op_wait(self, future, timeout):
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            raise TimeoutError("no ACK in time") from None
+
+    def _op_send_all(self, *args):
+        return self._send_all(*args)
+
+    def _op_refresh_peers(self):
+        # Đã subscribe thì danh sách được tracker cập nhật sẵn
+        if self.subscription is None:
+            self.load_peers()
+
     def register(self):
         """
         Đăng ký với tracker (tương ứng fetch('/register')).
-        Gửi lệnh REGISTER qua socket TCP.
+        Gửi lệnh REGISTER qua kết nối tracker dùng chung.
         """
         self.load_peers()
         for peer_username, (_, peer_port) in self.peers.items():
@@ -48,142 +490,309 @@ class Peer:
             print("peer res:  NAK:Port is unavailable. Please choose a different Port.")
         else:
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((self.tracker_host, self.tracker_port))
-                local_ip = socket.gethostbyname(socket.gethostname())
-                msg = f"REGISTER:{self.username}:{local_ip}:{self.listen_port}"
-                sock.send(msg.encode('utf-8'))
-                response = sock.recv(1024).decode('utf-8').strip()
+                response = self._send_register()
                 print("peer res:  " + response)
-                sock.close()
                 if response.startswith('ACK'):
                     print(f"[Peer {self.username}] Đăng ký thành công: {response}")
                     return True
                 else:
                     print(f"[Peer {self.username}] Đăng ký thất bại: {response}")
-            except socket.error as e:
+            except (socket.error, ProtocolError) as e:
                 print(f"[Peer {self.username}] Lỗi kết nối tracker: {e}")
         return False
-    
+
+    def _send_register(self):
+        return self.tracker.call(self._register_command())
+
+    def start_heartbeat(self, interval=10.0):
+        """
+        Gửi HEARTBEAT định kỳ để tracker không loại peer khi hết TTL.
+        Nếu tracker trả NAK:Peer not found (peer đã bị loại), tự động REGISTER lại;
+        NAK:Rate limited/NAK:Busy thì chỉ bỏ qua lần heartbeat này.
+        Mỗi nhịp heartbeat cũng gửi lại các tin trong outbox đã tới lượt thử lại.
+        :param interval: Chu kỳ heartbeat (giây), nên nhỏ hơn TTL của tracker.
+        """
+        def loop():
+            while self.running:
+                time.sleep(interval)
+                if not self.running:
+                    break
+                for target_username in self._run(self._heartbeat_steps()):
+                    self._fanout_pool().submit(self._flush_outbox, target_username)
+
+        self.heartbeat_thread = threading.Thread(target=loop, daemon=True)
+        self.heartbeat_thread.start()
+
+    def start_subscription(self):
+        """
+        Đăng ký nhận sự kiện join/leave do tracker đẩy về (SUBSCRIBE), để danh sách
+        peers luôn mới mà không cần polling. Chỉ hỗ trợ một tracker; ở chế độ cluster
+        (hoặc khi lỗi) vẫn dùng load_peers như cũ.
+        """
+        if not isinstance(self.tracker, TrackerClient):
+            return False
+
+        def on_events(events):
+            peers = self.directory.apply_events(events)
+            with self.lock:
+                self.peers = peers
+            # Cập nhật cache địa chỉ theo sự kiện; peer vừa online lại (join/update) thì
+            # gửi ngay các tin đang chờ cho peer đó
+            for op, _, username, addr in events:
+                if op in ('J', 'U') and username:
+                    self.addresses.put(username, addr)
+                    self._wake_outbox(username)
+                elif op == 'L' and username:
+                    self.addresses.put(username, None)
+
+        def on_close():
+            print(f"[Peer {self.username}] Mất kết nối subscription, quay lại polling.")
+            self.subscription = None
+
+        try:
+            self.load_peers()
+            subscription = TrackerSubscription(self.tracker_host, self.tracker_port,
+                                               self.directory.version, on_events, on_close)
+            subscription.start()
+        except (socket.error, ValueError) as e:
+            print(f"[Peer {self.username}] Không subscribe được, dùng polling: {e}")
+            return False
+        self.subscription = subscription
+        print(f"[Peer {self.username}] Nhận thay đổi peers trực tiếp từ tracker.")
+        return True
+
     def load_peers(self):
         """
         Tải danh sách peers từ tracker (tương ứng fetch('/peers')).
-        Giả lập qua socket LOOKUP * (hoặc endpoint HTTP trong backend).
+        Lần đầu tải theo trang (LOOKUP_PAGE), các lần sau chỉ lấy thay đổi (LOOKUP_SINCE).
         """
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.tracker_host, self.tracker_port))
-            msg = "LOOKUP:*"  # Lệnh lookup tất cả peers
-            sock.send(msg.encode('utf-8'))
-            response = sock.recv(2048).decode('utf-8').strip()  # Response có thể là JSON
-            sock.close()
-            if response.startswith('PEERS:'):
-                # Giả lập parse JSON từ response (backend trả {'peers': [{'ip': 'x.x.x.x', 'port': 8001}]})
-                peers_data = json.loads(response[6:])  # Bỏ prefix 'PEERS:'
-                with self.lock:
-                    self.peers = {p['username']: (p['ip'], p['port']) for p in peers_data['peers']}
-                print(f"[Peer {self.username}] Đã tải {len(self.peers)} peers.")
-                return list(self.peers.values())
-            else:
-                print(f"[Peer {self.username}] Không tải được peers: {response}")
-        except (socket.error, json.JSONDecodeError) as e:
+            peers = self.directory.sync()
+            with self.lock:
+                self.peers = peers
+            self.addresses.update(peers)
+            print(f"[Peer {self.username}] Đã tải {len(self.peers)} peers.")
+            return list(self.peers.values())
+        except (socket.error, ValueError) as e:
             print(f"[Peer {self.username}] Lỗi tải: {e}")
         return []
     
-    def send_message(self, target_username, msg):
-    # Lookup target address
-        if target_username in self.peers:
-            ip, port = self.peers[target_username]
-            addr = (ip, port)
-            #print(f"[Peer {self.username}] Sử dụng cache cho {target_username} tại {addr}")
-        else:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((self.tracker_host, self.tracker_port))
-                lookup_cmd = f"LOOKUP:{target_username}"
-                sock.send(lookup_cmd.encode('utf-8'))
-                response = sock.recv(2048).decode('utf-8').strip()
-                sock.close()
-                if response.startswith('FOUND:'):
-                    parts = response[6:].split(':')
-                    if len(parts) == 2:
-                        ip, port_str = parts
-                        port = int(port_str)
-                        addr = (ip, port)  # Fixed: Use tuple (ip, port) for connect
-                        with self.lock:
-                            self.peers[target_username] = addr
-                        print(f"[Peer {self.username}] Tìm thấy {target_username} tại {addr}")
-                    else:
-                        print(f"[Peer {self.username}] Invalid response format: {response}")
-                        return False
-                else:
-                    print(f"[Peer {self.username}] Không tìm thấy peer: {response}")
-                    return False
-            except (socket.error, ValueError) as e:
-                print(f"[Peer {self.username}] Lỗi tìm kiếm: {e}")
-                return False
+    def search_peers(self, prefix, limit=20, cursor='', substring=False):
+        """
+        Tìm peers theo tiền tố username (SEARCH), không cần tải toàn bộ registry.
+        :param substring: True để tìm username chứa chuỗi ở bất kỳ vị trí nào (SEARCH_ANY).
+        :return: (danh sách {username, ip, port}, cursor trang sau hoặc None).
+        """
+        return self._run(self._search_steps(prefix, limit, cursor, substring))
 
-            # Send P2P message
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect(addr)
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            message_data = {
-                'time': timestamp,
-                'sender': self.username,
-                'msg': msg
-            }
-            full_msg = f"MESSAGE:{json.dumps(message_data)}"
-            sock.send(full_msg.encode('utf-8'))
-            ack = sock.recv(1024).decode('utf-8').strip()
-            sock.close()
-            if ack.startswith('ACK'):
-                with self.lock:
-                    self.messages.append(message_data)
-                print(f"[Peer {self.username}] Đã gửi tới {target_username}: {msg}")
-                return True
-            else:
-                print(f"[Peer {self.username}] Gửi thất bại: {ack}")
-        except socket.error as e:
-            print(f"[Peer {self.username}] Lỗi gửi: {e}")
-        return False
+    def _resolve(self, target_username):
+        """
+        Địa chỉ (ip, port) của peer: từ cache địa chỉ, nếu hết hạn/chưa có thì LOOKUP tracker.
+        None nếu không tìm thấy (kết quả này cũng được cache trong thời gian ngắn).
+        """
+        return self._run(self._resolve_steps(target_username))
+
+    def prefetch(self, usernames):
+        """
+        Tải trước địa chỉ các peers chưa có trong cache bằng một lô LOOKUP gửi cùng lúc,
+        để vòng gửi tin sau đó không phải chờ tracker cho từng peer.
+        :return: Số peers đã hỏi tracker.
+        """
+        return self._run(self._prefetch_steps(usernames))
 
-    def broadcast_message(self, msg):
+    def send_message(self, target_username, msg, timeout=None, channel=None, queue=True):
         """
-        Broadcast tin nhắn đến tất cả peers (sử dụng load_peers để refresh danh sách).
+        Gửi tin nhắn tới một peer.
+        :param timeout: Thời gian tối đa (giây) chờ ACK, mặc định theo StreamPool.
+        :param channel: Kênh của tin nhắn (tin kênh được lưu một lần bởi channel_message).
+        :param queue: Không gửi được (peer offline, không tìm thấy) thì xếp vào outbox để gửi lại sau.
         """
-        self.load_peers()  # Refresh peer list
-        success_count = 0
-        for target_username, (ip, port) in self.peers.items():
-            if target_username != self.username:  # Avoid self-send
-                if self.send_message(target_username, msg):
-                    success_count += 1
-        print(f"[Peer {self.username}] Truyền tới {success_count}/{len(self.peers)-1} peers: {msg}")
-        return success_count > 0
+        return self._run(self._send_message_steps(target_username, msg, timeout, channel, queue))
+
+    def _wake_outbox(self, target_username):
+        """Peer đích đã online lại: gửi các tin đang chờ ngay, không đợi hết backoff."""
+        if self.outbox.wake(target_username):
+            self._fanout_pool().submit(self._flush_outbox, target_username)
+
+    def _flush_outbox(self, target_username):
+        return self._run(self._flush_outbox_steps(target_username))
+
+    def broadcast_message(self, msg, target_timeout=3.0, deadline=5.0, max_workers=32):
+        """
+        Broadcast tin nhắn đến tất cả peers (sử dụng load_peers để refresh danh sách,
+        trừ khi đã subscribe: khi đó danh sách được tracker cập nhật sẵn).
+        Các peer được gửi song song qua một thread pool giới hạn, nên thời gian broadcast
+        xấp xỉ peer chậm nhất thay vì tổng thời gian của mọi peer.
+        :param target_timeout: Thời gian tối đa (giây) cho mỗi peer đích.
+        :param deadline: Thời gian tối đa (giây) cho cả lần broadcast.
+        :param max_workers: Số lần gửi đồng thời tối đa.
+        :return: {username: 'delivered' | 'failed' | 'timeout'}.
+        """
+        return self._run(self._broadcast_steps(msg, target_timeout, deadline, max_workers))
+
+    def _send_all(self, targets, msg, target_timeout, deadline, max_workers, channel=None):
+        """
+        Gửi msg song song tới targets, trả {username: 'delivered' | 'failed' | 'timeout'}.
+        Mỗi lần gửi dùng một pool riêng (max_workers threads), nên broadcast lớn không làm
+        chậm outbox/gossip; hết deadline thì các lần gửi chưa bắt đầu bị huỷ.
+        """
+        if not targets:
+            return {}
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(targets)), thread_name_prefix='broadcast')
+        futures = {pool.submit(self.send_message, u, msg, target_timeout, channel): u for u in targets}
+        done, _ = wait(futures, timeout=deadline)
+        # Huỷ các lần gửi còn trong hàng đợi; lần đang chạy bị giới hạn bởi target_timeout
+        pool.shutdown(wait=False, cancel_futures=True)
+        results = {}
+        for future, target_username in futures.items():
+            if future not in done:
+                results[target_username] = 'timeout'
+            elif future.exception() is None and future.result():
+                results[target_username] = 'delivered'
+            else:
+                results[target_username] = 'failed'
+        return results
     
+    def _fanout_pool(self):
+        if self.fanout is None:
+            self.fanout = ThreadPoolExecutor(max_workers=32, thread_name_prefix='fanout')
+        return self.fanout
+
+    def _gossip_send(self, message, exclude):
+        """Gửi message gossip tới fanout peers ngẫu nhiên (không chờ ACK ở thread gọi)."""
+        line, peers, targets = self._gossip_targets(message, exclude)
+
+        def report(target_username, future):
+            if future.exception() is not None:
+                print(f"[Peer {self.username}] Gossip tới {target_username} lỗi: {future.exception()}")
+
+        def send(target_username):
+            # Kết nối (nếu cần) trong thread pool, không chặn thread listener
+            try:
+                future = self.streams.send(peers[target_username], line)
+                future.add_done_callback(lambda f: report(target_username, f))
+            except socket.error as e:
+                print(f"[Peer {self.username}] Gossip tới {target_username} lỗi: {e}")
+
+        for target_username in targets:
+            self._fanout_pool().submit(send, target_username)
+        return targets
+
+    def gossip_message(self, msg):
+        """
+        Broadcast kiểu gossip cho mạng nhiều peers (xem p2p/gossip.py): chỉ gửi tới
+        fanout peers ngẫu nhiên, mỗi peer nhận lần đầu sẽ chuyển tiếp tiếp cho fanout peers
+        khác tới khi hết TTL. Người gửi chỉ upload fanout bản thay vì N bản.
+        :return: Danh sách peers nhận trực tiếp từ peer này.
+        """
+        return self._run(self._gossip_steps(msg))
+
+    def join_channel(self, channel):
+        """Tham gia kênh: tracker ghi nhận thành viên (JOIN) để người gửi chỉ gửi tới thành viên."""
+        return self._run(self._join_steps(channel))
+
+    def part_channel(self, channel):
+        """Rời kênh (PART); lịch sử kênh vẫn được giữ."""
+        return self._run(self._part_steps(channel))
+
+    def channel_members(self, channel, page_size=1000):
+        """Danh sách username thành viên của kênh, tải theo trang (MEMBERS)."""
+        return self._run(self._members_steps(channel, page_size))
+
+    def channel_message(self, channel, msg, target_timeout=3.0, deadline=5.0, max_workers=32):
+        """
+        Gửi tin vào kênh: chỉ gửi song song tới các thành viên của kênh thay vì mọi peer
+        đã đăng ký, nên chi phí mỗi tin tỉ lệ với số thành viên.
+        :return: {username: 'delivered' | 'failed' | 'timeout'}.
+        """
+        return self._run(self._channel_message_steps(channel, msg, target_timeout, deadline, max_workers))
+
+    def channel_history(self, channel, before=None, limit=20):
+        """
+        Một trang lịch sử kênh, từ mới về cũ theo cursor (seq).
+        :return: (tin nhắn theo thứ tự thời gian, cursor trang cũ hơn hoặc None).
+        """
+        return self._channel_store(channel).page(before, limit)
+
+    def send_file(self, target_username, path, chunk_size=1 << 20):
+        """
+        Gửi file tới một peer theo từng chunk (socket.sendfile, không đọc cả file vào RAM).
+        Mất kết nối giữa chừng thì tự kết nối lại và gửi tiếp từ chunk cuối đã được kiểm tra.
+        :return: Thống kê lần gửi (xem p2p.filexfer.send_file), None nếu thất bại.
+        """
+        addr = self._resolve(target_username)
+        if addr is None:
+            return None
+        try:
+            result = send_file(addr, path, self.username, chunk_size)
+        except TransferRejected as e:
+            print(f"[Peer {self.username}] {target_username} từ chối file: {e}")
+            return None
+        except OSError as e:
+            self.addresses.invalidate(target_username)
+            print(f"[Peer {self.username}] Lỗi gửi file tới {target_username}: {e}")
+            return None
+        speed = result['sent'] / max(result['seconds'], 1e-9) / (1 << 20)
+        print(f"[Peer {self.username}] Đã gửi {result['name']} ({result['size']} bytes) tới {target_username} "
+              f"trong {result['seconds']:.2f}s ({speed:.1f} MB/s, tiếp tục từ byte {result['resumed_from']})")
+        return result
+
+    def _receive_file(self, conn, data):
+        """Nhận một file được gửi tới (connection bắt đầu bằng FILE:...) vào download_dir."""
+        # Header của file có thể dài hơn một lần recv: đọc đủ dòng đầu
+        while b'\n' not in data:
+            if len(data) > MAX_FILE_HEADER:
+                conn.sendall(b'NAK:Invalid offer\n')
+                return
+            more = conn.recv(65536)
+            if not more:
+                return
+            data += more
+        header = data.split(b'\n', 1)[0]
+        result = receive_file(conn, header.decode('utf-8', 'replace'), self.download_dir, self.max_file_size)
+        if result is None:
+            print(f"[Peer {self.username}] Không nhận trọn file (bị từ chối hoặc gián đoạn; người gửi thử lại sẽ tiếp tục).")
+            return
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            self.messages.append({'time': timestamp, 'sender': result['sender'],
+                                  'msg': f"[file] {result['name']} ({result['size']} bytes)"})
+        print(f"[Peer {self.username}] Nhận file {result['name']} từ {result['sender']}: {result['path']}")
+
     def load_messages(self):
         """
         Tải tin nhắn (tương ứng fetch('/messages')).
         Polling từ tracker hoặc local cache; ở đây dùng local để demo.
+        Trả về các tin gần nhất còn trong bộ nhớ; tin cũ hơn dùng messages.query().
         """
-        return self.messages
+        return self.messages.recent()
     
     def start_listener(self):
         """
         Khởi động socket server để nhận P2P messages (multi-peer concurrency).
-        Sử dụng threading để xử lý mỗi connection riêng biệt.
+        Sử dụng threading để xử lý mỗi connection riêng biệt. Connection framed (byte đầu
+        0x00, xem p2p/peerwire.py) mang nhiều tin mỗi frame và được ACK theo cửa sổ;
+        connection dạng dòng (p2p/connpool.py) và peer cũ gửi một tin không có xuống dòng
+        vẫn được hỗ trợ. Connection bắt đầu bằng FILE: là một lần gửi file (p2p/filexfer.py).
         """
         def handle_connection(conn, addr):
+            # Đóng connection bị bỏ quên, để không giữ thread mãi mãi
+            conn.settimeout(self.streams.idle_timeout * 2)
             try:
-                data = conn.recv(2048).decode('utf-8').strip()
-                if data.startswith('MESSAGE:'):
-                    msg_data = json.loads(data[8:])  # Parse JSON message
-                    with self.lock:
-                        self.messages.append(msg_data)
-                    print(f"[Peer {self.username}] Nhận từ {msg_data['sender']}: {msg_data['msg']}")
-                    conn.send(b'ACK:Message received')
-                else:
-                    conn.send(b'NAK:Invalid message')
+                data = conn.recv(65536)
+                if data.startswith(b'FILE:'):
+                    self._receive_file(conn, data)
+                    return
+                session = open_session(data, self._handle_line)
+                while data and self.running:
+                    reply, keep_open = session.feed(data)
+                    if reply:
+                        conn.sendall(reply)
+                    if not keep_open:
+                        break
+                    data = conn.recv(65536)
+            except socket.timeout:
+                pass
             except Exception as e:
                 print(f"[Peer {self.username}] Lỗi xử lý connection: {e}")
             finally:
@@ -215,7 +824,9 @@ class Peer:
         if not reg_flag:
             return
         self.start_listener()
-        print(f"[Peer {self.username}] Sẵn sàng. Lệnh: register | load_peers |broadcast <msg>| send <target> <msg> | messages | quit")
+        self.start_heartbeat()
+        self.start_subscription()
+        print(f"[Peer {self.username}] Sẵn sàng. Lệnh: register | load_peers | search <prefix> | find <chuỗi> |broadcast <msg>| gossip <msg> | send <target> <msg> | messages | history <sender|*> [phút] | join <kênh> | part <kênh> | say <kênh> <msg> | channel <kênh> [cursor] | outbox | cache | sendfile <target> <path> | quit")
         while self.running:
             try:
                 cmd = input("> ").strip().split()
@@ -226,9 +837,18 @@ class Peer:
                 elif cmd[0] == 'load_peers':
                     self.load_peers()
                     print("Peers:", self.peers)
+                elif cmd[0] in ('search', 'find') and len(cmd) == 2:
+                    peers, _ = self.search_peers(cmd[1], substring=cmd[0] == 'find')
+                    for p in peers:
+                        print(f"  {p['username']} {p['ip']}:{p['port']}")
                 elif cmd[0] == 'broadcast':
                     msg = ' '.join(cmd[1:])
-                    self.broadcast_message(msg)
+                    results = self.broadcast_message(msg)
+                    failed = [u for u, r in results.items() if r != 'delivered']
+                    if failed:
+                        print(f"Không gửi được tới: {', '.join(failed)}")
+                elif cmd[0] == 'gossip':
+                    self.gossip_message(' '.join(cmd[1:]))
                 elif cmd[0] == 'send' and len(cmd) >= 3:
                     target = cmd[1]
                     msg = ' '.join(cmd[2:])
@@ -237,8 +857,51 @@ class Peer:
                     msgs = self.load_messages()
                     for m in msgs[-5:]:  # Hiển thị 5 tin nhắn gần nhất
                         print(f"[{m['time']}] {m['sender']}: {m['msg']}")
+                elif cmd[0] == 'history' and len(cmd) >= 2:
+                    # history <sender|*> [phút]: tin nhắn trong N phút gần nhất (mặc định 60)
+                    try:
+                        minutes = float(cmd[2]) if len(cmd) > 2 else 60
+                    except ValueError:
+                        print("Số phút không hợp lệ.")
+                        continue
+                    sender = None if cmd[1] == '*' else cmd[1]
+                    for m in self.messages.query(start=time.time() - minutes * 60, sender=sender, limit=20):
+                        print(f"[{m['time']}] {m['sender']}: {m['msg']}")
+                elif cmd[0] == 'join' and len(cmd) == 2:
+                    self.join_channel(cmd[1])
+                elif cmd[0] == 'part' and len(cmd) == 2:
+                    self.part_channel(cmd[1])
+                elif cmd[0] == 'say' and len(cmd) >= 3:
+                    self.channel_message(cmd[1], ' '.join(cmd[2:]))
+                elif cmd[0] == 'channel' and len(cmd) in (2, 3) and valid_channel(cmd[1]):
+                    # channel <kênh> [cursor]: 20 tin trước cursor (mặc định: mới nhất)
+                    try:
+                        before = int(cmd[2]) if len(cmd) == 3 else None
+                    except ValueError:
+                        print("Cursor không hợp lệ.")
+                        continue
+                    msgs, cursor = self.channel_history(cmd[1], before)
+                    for m in msgs:
+                        print(f"[{m['time']}] {m['sender']}: {m['msg']}")
+                    if cursor is not None:
+                        print(f"(tin cũ hơn: channel {cmd[1]} {cursor})")
+                elif cmd[0] == 'outbox':
+                    print(f"Outbox: {self.outbox.pending()} tin chờ, {self.outbox.stats}")
+                elif cmd[0] == 'cache':
+                    print(f"Cache địa chỉ: {len(self.addresses)} mục, {self.addresses.stats}")
+                elif cmd[0] == 'sendfile' and len(cmd) >= 3:
+                    path = ' '.join(cmd[2:])
+                    if os.path.isfile(path):
+                        self.send_file(cmd[1], path)
+                    else:
+                        print(f"Không tìm thấy file: {path}")
                 elif cmd[0] == 'quit':
                     self.running = False
+                    self.streams.close()
+                    self.messages.close()
+                    self.outbox.close()
+                    for store in self.channels.values():
+                        store.close()
                     break
                 else:
                     print("Lệnh không hợp lệ.")
@@ -247,18 +910,366 @@ class Peer:
                 break
         print(f"[Peer {self.username}] Đang thoát.")
 
+
+class AsyncPeer(PeerCore):
+    """
+    Phiên bản asyncio của Peer: listener, gửi tin, gọi tracker và CLI cùng chạy trên một
+    event loop, không tạo thread cho mỗi connection. Các phương thức giữ tên và tham số
+    của Peer nhưng là coroutine (await peer.send_message(...)), nên một process có thể
+    chạy hàng nghìn peers để thử nghiệm ở quy mô lớn (xem bench/async_peers.py).
+    Chỉ hỗ trợ một tracker (không cluster); danh sách peers tải bằng LOOKUP:*.
+    Logic tin nhắn/kênh/outbox dùng chung với Peer (PeerCore); lớp này thực hiện I/O bằng await.
+    """
+
+    def __init__(self, username, listen_port, tracker_host='localhost', tracker_port=9000, history_dir=None,
+                 max_connections=256, ip=None):
+        """
+        :param max_connections: Số connection đến được xử lý đồng thời; khi đủ, listener ngừng
+                                accept và connection mới chờ trong backlog của kernel
+                                (backpressure qua TCP) thay vì tạo thêm coroutine.
+        :param ip: Địa chỉ đăng ký với tracker (mặc định: địa chỉ của hostname).
+        Các tham số còn lại như Peer.
+        """
+        super().__init__(username, listen_port, history_dir, ip)
+        self.tracker_host = tracker_host
+        self.tracker_port = tracker_port
+        self.tracker = AsyncTrackerClient(tracker_host, tracker_port)
+        self.streams = AsyncStreamPool()
+        self.max_connections = max_connections
+        self.slots = None  # Semaphore giới hạn connection đến, tạo trong start_listener
+        self.server = None  # Socket lắng nghe
+        self.incoming = set()  # Writer của các connection đến đang mở
+        self.tasks = set()  # Coroutine nền (accept, heartbeat, gossip, gửi lại outbox)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def _run(self, steps):
+        return await run_steps_async(steps, self._perform)
+
+    async def _perform(self, op, *args):
+        return await getattr(self, '_op_' + op)(*args)
+
+    async def _op_call(self, command):
+        return await self.tracker.call(command)
+
+    async def _op_call_many(self, commands):
+        return await self.tracker.call_many(commands)
+
+    async def _op_send(self, addr, line, timeout):
+        return await self.streams.send(addr, line, timeout)
+
+    async def _op_wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("no ACK in time") from None
+
+    async def _op_send_all(self, *args):
+        return await self._send_all(*args)
+
+    async def _op_refresh_peers(self):
+        await self.load_peers()
+
+    async def register(self):
+        """Đăng ký với tracker, cùng các kiểm tra như Peer.register."""
+        await self.load_peers()
+        for peer_username, (_, peer_port) in self.peers.items():
+            if self.listen_port == peer_port:
+                print("peer res:  NAK:Port is unavailable. Please choose a different Port.")
+                return False
+            if self.username == peer_username:
+                print("peer res: NAK:Name is taken. Please choose a different Name.")
+                return False
+        try:
+            response = await self._send_register()
+        except (OSError, ProtocolError) as e:
+            print(f"[Peer {self.username}] Lỗi kết nối tracker: {e}")
+            return False
+        if response.startswith('ACK'):
+            print(f"[Peer {self.username}] Đăng ký thành công: {response}")
+            return True
+        print(f"[Peer {self.username}] Đăng ký thất bại: {response}")
+        return False
+
+    async def _send_register(self):
+        return await self.tracker.call(self._register_command())
+
+    def start_heartbeat(self, interval=10.0):
+        """HEARTBEAT định kỳ như Peer.start_heartbeat, kèm gửi lại outbox và đóng stream rảnh."""
+        async def loop():
+            while self.running:
+                await asyncio.sleep(interval)
+                for target_username in await self._run(self._heartbeat_steps()):
+                    self._spawn(self._flush_outbox(target_username))
+                self.streams.evict_idle()
+
+        return self._spawn(loop())
+
+    async def load_peers(self):
+        """Tải danh sách peers (LOOKUP:*)."""
+        try:
+            response = await self.tracker.call("LOOKUP:*")
+            if not response.startswith('PEERS:'):
+                raise ValueError(f"unexpected tracker response: {response[:80]}")
+            peers = {p['username']: (p['ip'], p['port']) for p in json.loads(response[6:])['peers']}
+            with self.lock:
+                self.peers = peers
+            self.addresses.update(peers)
+            return list(peers.values())
+        except (OSError, ValueError) as e:
+            print(f"[Peer {self.username}] Lỗi tải: {e}")
+        return []
+
+    async def search_peers(self, prefix, limit=20, cursor='', substring=False):
+        """Tìm peers theo tiền tố hoặc chuỗi con (xem Peer.search_peers)."""
+        return await self._run(self._search_steps(prefix, limit, cursor, substring))
+
+    async def prefetch(self, usernames):
+        """Tải trước địa chỉ các peers chưa có trong cache (xem Peer.prefetch)."""
+        return await self._run(self._prefetch_steps(usernames))
+
+    async def send_message(self, target_username, msg, timeout=None, channel=None, queue=True):
+        """Gửi tin nhắn tới một peer (xem Peer.send_message)."""
+        return await self._run(self._send_message_steps(target_username, msg, timeout, channel, queue))
+
+    def _wake_outbox(self, target_username):
+        if self.outbox.wake(target_username):
+            self._spawn(self._flush_outbox(target_username))
+
+    async def _flush_outbox(self, target_username):
+        return await self._run(self._flush_outbox_steps(target_username))
+
+    async def _send_all(self, targets, msg, target_timeout, deadline, max_workers, channel=None):
+        """Gửi song song tới targets (tối đa max_workers cùng lúc), như Peer._send_all."""
+        limit = asyncio.Semaphore(max_workers)
+        started = set()
+
+        async def one(target_username):
+            async with limit:
+                started.add(target_username)
+                return await self.send_message(target_username, msg, target_timeout, channel)
+
+        tasks = {self._spawn(one(u)): u for u in targets}
+        if not tasks:
+            return {}
+        done, _ = await asyncio.wait(tasks, timeout=deadline)
+        results = {}
+        for task, target_username in tasks.items():
+            if task not in done:
+                # Chưa bắt đầu gửi thì huỷ; đang gửi thì bị giới hạn bởi target_timeout
+                if target_username not in started:
+                    task.cancel()
+                results[target_username] = 'timeout'
+            elif task.exception() is None and task.result():
+                results[target_username] = 'delivered'
+            else:
+                results[target_username] = 'failed'
+        return results
+
+    async def broadcast_message(self, msg, target_timeout=3.0, deadline=5.0, max_workers=32):
+        """Broadcast tới mọi peer (xem Peer.broadcast_message)."""
+        return await self._run(self._broadcast_steps(msg, target_timeout, deadline, max_workers))
+
+    def _gossip_send(self, message, exclude):
+        line, peers, targets = self._gossip_targets(message, exclude)
+
+        async def send(target_username):
+            try:
+                await (await self.streams.send(peers[target_username], line))
+            except OSError as e:
+                print(f"[Peer {self.username}] Gossip tới {target_username} lỗi: {e}")
+
+        for target_username in targets:
+            self._spawn(send(target_username))
+        return targets
+
+    async def gossip_message(self, msg):
+        """Broadcast kiểu gossip (xem Peer.gossip_message)."""
+        return await self._run(self._gossip_steps(msg))
+
+    async def join_channel(self, channel):
+        return await self._run(self._join_steps(channel))
+
+    async def part_channel(self, channel):
+        return await self._run(self._part_steps(channel))
+
+    async def channel_members(self, channel, page_size=1000):
+        return await self._run(self._members_steps(channel, page_size))
+
+    async def channel_message(self, channel, msg, target_timeout=3.0, deadline=5.0, max_workers=32):
+        """Gửi tin vào kênh, chỉ tới các thành viên (xem Peer.channel_message)."""
+        return await self._run(self._channel_message_steps(channel, msg, target_timeout, deadline, max_workers))
+
+    async def channel_history(self, channel, before=None, limit=20):
+        return self._channel_store(channel).page(before, limit)
+
+    async def load_messages(self):
+        return self.messages.recent()
+
+    async def start_listener(self):
+        """Nhận P2P messages trên event loop (framed và dạng dòng, như Peer.start_listener)."""
+        self.slots = asyncio.Semaphore(self.max_connections)
+        self.server = socket.create_server(('', self.listen_port), backlog=self.max_connections)
+        self.server.setblocking(False)
+        self._spawn(self._accept_loop())
+        print(f"[Peer {self.username}] Lắng nghe P2P trên port {self.listen_port} (asyncio)")
+
+    async def _accept_loop(self):
+        loop = asyncio.get_running_loop()
+        while self.running:
+            # Chỉ accept khi còn slot: connection vượt quá chờ trong backlog của kernel
+            await self.slots.acquire()
+            try:
+                conn, _ = await loop.sock_accept(self.server)
+            except OSError as e:
+                self.slots.release()
+                if self.running:
+                    print(f"[Peer {self.username}] Lỗi accept: {e}")
+                continue
+            self._spawn(self._serve(conn))
+
+    async def _serve(self, conn):
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(sock=conn)
+            self.incoming.add(writer)
+            idle = self.streams.idle_timeout * 2
+            data = await asyncio.wait_for(reader.read(65536), idle)
+            session = open_session(data, self._handle_line)
+            while data and self.running:
+                reply, keep_open = session.feed(data)
+                if reply:
+                    writer.write(reply)
+                    await writer.drain()
+                if not keep_open:
+                    break
+                data = await asyncio.wait_for(reader.read(65536), idle)
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            print(f"[Peer {self.username}] Lỗi xử lý connection: {e}")
+        finally:
+            if writer is not None:
+                self.incoming.discard(writer)
+                writer.close()
+            else:
+                conn.close()
+            self.slots.release()
+
+    async def run_cli(self):
+        """CLI như Peer.run_cli, đọc stdin trên cùng event loop."""
+        loop = asyncio.get_running_loop()
+        stdin = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(stdin), sys.stdin)
+        print(f"[Peer {self.username}] Sẵn sàng (asyncio). Lệnh: load_peers | search <prefix> | find <chuỗi> | broadcast <msg> | gossip <msg> | send <target> <msg> | messages | join <kênh> | part <kênh> | say <kênh> <msg> | channel <kênh> [cursor] | outbox | cache | quit")
+        while self.running:
+            print("> ", end='', flush=True)
+            line = await stdin.readline()
+            if not line:
+                break
+            cmd = line.decode('utf-8', 'replace').strip().split()
+            if not cmd:
+                continue
+            if cmd[0] == 'load_peers':
+                await self.load_peers()
+                print("Peers:", self.peers)
+            elif cmd[0] in ('search', 'find') and len(cmd) == 2:
+                peers, _ = await self.search_peers(cmd[1], substring=cmd[0] == 'find')
+                for p in peers:
+                    print(f"  {p['username']} {p['ip']}:{p['port']}")
+            elif cmd[0] == 'broadcast':
+                await self.broadcast_message(' '.join(cmd[1:]))
+            elif cmd[0] == 'gossip':
+                await self.gossip_message(' '.join(cmd[1:]))
+            elif cmd[0] == 'send' and len(cmd) >= 3:
+                await self.send_message(cmd[1], ' '.join(cmd[2:]))
+            elif cmd[0] == 'messages':
+                for m in (await self.load_messages())[-5:]:
+                    print(f"[{m['time']}] {m['sender']}: {m['msg']}")
+            elif cmd[0] == 'join' and len(cmd) == 2:
+                await self.join_channel(cmd[1])
+            elif cmd[0] == 'part' and len(cmd) == 2:
+                await self.part_channel(cmd[1])
+            elif cmd[0] == 'say' and len(cmd) >= 3:
+                await self.channel_message(cmd[1], ' '.join(cmd[2:]))
+            elif cmd[0] == 'channel' and len(cmd) in (2, 3) and valid_channel(cmd[1]):
+                if len(cmd) == 3 and not cmd[2].isdigit():
+                    print("Cursor không hợp lệ.")
+                    continue
+                msgs, cursor = await self.channel_history(cmd[1], int(cmd[2]) if len(cmd) == 3 else None)
+                for m in msgs:
+                    print(f"[{m['time']}] {m['sender']}: {m['msg']}")
+                if cursor is not None:
+                    print(f"(tin cũ hơn: channel {cmd[1]} {cursor})")
+            elif cmd[0] == 'outbox':
+                print(f"Outbox: {self.outbox.pending()} tin chờ, {self.outbox.stats}")
+            elif cmd[0] == 'cache':
+                print(f"Cache địa chỉ: {len(self.addresses)} mục, {self.addresses.stats}")
+            elif cmd[0] == 'quit':
+                break
+            else:
+                print("Lệnh không hợp lệ.")
+        print(f"[Peer {self.username}] Đang thoát.")
+
+    async def close(self):
+        self.running = False
+        for writer in list(self.incoming):
+            writer.close()
+        for task in list(self.tasks):
+            task.cancel()  # Kể cả vòng accept và các coroutine _serve
+        self.streams.close()
+        self.tracker.close()
+        await asyncio.sleep(0)
+        if self.server is not None:
+            self.server.close()
+        self._close_stores()
+
+
+async def run_async_peer(args):
+    """Chạy peer trên một event loop (--engine async)."""
+    peer = AsyncPeer(args.username, args.port, args.tracker_host, args.tracker_port, args.history_dir)
+    try:
+        await peer.start_listener()
+        if await peer.register():
+            peer.start_heartbeat()
+            await peer.run_cli()
+        else:
+            print("Lỗi đăng ký, không thể test.")
+    finally:
+        await peer.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Test Peer Client")
     parser.add_argument('--username', type=str, required=True, help="Tên peer (e.g., Alice)")
     parser.add_argument('--port', type=int, required=True, help="Port lắng nghe P2P (e.g., 8001)")
     parser.add_argument('--tracker-host', type=str, default='localhost', help="Host tracker (default: localhost)")
     parser.add_argument('--tracker-port', type=int, default=9000, help="Port tracker (default: 9000)")
+    parser.add_argument('--tracker-nodes', type=str, default=None,
+                        help="Cluster tracker 'host:port,host:port,...' (thay cho --tracker-host/--tracker-port)")
+    parser.add_argument('--history-dir', type=str, default=None,
+                        help="Thư mục lưu lịch sử tin nhắn (mặc định: chỉ giữ tin gần nhất trong RAM)")
+    parser.add_argument('--download-dir', type=str, default='downloads',
+                        help="Thư mục lưu file nhận từ peers khác (chỉ engine thread)")
+    parser.add_argument('--max-file-size', type=int, default=MAX_FILE_SIZE >> 20,
+                        help="Kích thước file lớn nhất nhận từ peers khác (MB)")
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread',
+                        help="thread: một thread mỗi connection (mặc định), async: một event loop asyncio")
     
     args = parser.parse_args()
+    if args.engine == 'async':
+        if args.tracker_nodes:
+            parser.error("--engine async chỉ hỗ trợ một tracker (--tracker-host/--tracker-port)")
+        asyncio.run(run_async_peer(args))
+        sys.exit(0)
     
     # Khởi tạo và test
     print(f"Khởi tạo Peer client: {args.username} trên port {args.port}")
-    peer = Peer(args.username, args.port, args.tracker_host, args.tracker_port)
+    peer = Peer(args.username, args.port, args.tracker_host, args.tracker_port, args.tracker_nodes,
+                args.history_dir, args.download_dir, args.max_file_size << 20)
     
     # Test tự động: Đăng ký, load peers, gửi tin nhắn mẫu (nếu có target)
     print("Bước 1: Đăng ký với tracker...")
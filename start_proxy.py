@@ -27,7 +27,7 @@ Requirements:
 - socket: provide socket networking interface.
 - threading: enables concurrent client handling via threads.
 - argparse: parses command-line arguments for server configuration.
-- re: used for regular expression matching in configuration parsing
+- proxyconf: tokenizer, parser and hot reloader of the configuration file.
 - response: response utilities.
 - httpadapter: the class for handling HTTP requests.
 - urlparse: parses URLs to extract host and port information.
@@ -38,12 +38,14 @@ Requirements:
 # import socket
 # import threading
 import argparse
-import re
 from urllib.parse import urlparse
 #from collections import defaultdict
 
 
 from daemon import create_proxy
+from daemon.proxyconf import ConfigError, ConfigReloader, load_config
+from daemon.proxy import ACCESS_LOG, METRICS
+from daemon.metrics import serve_admin
 
 PROXY_PORT = 8080
 
@@ -52,68 +54,19 @@ def parse_virtual_hosts(config_file):
     """
     Parses virtual host blocks from a config file.
 
+    The file is tokenized and compiled by :mod:`daemon.proxyconf`; this
+    function returns the compiled table in the legacy routes format.
+
     :config_file (str): Path to the NGINX config file.
-    :rtype list of dict: Each dict contains 'listen'and 'server_name'.
+    :rtype dict: {host: (target | [targets], dist_policy)}.
     """
 
-    with open(config_file, 'r') as f:
-        config_text = f.read()
-
-    # Match each host block
-    # host "<IP in here>" {<code block>}
-    host_blocks = re.findall(r'host\s+"([^"]+)"\s*\{(.*?)\}', config_text, re.DOTALL)
-
-    # dist_policy_map = ""
-
-    routes = {}
-    for host, block in host_blocks:
-        # proxy_map = {}      # Dictionary {key: host, value: [proxy_pass]}
-
-        # Find all proxy_pass entries
-        proxy_passes = re.findall(r'proxy_pass\s+http://([^\s;]+);', block)
-        # map = proxy_map.get(host,[])
-        # map = map + proxy_passes
-        # proxy_map[host] = map
-
-        # Find dist_policy if present
-        policy_match = re.search(r'dist_policy\s+([\w-]+)', block)
-        if policy_match:
-            dist_policy_map = policy_match.group(1)
-        else: #default policy is round_robin
-            dist_policy_map = "round-robin"
-            
-        #
-        # @bksysnet: Build the mapping and policy
-        # TODO: this policy varies among scenarios 
-        #       the default policy is provided with one proxy_pass
-        #       In the multi alternatives of proxy_pass then
-        #       the policy is applied to identify the highest matching
-        #       proxy_pass
-        #
-        # if len(proxy_map.get(host,[])) == 1:    # In case of 1 proxy_pass
-        #     routes[host] = (proxy_map.get(host,[])[0], dist_policy_map)
-        # esle if:
-        #         TODO:  apply further policy matching here
-        #
-
-
-        # else:
-        #     routes[host] = (proxy_map.get(host,[]), dist_policy_map)
-        if (len(proxy_passes) == 1):        # 1 proxy
-            routes[host] = (proxy_passes[0], dist_policy_map)
-        else:                               # multiple proxies
-            routes[host] = (proxy_passes, dist_policy_map)
-    # print("Loaded virtual proxy routes:")
-    # for host, (targets, policy) in routes.items():
-    #     print("{} -> {}, policy: {}".format(host, targets, policy))
+    routes = load_config(config_file).legacy()
+    for host in routes:
         print("{} {}".format(host, routes[host]))
 
     return routes
 
-    # for key, value in routes.items():
-    #     print(key, value)
-    # return routes
-
 ### UTILITIES ###
 # def build_balancer(routes: dict) -> dict:
 #     """
@@ -183,19 +136,43 @@ if __name__ == "__main__":
 
     :arg --server-ip (str): IP address to bind the server (default: 127.0.0.1).
     :arg --server-port (int): Port number to bind the server (default: 9000).
+    :arg --config (str): proxy configuration file (default: config/proxy.conf).
+    :arg --admin-port (int): port of the JSON statistics endpoint (default: disabled).
+    :arg --access-log (str): path of the rotating access log (default: disabled).
+    :arg --engine (str): "thread" or "async" proxy engine (default: thread).
     """
 
     parser = argparse.ArgumentParser(prog='Proxy', description='', epilog='Proxy daemon')
     parser.add_argument('--server-ip', default='0.0.0.0')
     parser.add_argument('--server-port', type=int, default=PROXY_PORT)
+    parser.add_argument('--config', default='config/proxy.conf',
+                        help='proxy configuration, reloaded on SIGHUP or change')
+    parser.add_argument('--admin-port', type=int, default=0,
+                        help='serve JSON statistics on this port (0 disables)')
+    parser.add_argument('--access-log', default=None,
+                        help='path of the rotating access log (disabled by default)')
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread',
+                        help='thread-per-connection or asyncio event loop engine')
  
     args = parser.parse_args()
     ip = args.server_ip
     port = args.server_port
-
-    #! 1. Parse config file
-    routes = parse_virtual_hosts("config/proxy.conf")
-    #! 2. Build the balancer
-    #balancer: dict = build_balancer(routes)
-    #! 3. Pass to create_proxy
-    create_proxy(ip, port, routes)
+    engine = args.engine
+
+    #! 1. Parse and compile config file
+    try:
+        routes = ConfigReloader(args.config)
+    except (OSError, ConfigError) as e:
+        parser.error("cannot load {}: {}".format(args.config, e))
+    for host, route in routes.current().items():
+        print("{} {}".format(host, route))
+    #! 2. Swap in a new routing table on SIGHUP or file change
+    routes.install_signal_handler()
+    routes.watch()
+    #! 3. Statistics endpoint and access log, both off the request path
+    if args.admin_port:
+        serve_admin(ip, args.admin_port, METRICS)
+    if args.access_log:
+        ACCESS_LOG.open(args.access_log)
+    #! 4. Pass to create_proxy
+    create_proxy(ip, port, routes, engine)
@@ -2,89 +2,794 @@
 import socket
 import threading
 import argparse
+import asyncio
+import json
+import struct
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
 from datetime import datetime
+from types import MappingProxyType
+
+from p2p.channels import ChannelRegistry, valid_channel
+from p2p.cluster import INTERNAL_COMMANDS, LOCAL_PREFIX, NODE_PREFIX, ClusterNode
+from p2p.nameindex import NgramIndex
+from p2p.protocol import PUSH_ID, FrameDecoder, ProtocolError, encode_frame, is_framed
+from p2p.pubsub import Broker, Subscription, encode_event
+from p2p.ratelimit import RateLimiter
+from p2p.timerwheel import TimerWheel
+from p2p.wal import RegistryLog
 
 # Storage peers: {username: (ip, port)}
 PEERS = {}
 PEERS_LOCK = threading.Lock()
 
+# In log cho từng lệnh/kết nối; tắt bằng --quiet khi chạy tải lớn
+VERBOSE = True
+
+def log(message):
+    if VERBOSE:
+        print(message)
+
+# TTL (giây) của mỗi peer: peer phải gửi HEARTBEAT trước khi hết hạn, 0 = không hết hạn
+PEER_TTL = 30.0
+# Timer wheel hết hạn peers (O(1) mỗi peer, không quét toàn bộ PEERS), bảo vệ bởi PEERS_LOCK
+TIMERS = TimerWheel(tick=1.0, now=time.monotonic())
+# Bộ đếm cho lệnh STATS
+STATS = {'registered': 0, 'heartbeats': 0, 'expired': 0, 'busy': 0}
+
+# Version của registry, tăng 1 mỗi lần có peer join/leave. Khởi tạo theo thời gian (ms)
+# để version sau khi tracker khởi động lại luôn lớn hơn version client đang giữ.
+VERSION = int(time.time() * 1000)
+# Change log có giới hạn: (version, 'join'|'update'|'leave', username, addr), phục vụ LOOKUP_SINCE
+CHANGELOG_SIZE = 4096
+CHANGES = deque(maxlen=CHANGELOG_SIZE)
+# Usernames đã sắp xếp, phục vụ LOOKUP_PAGE theo cursor
+SORTED_NAMES = []
+# Chỉ mục trigram của usernames, phục vụ SEARCH_ANY (tìm chuỗi con)
+NAME_INDEX = NgramIndex()
+# Số peers tối đa mỗi trang LOOKUP_PAGE/SEARCH
+MAX_PAGE = 1000
+# Số kết quả mặc định của SEARCH khi không truyền limit
+SEARCH_LIMIT = 50
+# Snapshot bất biến của registry: (version, {username: (ip, port)} chỉ đọc, response PEERS:)
+# Được thay thế nguyên khối bằng một phép gán, nên đọc không cần PEERS_LOCK.
+SNAPSHOT = (None, MappingProxyType({}), None)
+# Chỉ một thread dựng snapshot mới tại một thời điểm
+SNAPSHOT_LOCK = threading.Lock()
+# Thành viên các kênh chat (JOIN/PART/MEMBERS, xem p2p/channels.py).
+# Chỉ giữ trong bộ nhớ (không ghi WAL); peer JOIN lại các kênh của mình mỗi khi REGISTER lại.
+CHANNELS = ChannelRegistry()
+# Số thành viên mặc định mỗi trang MEMBERS
+MEMBERS_LIMIT = 1000
+# Write-ahead log của registry (p2p/wal.py), None nếu chạy không có --data-dir
+WAL = None
+# Node trong cluster nhiều tracker (p2p/cluster.py), None nếu chạy một tracker
+CLUSTER = None
+# IP của các node trong cluster: chỉ chúng được gửi lệnh có tiền tố NODE: (không bị rate limit)
+NODE_SOURCES = set()
+# Subscribers nhận sự kiện join/update/leave (SUBSCRIBE, xem p2p/pubsub.py)
+BROKER = Broker()
+# Số sự kiện tối đa chờ gửi cho một subscriber; đầy thì subscriber phải resync
+SUBSCRIBER_QUEUE = 1024
+# Subscriber không đọc trong khoảng thời gian này (giây) sẽ bị ngắt kết nối
+SUBSCRIBER_TIMEOUT = 30
+EVENT_OPS = {'join': 'J', 'update': 'U', 'leave': 'L'}
+# Ngân sách token bucket cho từng lớp lệnh (xem p2p/ratelimit.py):
+# (tokens/giây theo IP, burst theo IP, tokens/giây theo username, burst theo username)
+RATE_LIMITS = {
+    'REGISTER': (50, 200, 2, 10),
+    'HEARTBEAT': (200, 1000, 1, 5),
+    'LOOKUP': (200, 1000, None, None),
+}
+# Bộ giới hạn tốc độ, None nếu chạy với --no-rate-limit
+LIMITER = RateLimiter(RATE_LIMITS)
+# Số lệnh tối đa được thực thi đồng thời; vượt quá thì trả NAK:Busy ngay
+MAX_INFLIGHT = 64
+INFLIGHT = threading.BoundedSemaphore(MAX_INFLIGHT)
+
+def record_change(op, username, addr=None):
+    """
+    Ghi một thay đổi vào change log và WAL (gọi khi đang giữ PEERS_LOCK).
+    Trả về số thứ tự bản ghi WAL để chờ fsync sau khi nhả lock, hoặc None.
+    """
+    global VERSION
+    VERSION += 1
+    CHANGES.append((VERSION, op, username, addr))
+    BROKER.publish(encode_event(VERSION, EVENT_OPS[op], username, addr))
+    if WAL is not None:
+        return WAL.append(VERSION, 'L' if op == 'leave' else 'J', username, addr)
+    return None
+
+def maybe_snapshot():
+    """Chụp snapshot registry khi WAL đã đủ dài; ghi file ở thread nền."""
+    if WAL is None or not WAL.needs_snapshot():
+        return
+    with PEERS_LOCK:
+        if not WAL.needs_snapshot():
+            return
+        peers = dict(PEERS)
+        version = VERSION
+        WAL.rotate(version)
+    threading.Thread(target=WAL.write_snapshot, args=(version, peers), daemon=True).start()
+
+def load_registry(data_dir):
+    """
+    Khôi phục registry từ snapshot + WAL trong data_dir và bật ghi WAL.
+    Peers khôi phục được cấp TTL mới: peer còn sống chỉ cần tiếp tục HEARTBEAT,
+    không phải REGISTER lại.
+    """
+    global WAL, VERSION
+    started = time.monotonic()
+    WAL = RegistryLog(data_dir)
+    version, peers = WAL.recover()
+    with PEERS_LOCK:
+        PEERS.update(peers)
+        SORTED_NAMES[:] = sorted(PEERS)
+        NAME_INDEX.rebuild(PEERS)
+        VERSION = max(VERSION, version)
+        if PEER_TTL > 0:
+            deadline = time.monotonic() + PEER_TTL
+            for username in PEERS:
+                TIMERS.schedule(username, deadline)
+    print(f"[Tracker] Khôi phục {len(peers)} peers (version {version}) từ {data_dir} "
+          f"trong {time.monotonic() - started:.3f}s")
+
+def remove_peer(username):
+    """Xoá peer khỏi registry (gọi khi đang giữ PEERS_LOCK)."""
+    del PEERS[username]
+    del SORTED_NAMES[bisect_left(SORTED_NAMES, username)]
+    NAME_INDEX.remove(username)
+    CHANNELS.remove_user(username)
+    if CLUSTER is not None:
+        # Kênh được chia theo tên kênh nên nằm ở các node khác: báo chúng xoá peer khỏi kênh
+        CLUSTER.notify_others(f"PARTALL:{username}")
+    record_change('leave', username)
+
 def add_peer(username, ip, port):
     with PEERS_LOCK:
-        PEERS[username] = (ip, int(port))
-        print(f"[Tracker] Register peer: {username} at {ip}:{port}")
+        addr = (ip, int(port))
+        old = PEERS.get(username)
+        if old is None:
+            insort(SORTED_NAMES, username)
+            NAME_INDEX.add(username)
+        PEERS[username] = addr
+        seq = None
+        if old != addr:
+            seq = record_change('join' if old is None else 'update', username, addr)
+        STATS['registered'] += 1
+        if PEER_TTL > 0:
+            TIMERS.schedule(username, time.monotonic() + PEER_TTL)
+        log(f"[Tracker] Register peer: {username} at {ip}:{port}")
+    if seq is not None:
+        # Chỉ ACK sau khi bản ghi đã fsync (group commit với các REGISTER đồng thời)
+        WAL.wait(seq)
+        maybe_snapshot()
 
-def get_peer(username):
+def heartbeat_peer(username, addr=None):
+    """
+    Gia hạn TTL của peer; trả False nếu peer không còn trong PEERS.
+    Nếu có addr (ip, port), peer chưa có sẽ được thêm lại (REFRESH sao chép giữa các
+    node cluster); khi đó có thể raise OSError nếu ghi WAL lỗi, như add_peer.
+    """
+    if addr is not None and lookup_peer(username) is None:
+        add_peer(username, addr[0], addr[1])
+        return True
+    with PEERS_LOCK:
+        if username not in PEERS:
+            return False
+        STATS['heartbeats'] += 1
+        if PEER_TTL > 0:
+            TIMERS.schedule(username, time.monotonic() + PEER_TTL)
+        return True
+
+def expire_peers():
+    """Loại các peers đã hết TTL, trả về danh sách username bị loại."""
+    with PEERS_LOCK:
+        expired = TIMERS.advance(time.monotonic())
+        for username in expired:
+            remove_peer(username)
+        STATS['expired'] += len(expired)
+        total = STATS['expired']
+    maybe_snapshot()
+    if expired:
+        print(f"[Tracker] Hết hạn {len(expired)} peers: {', '.join(expired)} (tổng {total})")
+    return expired
+
+def run_reaper():
+    """Thread nền: mỗi tick của timer wheel, loại các peers hết hạn."""
+    while True:
+        time.sleep(TIMERS.tick)
+        try:
+            expire_peers()
+        except Exception as e:
+            print(f"[Tracker] Lỗi khi loại peers hết hạn: {e}")
+
+def get_stats():
+    with PEERS_LOCK:
+        stats = dict(STATS, peers=len(PEERS), ttl=PEER_TTL, version=VERSION)
+    if WAL is not None:
+        stats['wal'] = WAL.stats()
+    if CLUSTER is not None:
+        stats['cluster'] = dict(CLUSTER.stats, node=CLUSTER.node_id)
+    stats['subscriptions'] = BROKER.stats()
+    stats['channels'] = CHANNELS.stats()
+    if LIMITER is not None:
+        stats['rate_limit'] = LIMITER.stats()
+    return stats
+
+def lookup_since(since):
+    """
+    Trả các thay đổi sau version since, đã gộp theo username (thay đổi cuối cùng thắng):
+    {'version': V, 'joins': [...], 'leaves': [...]}.
+    Trả None nếu change log không còn đủ lịch sử (client phải đồng bộ lại toàn bộ).
+    """
+    with PEERS_LOCK:
+        count = VERSION - since
+        if count < 0 or count > len(CHANGES):
+            return None
+        latest = {}
+        for i in range(len(CHANGES) - 1, len(CHANGES) - 1 - count, -1):
+            _, op, username, addr = CHANGES[i]
+            if username not in latest:
+                latest[username] = (op, addr)
+        version = VERSION
+    joins = [{'username': u, 'ip': a[0], 'port': a[1]} for u, (op, a) in latest.items() if op != 'leave']
+    leaves = [u for u, (op, _) in latest.items() if op == 'leave']
+    return {'version': version, 'joins': joins, 'leaves': leaves}
+
+def lookup_page(cursor, limit):
+    """
+    Trả một trang peers theo thứ tự username, bắt đầu sau cursor:
+    {'version': V, 'peers': [...], 'next': cursor trang sau hoặc None}.
+    """
+    with PEERS_LOCK:
+        start = bisect_right(SORTED_NAMES, cursor) if cursor else 0
+        names = SORTED_NAMES[start:start + limit]
+        peers = [{'username': u, 'ip': PEERS[u][0], 'port': PEERS[u][1]} for u in names]
+        more = start + limit < len(SORTED_NAMES)
+        version = VERSION
+    return {'version': version, 'peers': peers, 'next': names[-1] if more else None}
+
+def search_peers(prefix, limit, cursor=''):
+    """
+    Tìm peers có username bắt đầu bằng prefix, theo thứ tự username, sau cursor:
+    {'version': V, 'peers': [...], 'next': cursor trang sau hoặc None}.
+    Dùng bisect trên SORTED_NAMES nên chi phí là O(log n + limit), không quét PEERS.
+    """
     with PEERS_LOCK:
-        return PEERS.get(username)
+        start = bisect_left(SORTED_NAMES, prefix)
+        if cursor > prefix:
+            start = max(start, bisect_right(SORTED_NAMES, cursor))
+        names = []
+        for username in SORTED_NAMES[start:start + limit + 1]:
+            if not username.startswith(prefix):
+                break
+            names.append(username)
+        more = len(names) > limit
+        names = names[:limit]
+        peers = [{'username': u, 'ip': PEERS[u][0], 'port': PEERS[u][1]} for u in names]
+        version = VERSION
+    return {'version': version, 'peers': peers, 'next': names[-1] if more else None}
+
+def search_substring(substring, limit, cursor=''):
+    """
+    Tìm peers có username chứa substring, theo thứ tự username, sau cursor (cùng dạng
+    kết quả với search_peers). Chuỗi từ 3 ký tự chỉ xét các username trong danh sách
+    trigram hiếm nhất của nó (NAME_INDEX); chuỗi ngắn hơn thì quét SORTED_NAMES từ
+    cursor và dừng khi đủ một trang.
+    """
+    with PEERS_LOCK:
+        candidates = NAME_INDEX.candidates(substring)
+        if candidates is None:
+            start = bisect_right(SORTED_NAMES, cursor) if cursor else 0
+            names = []
+            for username in SORTED_NAMES[start:]:
+                if substring in username:
+                    names.append(username)
+                    if len(names) > limit:
+                        break
+        else:
+            names = sorted(u for u in candidates if substring in u and u > cursor)[:limit + 1]
+        more = len(names) > limit
+        names = names[:limit]
+        peers = [{'username': u, 'ip': PEERS[u][0], 'port': PEERS[u][1]} for u in names]
+        version = VERSION
+    return {'version': version, 'peers': peers, 'next': names[-1] if more else None}
+
+def registry_snapshot():
+    """
+    Trả snapshot bất biến (version, peers, payload) của registry.
+    Nếu registry chưa đổi kể từ snapshot trước, trả ngay mà không lấy khoá nào. Nếu đã đổi,
+    một thread dựng snapshot mới: chỉ copy dict dưới PEERS_LOCK (writer bị chặn rất ngắn),
+    json.dumps chạy ngoài khoá, và mỗi version chỉ được mã hoá một lần.
+    """
+    global SNAPSHOT
+    snapshot = SNAPSHOT
+    if snapshot[0] == VERSION:
+        return snapshot
+    with SNAPSHOT_LOCK:
+        if SNAPSHOT[0] == VERSION:
+            return SNAPSHOT
+        with PEERS_LOCK:
+            version = VERSION
+            peers = dict(PEERS)
+        peers_list = [{'username': k, 'ip': v[0], 'port': v[1]} for k, v in peers.items()]
+        payload = f"PEERS:{json.dumps({'peers': peers_list})}\n"
+        SNAPSHOT = (version, MappingProxyType(peers), payload)
+        return SNAPSHOT
+
+def get_peer(username):
+    return lookup_peer(username)
     
 def lookup_peer(username):
-    with PEERS_LOCK:
-        return PEERS.get(username)
+    # dict.get là thao tác nguyên tử (GIL), không cần PEERS_LOCK cho một lần đọc
+    return PEERS.get(username)
 
-def handle_tracker_client(conn, addr):
-    import json
+def process_command(data):
+    """
+    Điểm vào cho mọi lệnh: ở chế độ cluster, lệnh được định tuyến tới node sở hữu
+    username (xem p2p/cluster.py); ngược lại thực thi ngay trên tracker này.
+    """
+    if CLUSTER is not None:
+        return CLUSTER.handle(data, execute_command)
+    return execute_command(data)
+
+def admit_command(source, command):
+    """
+    Kiểm tra rate limit của lệnh từ IP source, trước khi parse/định tuyến lệnh.
+    Lệnh từ node khác (tiền tố NODE:) chỉ được nhận từ IP của node và không bị rate limit;
+    lệnh nội bộ của cluster (REFRESH/PARTALL) chỉ được nhận với tiền tố đó.
+    Trả response NAK nếu lệnh bị từ chối, None nếu được thực thi.
+    """
+    from_node = command.startswith(NODE_PREFIX)
+    if from_node:
+        if source not in NODE_SOURCES:
+            return 'NAK:Internal command'
+        command = command[len(NODE_PREFIX):]
+    if command.startswith(LOCAL_PREFIX):
+        command = command[len(LOCAL_PREFIX):]
+    if from_node:
+        return None
+    if command.partition(':')[0] in INTERNAL_COMMANDS:
+        return 'NAK:Internal command'
+    if LIMITER is not None and not LIMITER.allow(source, command):
+        return 'NAK:Rate limited'
+    return None
+
+def guarded_command(source, command):
+    """
+    process_command có kiểm soát: rate limit theo IP/username, và giới hạn số lệnh
+    thực thi đồng thời (MAX_INFLIGHT) để độ trễ ổn định khi tracker bị quá tải.
+    """
+    rejected = admit_command(source, command)
+    if rejected is not None:
+        return rejected
+    if not INFLIGHT.acquire(blocking=False):
+        STATS['busy'] += 1
+        return 'NAK:Busy'
     try:
-        data = conn.recv(1024).decode('utf-8').strip()
-        if data.startswith('REGISTER:'):
-            parts = data.split(':')
-            if len(parts) != 4:
-                conn.send(b'NAK:Invalid format (expected REGISTER:username:ip:port)')
-                return
-            cmd, username, ip, port_str = parts
-            if not port_str:
-                conn.send(b'NAK:Port cannot be empty')
+        return process_command(command)
+    finally:
+        INFLIGHT.release()
+
+def parse_port(port_str):
+    """Port của REGISTER/REFRESH: trả (port, None) hoặc (None, response NAK)."""
+    if not port_str:
+        return None, 'NAK:Port cannot be empty'
+    try:
+        port = int(port_str)
+    except ValueError:
+        return None, 'NAK:Invalid port value (must be an integer)'
+    if not (1024 <= port <= 65535):
+        return None, 'NAK:Port must be between 1024 and 65535'
+    return port, None
+
+def execute_command(data):
+    """
+    Thực thi một lệnh tracker (REGISTER/LOOKUP/LOOKUP_SINCE/LOOKUP_PAGE/SEARCH/SEARCH_ANY/
+    HEARTBEAT/REFRESH/JOIN/PART/PARTALL/MEMBERS/STATS)
+    và trả về response dạng str.
+    Dùng chung cho kết nối text cũ (một lệnh) và kết nối framed (nhiều lệnh).
+
+    Đồng bộ danh sách peers không cần tải lại toàn bộ:
+      LOOKUP_PAGE:<cursor>:<limit> -> PAGE:{"version", "peers", "next"}
+      LOOKUP_SINCE:<version>       -> DELTA:{"version", "joins", "leaves"}
+                                      hoặc RESYNC:<version> nếu change log không đủ
+
+    Tìm theo tiền tố username (autocomplete) hoặc theo chuỗi con, trả từng trang:
+      SEARCH:<prefix>[:<limit>[:<cursor>]]        -> RESULTS:{"version", "peers", "next"}
+      SEARCH_ANY:<substring>[:<limit>[:<cursor>]] -> RESULTS:{"version", "peers", "next"}
+
+    Kênh chat: peer gửi tin kênh chỉ tới các thành viên thay vì mọi peer:
+      JOIN:<channel>:<username>              -> ACK:Joined
+      PART:<channel>:<username>              -> ACK:Left
+      PARTALL:<username>                     -> ACK:Left (rời mọi kênh trên node này)
+      MEMBERS:<channel>[:<limit>[:<cursor>]] -> MEMBERS:{"channel", "members", "next"}
+    """
+    if data.startswith('REGISTER:'):
+        parts = data.split(':')
+        if len(parts) != 4:
+            return 'NAK:Invalid format (expected REGISTER:username:ip:port)'
+        cmd, username, ip, port_str = parts
+        port, error = parse_port(port_str)
+        if error is not None:
+            return error
+        try:
+            add_peer(username, ip, port)
+        except OSError as e:
+            print(f"[Tracker] Lỗi ghi WAL khi REGISTER {username}: {e}")
+            return 'NAK:Registry write failed'
+        return 'ACK:Registered'
+    elif data.startswith('LOOKUP:'):
+        parts = data.split(':')
+        if len(parts) != 2:
+            return 'NAK:Invalid format (expected LOOKUP:target_username or LOOKUP:*)'
+
+        cmd, target = parts
+        if target == '*':
+            # LOOKUP tất cả peers - trả JSON list đã mã hoá sẵn cho version hiện tại
+            version, peers, payload = registry_snapshot()
+            log(f"[Tracker] Trả LOOKUP:* {len(peers)} peers (version {version})")
+            return payload
+        else:
+            # LOOKUP peer cụ thể
+            peer_info = lookup_peer(target)
+            if peer_info:
+                log(f"[Tracker] Trả FOUND cho {target}: {peer_info[0]}:{peer_info[1]}")
+                return f"FOUND:{peer_info[0]}:{peer_info[1]}\n"
+            log(f"[Tracker] NAK cho LOOKUP:{target} - không tồn tại")
+            return 'NAK:Peer not found\n'
+    elif data.startswith('LOOKUP_SINCE:'):
+        parts = data.split(':')
+        try:
+            since = int(parts[1]) if len(parts) == 2 else None
+        except ValueError:
+            since = None
+        if since is None:
+            return 'NAK:Invalid format (expected LOOKUP_SINCE:version)'
+        delta = lookup_since(since)
+        if delta is None:
+            return f"RESYNC:{VERSION}"
+        return f"DELTA:{json.dumps(delta)}"
+    elif data.startswith('LOOKUP_PAGE:'):
+        parts = data.split(':')
+        try:
+            limit = int(parts[2]) if len(parts) == 3 else 0
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            return 'NAK:Invalid format (expected LOOKUP_PAGE:cursor:limit)'
+        return f"PAGE:{json.dumps(lookup_page(parts[1], min(limit, MAX_PAGE)))}"
+    elif data.startswith('SEARCH:') or data.startswith('SEARCH_ANY:'):
+        parts = data.split(':')
+        try:
+            limit = int(parts[2]) if len(parts) > 2 and parts[2] else SEARCH_LIMIT
+        except ValueError:
+            limit = 0
+        if len(parts) > 4 or limit <= 0:
+            return f'NAK:Invalid format (expected {parts[0]}:query:limit:cursor)'
+        cursor = parts[3] if len(parts) == 4 else ''
+        search = search_peers if parts[0] == 'SEARCH' else search_substring
+        result = search(parts[1], min(limit, MAX_PAGE), cursor)
+        log(f"[Tracker] Trả {parts[0]}:{parts[1]} {len(result['peers'])} peers")
+        return f"RESULTS:{json.dumps(result)}"
+    elif data.startswith('HEARTBEAT:'):
+        parts = data.split(':')
+        if len(parts) != 2:
+            return 'NAK:Invalid format (expected HEARTBEAT:username)'
+        if heartbeat_peer(parts[1]):
+            return 'ACK:Alive'
+        # Peer đã bị loại (hết hạn), client cần REGISTER lại
+        return 'NAK:Peer not found'
+    elif data.startswith('REFRESH:'):
+        # HEARTBEAT do node khác sao chép, kèm địa chỉ để replica bỏ lỡ REGISTER bắt kịp
+        if CLUSTER is None:
+            return 'NAK:Unsupported outside cluster mode'
+        parts = data.split(':')
+        if len(parts) != 4 or not parts[1]:
+            return 'NAK:Invalid format (expected REFRESH:username:ip:port)'
+        port, error = parse_port(parts[3])
+        if error is not None:
+            return error
+        try:
+            heartbeat_peer(parts[1], (parts[2], port))
+        except OSError as e:
+            print(f"[Tracker] Lỗi ghi WAL khi REFRESH {parts[1]}: {e}")
+            return 'NAK:Registry write failed'
+        return 'ACK:Alive'
+    elif data.startswith('JOIN:') or data.startswith('PART:'):
+        parts = data.split(':')
+        if len(parts) != 3 or not parts[2]:
+            return f"NAK:Invalid format (expected {parts[0]}:channel:username)"
+        cmd, channel, username = parts
+        if not valid_channel(channel):
+            return 'NAK:Invalid channel name'
+        if cmd == 'PART':
+            CHANNELS.part(channel, username)
+            log(f"[Tracker] {username} rời kênh #{channel}")
+            return 'ACK:Left'
+        # Trong cluster, node giữ kênh có thể không giữ username nên không kiểm tra được
+        if CLUSTER is None and lookup_peer(username) is None:
+            return 'NAK:Peer not found'
+        CHANNELS.join(channel, username)
+        log(f"[Tracker] {username} vào kênh #{channel}")
+        return 'ACK:Joined'
+    elif data.startswith('PARTALL:'):
+        # Node giữ username gửi tới các node khác khi peer hết hạn (cluster)
+        username = data[len('PARTALL:'):]
+        if not username:
+            return 'NAK:Invalid format (expected PARTALL:username)'
+        CHANNELS.remove_user(username)
+        return 'ACK:Left'
+    elif data.startswith('MEMBERS:'):
+        parts = data.split(':')
+        try:
+            limit = int(parts[2]) if len(parts) > 2 and parts[2] else MEMBERS_LIMIT
+        except ValueError:
+            limit = 0
+        if len(parts) > 4 or limit <= 0 or not valid_channel(parts[1]):
+            return 'NAK:Invalid format (expected MEMBERS:channel:limit:cursor)'
+        cursor = parts[3] if len(parts) == 4 else ''
+        return f"MEMBERS:{json.dumps(CHANNELS.page(parts[1], min(limit, MAX_PAGE), cursor))}"
+    elif data == 'STATS':
+        return f"STATS:{json.dumps(get_stats())}"
+    log(f"[Tracker] NAK: Unknown command '{data}'")
+    return 'NAK:Unknown command'
+
+def parse_subscribe(command):
+    """
+    Trả (True, since) nếu command là SUBSCRIBE hoặc SUBSCRIBE:<version>, (False, None) nếu không.
+    """
+    if command == 'SUBSCRIBE':
+        return True, None
+    if command.startswith('SUBSCRIBE:'):
+        try:
+            return True, int(command[len('SUBSCRIBE:'):])
+        except ValueError:
+            return True, -1
+    return False, None
+
+def open_subscription(since, wakeup):
+    """
+    Tạo subscription và đăng ký vào BROKER. Nếu có since, các sự kiện sau version đó
+    (còn trong change log) được xếp hàng trước, dưới cùng PEERS_LOCK nên không hụt sự kiện.
+    Trả về (subscription, version hiện tại).
+    """
+    subscription = Subscription(SUBSCRIBER_QUEUE, wakeup, lambda: VERSION)
+    with PEERS_LOCK:
+        if since is not None:
+            count = VERSION - since
+            if 0 <= count <= len(CHANGES):
+                for i in range(len(CHANGES) - count, len(CHANGES)):
+                    version, op, username, addr = CHANGES[i]
+                    subscription.offer(encode_event(version, EVENT_OPS[op], username, addr))
+            else:
+                # Change log không đủ: client phải đồng bộ lại (LOOKUP_PAGE)
+                subscription.events.append(None)
+                wakeup()
+        BROKER.subscribe(subscription)
+        version = VERSION
+    return subscription, version
+
+def start_subscription(conn, write_lock, since):
+    """
+    SUBSCRIBE trên kết nối framed (engine thread): một thread gửi sự kiện dạng push
+    frame (request id 0), dùng chung write_lock với các response.
+    """
+    wakeup = threading.Event()
+    subscription, version = open_subscription(since, wakeup.set)
+    # sendall chờ tối đa SUBSCRIBER_TIMEOUT giây khi client không đọc
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack('ll', SUBSCRIBER_TIMEOUT, 0))
+
+    def push_loop():
+        while True:
+            wakeup.wait()
+            wakeup.clear()
+            if subscription.closed:
                 return
+            payload = subscription.drain()
+            if payload is None:
+                continue
             try:
-                port = int(port_str)
-                if not (1024 <= port <= 65535):
-                    conn.send(b'NAK:Port must be between 1024 and 65535')
-                    return
-            except ValueError:
-                conn.send(b'NAK:Invalid port value (must be an integer)')
-                return
-            add_peer(username, ip, port)
-            conn.send(b'ACK:Registered')
-        elif data.startswith('LOOKUP:'):
-            parts = data.split(':')
-            if len(parts) != 2:
-                conn.send(b'NAK:Invalid format (expected LOOKUP:target_username or LOOKUP:*)')
+                with write_lock:
+                    conn.sendall(encode_frame(PUSH_ID, payload))
+            except OSError as e:
+                print(f"[Tracker] Ngắt subscriber chậm/đã đóng: {e}")
+                BROKER.drop(subscription)
+                conn.close()
                 return
-            
-            cmd, target = parts
-            if target == '*':
-                # LOOKUP tất cả peers - trả JSON list
-                with PEERS_LOCK:
-                    peers_list = [{'username': k, 'ip': v[0], 'port': v[1]} for k, v in PEERS.items()]
-                peers_json = json.dumps({'peers': peers_list})
-                full_response = f"PEERS:{peers_json}\n"
-                conn.send(full_response.encode('utf-8'))
-                print(f"[Tracker] Trả LOOKUP:* {len(peers_list)} peers")
-            else:
-                # LOOKUP peer cụ thể
-                peer_info = lookup_peer(target)
-                if peer_info:
-                    full_response = f"FOUND:{peer_info[0]}:{peer_info[1]}\n"
-                    conn.send(full_response.encode('utf-8'))
-                    print(f"[Tracker] Trả FOUND cho {target}: {peer_info[0]}:{peer_info[1]}")
+
+    threading.Thread(target=push_loop, daemon=True).start()
+    return subscription, version
+
+def serve_framed(conn, addr, data):
+    """
+    Vòng lặp cho kết nối framed (xem p2p/protocol.py): client giữ kết nối lâu dài
+    và có thể pipeline nhiều lệnh, mỗi lệnh mang request id riêng.
+    Các response của cùng một lần recv được gửi lại bằng một lần sendall.
+    SUBSCRIBE[:version] biến kết nối thành kênh nhận sự kiện push (request id 0).
+    """
+    decoder = FrameDecoder()
+    write_lock = threading.Lock()
+    subscription = None
+    try:
+        while data:
+            decoder.feed(data)
+            out = []
+            for req_id, payload in decoder.frames():
+                command = payload.decode('utf-8').strip()
+                is_subscribe, since = parse_subscribe(command)
+                if not is_subscribe:
+                    response = guarded_command(addr[0], command)
+                elif subscription is not None:
+                    response = 'NAK:Already subscribed'
                 else:
-                    conn.send(b'NAK:Peer not found\n')
-                    print(f"[Tracker] NAK cho LOOKUP:{target} - không tồn tại")
+                    subscription, version = start_subscription(conn, write_lock, since)
+                    response = f"ACK:Subscribed:{version}"
+                out.append(encode_frame(req_id, response))
+            if out:
+                with write_lock:
+                    conn.sendall(b''.join(out))
+            data = conn.recv(65536)
+    finally:
+        if subscription is not None:
+            BROKER.unsubscribe(subscription)
+            subscription.closed = True
+            subscription.wakeup()
+
+def handle_tracker_client(conn, addr):
+    try:
+        data = conn.recv(1024)
+        if is_framed(data):
+            serve_framed(conn, addr, data)
         else:
-            conn.send(b'NAK:Unknown command')
-            print(f"[Tracker] NAK: Unknown command '{data}'")
+            # Lệnh text cũ: một lệnh, một response, rồi đóng kết nối
+            response = guarded_command(addr[0], data.decode('utf-8').strip())
+            conn.send(response.encode('utf-8'))
     except Exception as e:
         print(f"[Tracker] Lỗi xử lý client {addr}: {e}")
     finally:
         conn.close()
 
-def run_tracker(ip, port):
+def join_cluster(nodes, node_id=None, port=None, replicas=2):
+    """
+    Bật chế độ cluster: nodes là danh sách "host:port" của mọi tracker (giống nhau trên
+    mọi node), node_id là node hiện tại (mặc định: node trong danh sách có cùng port).
+    """
+    global CLUSTER
+    if node_id is None:
+        matches = [n for n in nodes if n.rpartition(':')[2] == str(port)]
+        if len(matches) != 1:
+            raise ValueError("Không xác định được node hiện tại, hãy truyền --node host:port")
+        node_id = matches[0]
+    CLUSTER = ClusterNode(node_id, nodes, replicas=replicas, lookup=lookup_peer)
+    for node in nodes:
+        try:
+            NODE_SOURCES.add(socket.gethostbyname(node.rpartition(':')[0] or 'localhost'))
+        except OSError as e:
+            print(f"[Tracker] Không phân giải được node {node}: {e}")
+    print(f"[Tracker] Node {node_id} trong cluster {len(nodes)} nodes, {replicas} bản sao")
+
+async def handle_async_client(reader, writer):
+    """
+    Phiên bản asyncio của handle_tracker_client: cùng bộ lệnh, cùng hai kiểu kết nối.
+    Khi có WAL (chờ fsync) hoặc cluster (gọi node khác), lệnh chạy trong thread pool
+    để không chặn event loop; ngược lại lệnh chạy thẳng trên loop.
+    """
+    addr = writer.get_extra_info('peername')
+    log(f"[Tracker] Accepted connection from {addr}")
+    loop = asyncio.get_running_loop()
+    blocking = WAL is not None or CLUSTER is not None
+    subscription = None
+
+    async def run(payload):
+        command = payload.decode('utf-8').strip()
+        if not blocking:
+            return guarded_command(addr[0], command)
+        # Từ chối ngay trên event loop, không chiếm thread của executor
+        rejected = admit_command(addr[0], command)
+        if rejected is not None:
+            return rejected
+        if not INFLIGHT.acquire(blocking=False):
+            STATS['busy'] += 1
+            return 'NAK:Busy'
+        try:
+            return await loop.run_in_executor(None, process_command, command)
+        finally:
+            INFLIGHT.release()
+
+    try:
+        data = await reader.read(1024)
+        if not is_framed(data):
+            # Lệnh text cũ: một lệnh, một response, rồi đóng kết nối
+            writer.write((await run(data)).encode('utf-8'))
+            await writer.drain()
+            return
+        decoder = FrameDecoder()
+        while data:
+            decoder.feed(data)
+            out = []
+            for req_id, payload in decoder.frames():
+                is_subscribe, since = parse_subscribe(payload.decode('utf-8').strip())
+                if not is_subscribe:
+                    response = await run(payload)
+                elif subscription is not None:
+                    response = 'NAK:Already subscribed'
+                else:
+                    wakeup = asyncio.Event()
+                    subscription, version = open_subscription(
+                        since, lambda: loop.call_soon_threadsafe(wakeup.set))
+                    pusher = asyncio.ensure_future(push_events(writer, subscription, wakeup))
+                    response = f"ACK:Subscribed:{version}"
+                out.append(encode_frame(req_id, response))
+            if out:
+                writer.write(b''.join(out))
+                await writer.drain()
+            data = await reader.read(65536)
+    except (OSError, ProtocolError, UnicodeDecodeError) as e:
+        print(f"[Tracker] Lỗi xử lý client {addr}: {e}")
+    finally:
+        if subscription is not None:
+            BROKER.unsubscribe(subscription)
+            pusher.cancel()
+        writer.close()
+
+async def push_events(writer, subscription, wakeup):
+    """Gửi sự kiện của một subscriber (engine async); ngắt subscriber không đọc."""
+    while True:
+        await wakeup.wait()
+        wakeup.clear()
+        payload = subscription.drain()
+        if payload is None:
+            continue
+        writer.write(encode_frame(PUSH_ID, payload))
+        try:
+            await asyncio.wait_for(writer.drain(), SUBSCRIBER_TIMEOUT)
+        except (asyncio.TimeoutError, OSError) as e:
+            print(f"[Tracker] Ngắt subscriber chậm/đã đóng: {e!r}")
+            BROKER.drop(subscription)
+            writer.close()
+            return
+
+def raise_nofile_limit():
+    """Nâng giới hạn số file descriptor (soft) lên mức hard để nhận nhiều kết nối."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return -1
+
+def run_async_tracker(ip, port, data_dir=None, backlog=4096):
+    """Chạy tracker trên một event loop asyncio (--engine async)."""
+    if data_dir:
+        load_registry(data_dir)
+    raise_nofile_limit()
+
+    async def main():
+        server = await asyncio.start_server(handle_async_client, ip, port,
+                                            backlog=backlog, reuse_address=True)
+        print(f"[Tracker] Listening on {ip}:{port} (asyncio, backlog {backlog}, peer TTL {PEER_TTL}s)")
+        threading.Thread(target=run_reaper, daemon=True).start()
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+def run_tracker(ip, port, data_dir=None, backlog=128):
+    if data_dir:
+        load_registry(data_dir)
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind((ip, port))
-    server.listen(5)
-    print(f"[Tracker] Listening on {ip}:{port}")
+    server.listen(backlog)
+    print(f"[Tracker] Listening on {ip}:{port} (backlog {backlog}, peer TTL {PEER_TTL}s)")
+    threading.Thread(target=run_reaper, daemon=True).start()
     while True:
         conn, addr = server.accept()
-        print(f"[Tracker] Accepted connection from {addr}")
+        log(f"[Tracker] Accepted connection from {addr}")
         client_thread = threading.Thread(target=handle_tracker_client, args=(conn, addr), daemon=True)
         client_thread.start()
 
@@ -92,5 +797,34 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Chạy Tracker Server")
     parser.add_argument('--ip', default='0.0.0.0')
     parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--ttl', type=float, default=PEER_TTL,
+                        help="TTL (giây) của peer không gửi HEARTBEAT, 0 = không hết hạn")
+    parser.add_argument('--data-dir', default=None,
+                        help="Thư mục lưu WAL + snapshot của registry (mặc định: chỉ lưu trong RAM)")
+    parser.add_argument('--cluster', default=None,
+                        help="Danh sách node cluster 'host:port,host:port,...' (mặc định: một tracker)")
+    parser.add_argument('--node', default=None, help="host:port của node này trong --cluster")
+    parser.add_argument('--replicas', type=int, default=2, help="Số bản sao mỗi peer (owner + successors)")
+    parser.add_argument('--engine', choices=('thread', 'async'), default='thread',
+                        help="thread: một thread mỗi kết nối; async: một event loop asyncio")
+    parser.add_argument('--backlog', type=int, default=None,
+                        help="Độ dài hàng đợi listen() (mặc định 128 cho thread, 4096 cho async)")
+    parser.add_argument('--no-rate-limit', action='store_true',
+                        help="Tắt rate limit theo IP/username (ví dụ khi đo tải từ một máy)")
+    parser.add_argument('--max-inflight', type=int, default=MAX_INFLIGHT,
+                        help="Số lệnh tối đa thực thi đồng thời, vượt quá trả NAK:Busy")
+    parser.add_argument('--quiet', action='store_true', help="Không in log cho từng lệnh")
     args = parser.parse_args()
-    run_tracker(args.ip, args.port)
\ No newline at end of file
+    PEER_TTL = args.ttl
+    VERBOSE = not args.quiet
+    if args.no_rate_limit:
+        LIMITER = None
+    MAX_INFLIGHT = args.max_inflight
+    INFLIGHT = threading.BoundedSemaphore(MAX_INFLIGHT)
+    if args.cluster:
+        join_cluster([n.strip() for n in args.cluster.split(',') if n.strip()],
+                     args.node, args.port, args.replicas)
+    if args.engine == 'async':
+        run_async_tracker(args.ip, args.port, args.data_dir, args.backlog or 4096)
+    else:
+        run_tracker(args.ip, args.port, args.data_dir, args.backlog or 128)
\ No newline at end of file